@@ -2,11 +2,18 @@
 
 import click
 import glob
+import hashlib
+import json
+import os
 import pickle
 import tqdm
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
+from aproftracer import resultdir
+from aproftracer.rawtrace import HitRecords
+
 COVTOOLS = ["profcov", "acvtool"]
 TOOLS = ["time", "monkey", "droidbot", "fastbot"]
 SKIPNUM=50 # skip every x probe hits to make plots manageable
@@ -23,79 +30,212 @@ class CacheNotFoundError(Exception):
 
 
 # profile coverage cache names
+# profcov caches are a directory per tool: a manifest of the ingested runs and a partial frame per run
+PROFCOV_CACHE_VERSION = 2
+
 def cachename_for_profcov(tool: str):
-    return Path("_cache/") / "profcov" / f"{tool}.pickle"
+    return Path("_cache/") / "profcov" / tool
+
+def resdir_for_profcov(tool: str):
+    return Path(f"../../dynamic/profcov/{tool}/")
 
 def cachename_for_acvtool(tool: str):
     return Path("_cache/") / "acvtool" / f"{tool}.pickle"
 
 
 def _uprobes_to_total_and_cumulative(hit_uprobes):
-    toplot_unique = []
-    toplot_total = []
-    _known_offs = set()
-    _total_probes = 0
-
-    for _, ts, offs in hit_uprobes:
-        _total_probes+=1
-        if _total_probes % SKIPNUM == 1:
-            # total number is a lot, so we batch it in 50s steps
-            toplot_total.append((ts, _total_probes))
-        if offs not in _known_offs:
-            _known_offs.add(offs)
-            toplot_unique.append((ts, len(_known_offs)))
-    
-    tsses_total, total = zip(*toplot_total)
-    tsses_cumulative, cumulative = zip(*toplot_unique)
+    ts = hit_uprobes.time
+    # total number is a lot, so we batch it in 50s steps
+    tsses_total = ts[::SKIPNUM].tolist()
+    total = list(range(1, len(ts) + 1, SKIPNUM))
+
+    # first hit of every probe, in order of the hits
+    _, first_hits = np.unique(hit_uprobes.probe, return_index=True)
+    first_hits.sort()
+    tsses_cumulative = ts[first_hits].tolist()
+    cumulative = list(range(1, len(first_hits) + 1))
     return tsses_total, total, tsses_cumulative, cumulative
 
+def _read_hits(apkdir):
+    """hits and number of tracepoints of a run, only the needed columns are mapped for result directories"""
+    if (apkdir / resultdir.RESULT_DIRNAME).exists():
+        result = resultdir.read_result(apkdir)
+        return result, result.num_tracepoints
+    # results from before the columnar format
+    with open(apkdir / resultdir.PICKLE_NAME, 'rb') as f:
+        profile_info, offsets_info, trace_info, traced_activities, hit_uprobes = pickle.load(f)
+    if not isinstance(hit_uprobes, HitRecords):
+        # results from before hits were saved as records
+        hit_uprobes = HitRecords.from_hit_uprobes(hit_uprobes, trace_info)
+    return hit_uprobes, len(trace_info)
+
+def _run_dirs_profcov(tool):
+    """apkid dirs of all runs that have a result, relative to resdir_for_profcov"""
+    resdir = resdir_for_profcov(tool)
+    for apkdir in sorted(resdir.glob(f"results_{tool}-*/*/")):
+        if (apkdir / resultdir.RESULT_DIRNAME).exists() or (apkdir / resultdir.PICKLE_NAME).exists():
+            yield apkdir.relative_to(resdir)
+
+def _read_run_profcov(apkdir):
+    """partial frame of one run, None if it has no hits"""
+    apkid = apkdir.name
+    runid = int(apkdir.parent.name.split('-')[1])
+    hit_uprobes, num_tracepoints_set = _read_hits(apkdir)
+    if len(hit_uprobes) == 0:
+        return None
+    tsses_total, total, tsses_cumulative, cumulative = _uprobes_to_total_and_cumulative(hit_uprobes)
+
+    # cumulative data first, then total data
+    return pd.DataFrame({
+            'seconds since first probe hit': tsses_cumulative + tsses_total,
+            'cumulative number of unique probes hit': cumulative + [pd.NA] * len(total),
+            'profile coverage': [float(c)/num_tracepoints_set for c in cumulative] + [pd.NA] * len(total),
+            'cumulative number of non-unique probes hit': [pd.NA] * len(cumulative) + total,
+            'app id': [apkid] * (len(cumulative) + len(total)),
+            'run id': [runid] * (len(cumulative) + len(total)),
+        })
+
+_PROFCOV_COLUMNS = [
+        'seconds since first probe hit',
+        'cumulative number of unique probes hit',
+        'profile coverage',
+        'cumulative number of non-unique probes hit',
+        'app id',
+        'run id',
+    ]
+
+def _combine_profcov(frames):
+    if not frames:
+        return pd.DataFrame({c: [] for c in _PROFCOV_COLUMNS})
+    return pd.concat(frames, ignore_index=True)
+
 def read_all_results_profcov(tool):
-    resglob = f"../../dynamic/profcov/{tool}/results_{tool}-*/**/result.pickle"
-    all_tsses = []
-    all_cumulative_total = []
-    all_cumulative_relative = []
-    all_total = []
-    all_appids = []
-    all_runids = []
-    for resfile in tqdm.tqdm(glob.glob(resglob)):
+    """reads every run, without the cache"""
+    resdir = resdir_for_profcov(tool)
+    frames = []
+    for run in tqdm.tqdm(list(_run_dirs_profcov(tool))):
         try:
-            apkid = str(resfile).split('/')[-2]
-            runid = int(str(resfile).split('/')[-3].split('-')[1])
-            with open(resfile, 'rb') as f:
-                profile_info, offsets_info, trace_info, traced_activities, hit_uprobes = pickle.load(f)
-            if len(hit_uprobes) == 0:
+            df = _read_run_profcov(resdir / run)
+        except Exception as e:
+            print(f"ERR on {resdir / run}")
+            raise e
+        if df is not None:
+            frames.append(df)
+    return _combine_profcov(frames)
+
+# the files of a result directory the frame of a run is built from, see _read_hits and _read_run_profcov.
+# a rerun can write the same manifest (same counts and comms) with other hits, so the columns are in it
+_RESULT_DIR_FILES = [resultdir.MANIFEST_NAME, "probe.npy", "time.npy"]
+
+def _result_path(apkdir):
+    """the result of a run, relative paths of it are the cache keys"""
+    if (apkdir / resultdir.RESULT_DIRNAME).exists():
+        return apkdir / resultdir.RESULT_DIRNAME
+    return apkdir / resultdir.PICKLE_NAME
+
+def _result_files(apkdir):
+    """the files whose content identifies the result of a run"""
+    path = _result_path(apkdir)
+    if path.is_dir():
+        return [path / name for name in _RESULT_DIR_FILES]
+    return [path]
+
+def _stat_files(paths):
+    """(total size, newest mtime) of paths"""
+    stats = [p.stat() for p in paths]
+    return sum(st.st_size for st in stats), max(st.st_mtime_ns for st in stats)
+
+def _hash_files(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.name.encode() + b"\0")
+        with open(path, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+    return h.hexdigest()
+
+def _load_profcov_manifest(cachedir):
+    try:
+        with open(cachedir / "manifest.json") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != PROFCOV_CACHE_VERSION:
+        print(f"cache {cachedir} has another version, rebuilding it")
+        return None
+    return manifest
+
+def _save_profcov_manifest(cachedir, manifest):
+    tmp = cachedir / "manifest.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, cachedir / "manifest.json")
+
+def refresh_profcov_cache(tool):
+    """
+    bring the cache of tool up to date with the results on disk: only runs that are new or whose result
+    changed (size and mtime first, then the content hash) are read, frames of removed runs are dropped.
+    """
+    cachedir = cachename_for_profcov(tool)
+    (cachedir / "runs").mkdir(parents=True, exist_ok=True)
+    manifest = _load_profcov_manifest(cachedir) or {'version': PROFCOV_CACHE_VERSION, 'runs': {}}
+    resdir = resdir_for_profcov(tool)
+
+    runs = {}
+    todo = []
+    for run in _run_dirs_profcov(tool):
+        key = str(run)
+        path = _result_path(resdir / run)
+        files = _result_files(resdir / run)
+        size, mtime = _stat_files(files)
+        entry = manifest['runs'].get(key)
+        if entry is not None and entry['path'] == str(path.relative_to(resdir)) and entry['size'] == size:
+            if entry['mtime'] == mtime:
+                runs[key] = entry
                 continue
-            tsses_total, total, tsses_cumulative, cumulative = _uprobes_to_total_and_cumulative(hit_uprobes)
-            num_tracepoints_set = len(trace_info)
-
-            # add cumulative data
-            all_tsses.extend(tsses_cumulative)
-            all_cumulative_total.extend(cumulative)
-            all_cumulative_relative.extend([float(c)/num_tracepoints_set for c in cumulative])
-            all_appids.extend([apkid for _ in range(len(cumulative))])
-            all_runids.extend([runid for _ in range(len(cumulative))])
-            all_total.extend([pd.NA for _ in range(len(cumulative))])
-            
-            # add total data
-            all_tsses.extend(tsses_total)
-            all_total.extend(total)
-            all_appids.extend([apkid for _ in range(len(total))])
-            all_runids.extend([runid for _ in range(len(total))])
-            all_cumulative_total.extend([pd.NA for _ in range(len(total))])
-            all_cumulative_relative.extend([pd.NA for _ in range(len(total))])
+            # touched, but maybe not changed
+            if entry['hash'] == _hash_files(files):
+                runs[key] = dict(entry, mtime=mtime)
+                continue
+        todo.append((key, run, path, files, size, mtime))
+
+    if todo:
+        print(f"reading {len(todo)} new or changed '{tool}' runs, {len(runs)} cached")
+    for key, run, path, files, size, mtime in tqdm.tqdm(todo, disable=not todo):
+        try:
+            df = _read_run_profcov(resdir / run)
         except Exception as e:
-            print(f"ERR on {resfile}")
+            print(f"ERR on {resdir / run}")
             raise e
-    
-    df = pd.DataFrame({
-            'seconds since first probe hit': all_tsses,
-            'cumulative number of unique probes hit': all_cumulative_total,
-            'profile coverage': all_cumulative_relative,
-            'cumulative number of non-unique probes hit': all_total,
-            'app id': all_appids,
-            'run id': all_runids
-        })
-    return df
+        frame = None
+        if df is not None:
+            frame = f"{hashlib.sha256(key.encode()).hexdigest()}.pickle"
+            df.to_pickle(cachedir / "runs" / frame)
+        runs[key] = {
+                'path': str(path.relative_to(resdir)),
+                'size': size,
+                'mtime': mtime,
+                'hash': _hash_files(files),
+                'frame': frame,
+            }
+
+    # frames of runs that are gone
+    frames = {entry['frame'] for entry in runs.values()}
+    for entry in manifest['runs'].values():
+        if entry['frame'] is not None and entry['frame'] not in frames:
+            (cachedir / "runs" / entry['frame']).unlink(missing_ok=True)
+
+    manifest['runs'] = runs
+    _save_profcov_manifest(cachedir, manifest)
+    return manifest
+
+def _load_profcov_cache(tool, manifest):
+    """the combined frame of all cached runs, only assembled here"""
+    cachedir = cachename_for_profcov(tool)
+    frames = [pd.read_pickle(cachedir / "runs" / entry['frame']) for entry in manifest['runs'].values() if entry['frame'] is not None]
+    results = _combine_profcov(frames)
+    print(f" loaded '{tool}' results for {results['app id'].nunique()} apps and {results['run id'].nunique()} runs from cache!")
+    return results
 
 def _read_from_cache(tool, cachepath):
     print(f"loading '{tool}' from cache!")
@@ -104,26 +244,22 @@ def _read_from_cache(tool, cachepath):
     return results
 
 def read_from_cache_or_generate_profcov(tool):
-    cachepath = cachename_for_profcov(tool)
-    if not cachepath.exists():
-        print(f"no cache found, loading '{tool}' from raw data")
-        results = read_all_results_profcov(tool)
-        if results['app id'].nunique() != 0:
-            results.to_pickle(cachepath)
-        else:
-            print("error: raw data contained 0 results")
-    else:
-        results = _read_from_cache(tool, cachepath)
+    """updates the cache with new or changed runs first, see refresh_profcov_cache"""
+    manifest = refresh_profcov_cache(tool)
+    results = _load_profcov_cache(tool, manifest)
+    if results['app id'].nunique() == 0:
+        print("error: raw data contained 0 results")
     return results
 
 def read_from_cache_profcov(tool):
-    cachepath = cachename_for_profcov(tool)
-    if not cachepath.exists():
+    """the cache as it is, without looking for new runs"""
+    cachedir = cachename_for_profcov(tool)
+    manifest = _load_profcov_manifest(cachedir)
+    if manifest is None:
         print(f"ERROR: no cache found for {tool}")
         raise CacheNotFoundError()
-    else:
-        results = _read_from_cache(tool, cachepath)
-    return results
+    print(f"loading '{tool}' from cache!")
+    return _load_profcov_cache(tool, manifest)
 
 def read_all_results_acvtool(tool):
     appids = []
@@ -187,7 +323,8 @@ def read_from_cache_acvtool(tool):
 def main(covtool, tool):
     """
     computing profile coverage caches takes ~15GB and 5m per tool,
-        fastbot more like ~30GB and 30min and takes longer
+        fastbot more like ~30GB and 30min and takes longer.
+    after that only new or changed runs are read.
     """
     if covtool == "all":
         covtools = COVTOOLS
@@ -14,6 +14,8 @@ import shelve
 import traceback
 from multiprocessing import Pool
 
+from aproftracer import prof
+
 
 ALL_DAILY_DIR = Path("/mnt/SecPrivSt1/playstorescraper/2025-03-aot-scrapes/")
 
@@ -284,7 +286,7 @@ uid = sh.id("-u").strip()
 gid = sh.id("-g").strip()
 
 def cached_profdump(profpath, cloud=True):
-    """return location of profdump but its a hashfile"""
+    """return location of profdump but its a hashfile. the analysis decodes profiles in process now (cached_profile_txt_to_json), this is kept to compare against profman"""
     prof_hash = get_filehash(profpath)
     prof_hash_path = PROF_HASH_CACHE / prof_hash
     if prof_hash_path.exists():
@@ -351,17 +353,7 @@ def _profile_txt_to_json(profdumppath):
             # demarks new dexfile entry
             elif "[index=" in line:
                 parts = line.split(" ")
-                raw_dex = parts[0]
-                # the first dex file can be either implied or explicit
-                if raw_dex == "base.apk" or raw_dex == "classes.dex":
-                    current_dex = 1
-                else:
-                    # all others are always base.apk!classesN.dex
-                    current_dex = int(
-                        raw_dex.removeprefix("base.apk!")
-                        .removeprefix("classes")
-                        .removesuffix(".dex")
-                    )
+                current_dex = _dex_number(parts[0])
                 profile_json[current_dex] = {}
             # parse the different method classifications
             elif line.startswith("hot methods:") and line != "hot methods:":
@@ -388,18 +380,51 @@ def _profile_txt_to_json(profdumppath):
                 )
     return profile_json
 
+def _dex_number(raw_dex):
+    # the first dex file can be either implied or explicit
+    if raw_dex == "base.apk" or raw_dex == "classes.dex":
+        return 1
+    # all others are always base.apk!classesN.dex
+    return int(
+        raw_dex.removeprefix("base.apk!")
+        .removeprefix("classes")
+        .removesuffix(".dex")
+    )
+
+def _prof_to_json(profpath):
+    """same as _profile_txt_to_json, but decodes the binary profile in process instead of going through profman"""
+    profile_json = {}
+    for dex in prof.read_prof(profpath):
+        current_dex = _dex_number(dex["key"])
+        profile_json[current_dex] = {}
+        # like in the dump, empty categories are left out
+        for name, key in (("hot", "hot"), ("startup", "startup"), ("post", "poststartup"), ("classes", "classes")):
+            if dex[key]:
+                profile_json[current_dex][name] = sorted(dex[key])
+    return profile_json
+
 def cached_profile_txt_to_json(apkdir, cloud=True):
-    profdumppath = cached_get_profdump_path(apkdir, cloud)
-    if not profdumppath or not profdumppath.exists():
+    """profile as json, decoded from the cloud or baseline prof. was going through a profdump, hence the name"""
+    if cloud:
+        profpath = get_cache_profile_cloud_dir(apkdir) / IN_DM_CLOUDPROFILE_PATH
+    else:
+        profpath = get_cache_profile_baseline_dir(apkdir) / IN_APK_BASELINE_PATH
+    if not profpath.exists():
         return None
-    
-    profile_json_path = PROFILEJSON_CACHE / f"{get_filehash(profdumppath)}"
+
+    # keyed by the hash of the prof, not the profdump, so old entries are never confused for these
+    profile_json_path = PROFILEJSON_CACHE / f"prof-{get_filehash(profpath)}"
 
     if profile_json_path.exists():
         with open(profile_json_path) as f:
             return json.load(f)
 
-    profile_json = _profile_txt_to_json(profdumppath)
+    try:
+        profile_json = _prof_to_json(profpath)
+    except:
+        _, apkid = get_date_apkid(apkdir)
+        print(f"error decoding {'cloud' if cloud else 'baseline'} profile for {apkid}")
+        raise
 
     with open(profile_json_path, "w") as f:
         json.dump(profile_json, f)
@@ -417,11 +442,11 @@ def _prep_all(apkdir):
     except:
         print(f"failed to extract prof for {apkdir}")
     try:
-        cached_get_profdump_path(apkdir, cloud=False)
+        cached_profile_txt_to_json(apkdir, cloud=False)
     except:
         print(f"failed to get baseline prof for {apkdir}")
     try:
-        cached_get_profdump_path(apkdir, cloud=True)
+        cached_profile_txt_to_json(apkdir, cloud=True)
     except:
         print(f"failed to get cloud prof for {apkdir}")
     return None 
@@ -14,10 +14,13 @@ _ch.setFormatter(
 # adds the handler to the global variable: log
 log.addHandler(_ch)
 
+from adbdevice.adbclient import AdbClient, AdbError  # noqa: F401 E402
 from adbdevice.adbdevice import (  # noqa: F401 E402
+    BACKENDS,
     AdbDevice,
     AdbRootDevice,
     SuRootDevice,
     check_device_ok,
     run_cmd,
 )
+from adbdevice.shellsession import ShellSessionError  # noqa: F401 E402
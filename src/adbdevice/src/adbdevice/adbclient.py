@@ -0,0 +1,223 @@
+"""
+client for the adb host protocol, talks to the local adb server socket directly instead of forking the adb binary.
+
+every request is a connection to the server (localhost:5037 or ANDROID_ADB_SERVER_PORT): a 4 digit hex
+length and the request, answered with OKAY or FAIL and a length prefixed message. host:transport:<serial>
+binds the connection to a device, after that the next request is a service on the device:
+- shell,v2,raw:<cmd> is the shell protocol v2 (android 7+), packets of a 1 byte id, a 4 byte little endian
+  length and the data, so stdout, stderr and the exit code come separately.
+- exec:<cmd> is the raw output of the command until the connection closes, like adb exec-out.
+- sync: is the file sync protocol, requests and replies are a 4 byte id and a 4 byte little endian length
+  (or other u32 fields), files go in DATA chunks of at most 64k, streamed from and to disk.
+see packages/modules/adb/SERVICES.TXT, SYNC.TXT and shell_protocol.h in aosp.
+"""
+import logging
+import os
+import socket
+import struct
+import time
+from pathlib import Path
+
+_DEFAULT_PORT = 5037
+_SYNC_DATA_MAX = 64 * 1024
+
+# shell protocol v2 packet ids
+_SHELL_STDIN = 0
+_SHELL_STDOUT = 1
+_SHELL_STDERR = 2
+_SHELL_EXIT = 3
+_SHELL_CLOSE_STDIN = 4
+
+log = logging.getLogger(__name__)
+
+
+class AdbError(RuntimeError):
+    pass
+
+
+def _server_address():
+    return ("127.0.0.1", int(os.environ.get("ANDROID_ADB_SERVER_PORT", _DEFAULT_PORT)))
+
+
+class _Connection:
+    def __init__(self, address, timeout=None):
+        self.sock = socket.create_connection(address, timeout=timeout)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_exact(self, n):
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise AdbError(f"connection closed, expected {n - len(buf)} more bytes")
+            buf += chunk
+        return bytes(buf)
+
+    def read_all(self):
+        chunks = []
+        while chunk := self.sock.recv(_SYNC_DATA_MAX):
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def send_request(self, request):
+        data = request.encode()
+        self.sock.sendall(b"%04x" % len(data) + data)
+        self.read_status(request)
+
+    def read_status(self, request):
+        status = self.read_exact(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            length = int(self.read_exact(4), 16)
+            raise AdbError(f"{request}: {self.read_exact(length).decode(errors='replace')}")
+        raise AdbError(f"{request}: unexpected reply {status!r}")
+
+    # sync protocol
+    def send_sync(self, sync_id, data=b""):
+        self.sock.sendall(sync_id + struct.pack("<I", len(data)) + data)
+
+    def read_sync(self):
+        sync_id = self.read_exact(4)
+        (value,) = struct.unpack("<I", self.read_exact(4))
+        return sync_id, value
+
+
+class AdbClient:
+    """one device behind the local adb server"""
+
+    def __init__(self, serial_number, address=None, timeout=None):
+        self.serial_number = serial_number
+        self.address = address or _server_address()
+        self.timeout = timeout
+        # what the same call would look like with the adb binary, for error messages
+        self.argv = ["adb", "-s", serial_number, "shell"]
+
+    def _host(self, request):
+        """a host request that answers with a length prefixed string"""
+        with _Connection(self.address, self.timeout) as conn:
+            conn.send_request(request)
+            length = int(conn.read_exact(4), 16)
+            return conn.read_exact(length).decode()
+
+    def _service(self, service):
+        conn = _Connection(self.address, self.timeout)
+        try:
+            conn.send_request(f"host:transport:{self.serial_number}")
+            conn.send_request(service)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def features(self):
+        return set(self._host(f"host-serial:{self.serial_number}:features").split(","))
+
+    def run(self, command):
+        """run the command line in a shell on the device, returns (exit code, stdout, stderr), like ShellSession.run"""
+        exit_code, stdout, stderr = self.shell(command)
+        return exit_code, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+    def shell(self, command):
+        """shell protocol v2, returns (exit code, stdout bytes, stderr bytes)"""
+        with self._service(f"shell,v2,raw:{command}") as conn:
+            # nothing on stdin, commands reading it get eof right away
+            conn.sock.sendall(struct.pack("<BI", _SHELL_CLOSE_STDIN, 0))
+            stdout, stderr = [], []
+            while True:
+                packet_id, length = struct.unpack("<BI", conn.read_exact(5))
+                data = conn.read_exact(length)
+                if packet_id == _SHELL_STDOUT:
+                    stdout.append(data)
+                elif packet_id == _SHELL_STDERR:
+                    stderr.append(data)
+                elif packet_id == _SHELL_EXIT:
+                    return data[0], b"".join(stdout), b"".join(stderr)
+
+    def exec_out(self, command):
+        """raw stdout of the command, like adb exec-out"""
+        with self._service(f"exec:{command}") as conn:
+            return conn.read_all()
+
+    def stat(self, remote):
+        """(mode, size, mtime) of a file on the device, all 0 if it doesn't exist"""
+        remote = str(remote).encode()
+        with self._service("sync:") as conn:
+            conn.send_sync(b"STAT", remote)
+            reply = conn.read_exact(16)
+            conn.send_sync(b"QUIT")
+        if reply[:4] != b"STAT":
+            raise AdbError(f"stat {remote}: unexpected reply {reply[:4]!r}")
+        return struct.unpack("<III", reply[4:])
+
+    def pull(self, remote, local):
+        """streams a file from the device to local, which can be a directory like for adb pull"""
+        local = Path(local)
+        if local.is_dir():
+            local = local / Path(str(remote)).name
+        with self._service("sync:") as conn:
+            conn.send_sync(b"RECV", str(remote).encode())
+            with open(local, "wb") as f:
+                while True:
+                    sync_id, length = conn.read_sync()
+                    if sync_id == b"DATA":
+                        f.write(conn.read_exact(length))
+                    elif sync_id == b"DONE":
+                        break
+                    elif sync_id == b"FAIL":
+                        message = conn.read_exact(length).decode(errors="replace")
+                        f.close()
+                        local.unlink()
+                        raise AdbError(f"pull {remote}: {message}")
+                    else:
+                        raise AdbError(f"pull {remote}: unexpected reply {sync_id!r}")
+            conn.send_sync(b"QUIT")
+        return local
+
+    def push(self, local, remote, mode=0o644):
+        """streams a local file to remote, which can be a directory like for adb push"""
+        local = Path(local)
+        remote = str(remote)
+        if remote.endswith("/"):
+            remote += local.name
+        with self._service("sync:") as conn:
+            conn.send_sync(b"SEND", f"{remote},{mode}".encode())
+            with open(local, "rb") as f:
+                while chunk := f.read(_SYNC_DATA_MAX):
+                    conn.send_sync(b"DATA", chunk)
+            conn.sock.sendall(b"DONE" + struct.pack("<I", int(local.stat().st_mtime)))
+            sync_id, length = conn.read_sync()
+            if sync_id == b"FAIL":
+                raise AdbError(f"push {remote}: {conn.read_exact(length).decode(errors='replace')}")
+            if sync_id != b"OKAY":
+                raise AdbError(f"push {remote}: unexpected reply {sync_id!r}")
+            conn.send_sync(b"QUIT")
+
+    def root(self, timeout=60):
+        """restart adbd as root, like adb root, and wait for the device to come back"""
+        with self._service("root:") as conn:
+            message = conn.read_all().decode(errors="replace").strip()
+        log.debug(f"root: {message}")
+        if "already running as root" in message:
+            return
+        if "restarting" not in message:
+            raise AdbError(f"root: {message}")
+        # the device drops off and comes back, wait until a shell works again
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(1)
+            try:
+                if self.shell("id -u")[1].strip() == b"0":
+                    return
+            except (AdbError, OSError):
+                pass
+            if time.monotonic() > deadline:
+                raise AdbError(f"root: device not back after {timeout}s")
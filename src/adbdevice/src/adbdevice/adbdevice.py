@@ -11,6 +11,12 @@ import sh
 from lxml import etree
 from sh import adb
 
+from adbdevice.adbclient import AdbClient, AdbError
+from adbdevice.shellsession import SessionCommand, ShellSession
+
+# how to talk to the device: the adb binary, or the adb server socket directly, see adbclient.py
+BACKENDS = ["binary", "socket"]
+
 
 def check_device_ok(device_id: str):
     """check if the device is listed in adb and authorized, else raise RunTimeError"""
@@ -22,8 +28,13 @@ def check_device_ok(device_id: str):
             raise RuntimeError(f"device-id '{device_id}' has not authorized us")
 
 
+def attached_devices():
+    """serials of the devices adb lists as ready, not offline or unauthorized ones"""
+    return _undevices(str(sh.adb("devices")))
+
+
 class AdbDevice:
-    def __init__(self, serial_number: str, logger=None):
+    def __init__(self, serial_number: str, logger=None, persistent_shell=False, backend=BACKENDS[0]):
         if logger is None:
             self.log = logging.getLogger(__name__)
             self.log.setLevel(logging.WARNING)
@@ -63,6 +74,17 @@ class AdbDevice:
         # set up bootstrap functions
         self.adb = adb.bake("-s", serial_number)
         self.shell = self.adb.bake("shell")
+        if backend not in BACKENDS:
+            raise NotImplementedError(f"unknown backend {backend}")
+        self.client = None
+        if backend == "socket":
+            self.client = AdbClient(serial_number)
+            self.shell = SessionCommand(self.client)
+        # one long lived adb shell for all shell calls instead of an adb process each, see shellsession.py
+        self._sessions = []
+        if persistent_shell:
+            self.shell = SessionCommand(self._new_session(["adb", "-s", serial_number, "shell"]))
+        self._ro_props = None  # see getprop
         version_sdk = self.getprop("ro.build.version.sdk")
 
         # set up AIDL codes
@@ -91,6 +113,9 @@ class AdbDevice:
         # set up other adb functions
         self.pull = self.adb.bake("pull")
         self.push = self.adb.bake("push")
+        if self.client is not None:
+            self.pull = _adb_exit_code(self.client.pull, "pull")
+            self.push = _adb_exit_code(self.client.push, "push")
 
         # set up other shell functions
         self.am = self.shell.bake("am")
@@ -110,6 +135,16 @@ class AdbDevice:
             self.aidl_codes["isKeyguardLocked"] = "30"
             # for some godforsaken reason, it is different on that build, and probably on future ones...
 
+    def _new_session(self, argv, **kwargs):
+        session = ShellSession(argv, log=self.log, **kwargs)
+        self._sessions.append(session)
+        return session
+
+    def close_sessions(self):
+        """stop the persistent shells, if any. they are started again by the next call"""
+        for session in self._sessions:
+            session.close()
+
     def wait(self, amount=None):
         if amount is None:
             amount = self.input_wait
@@ -154,6 +189,12 @@ class AdbDevice:
         # time.sleep(self.input_wait)  # shouldn't really be necessary...
 
     def getprop(self, prop: str):
+        # ro. properties don't change until the next boot, one getprop lists all of them
+        if prop.startswith("ro."):
+            if self._ro_props is None:
+                self._ro_props = {k: v for k, v in _unprop(self.shell("getprop")).items() if k.startswith("ro.")}
+            if prop in self._ro_props:
+                return self._ro_props[prop]
         return self.shell("getprop", prop).strip()
 
     def install(self, appid: str):
@@ -332,6 +373,7 @@ class AdbDevice:
         return _unpackage(packages)
 
     def reboot(self):
+        self._ro_props = None  # could come back with another build
         self.shell("reboot")
 
     def rm(self, *args):
@@ -420,8 +462,8 @@ class AdbDevice:
 # abstract class, don't use!
 # (can't be asked to do proper abstract classing right now)
 class AbstractRootDevice(AdbDevice):
-    def __init__(self, serial_number: str):
-        super().__init__(serial_number)
+    def __init__(self, serial_number: str, persistent_shell=False, backend=BACKENDS[0]):
+        super().__init__(serial_number, persistent_shell=persistent_shell, backend=backend)
         # could be easily created on a non-root device, it just doesn't really make sense
         self.device_push_path = "/storage/emulated/0/ProfmanData/"
         self.apk_push_path = self.device_push_path + "base.apk"
@@ -481,21 +523,44 @@ class AbstractRootDevice(AdbDevice):
 
 
 class SuRootDevice(AbstractRootDevice):
-    def __init__(self, serial_number: str):
-        super().__init__(serial_number)
-        self.root_shell = self.shell.bake("su", "-c")
+    def __init__(self, serial_number: str, persistent_shell=False, backend=BACKENDS[0]):
+        super().__init__(serial_number, persistent_shell=persistent_shell, backend=backend)
+        if persistent_shell:
+            # a shell that stays su, commands are evaluated twice like `su -c` in the device shell does
+            root_session = self._new_session(["adb", "-s", serial_number, "shell", "su"], evaluate_twice=True)
+            self.root_shell = SessionCommand(root_session)
+        else:
+            self.root_shell = self.shell.bake("su", "-c")
 
 
 class AdbRootDevice(AbstractRootDevice):
-    def __init__(self, serial_number: str):
-        super().__init__(serial_number)
-        self.adb("root")  # just do everything in a root shell
+    def __init__(self, serial_number: str, persistent_shell=False, backend=BACKENDS[0]):
+        super().__init__(serial_number, persistent_shell=persistent_shell, backend=backend)
+        # just do everything in a root shell
+        if self.client is not None:
+            self.client.root()
+        else:
+            self.adb("root")
+        # adbd restarted as root, the next call starts a new (root) session
+        self.close_sessions()
         self.root_shell = self.shell
 
 
 # UTIL FUNCTIONS
 
 
+def _adb_exit_code(func, name):
+    """raise AdbErrors of func as sh.ErrorReturnCode_1, like the adb binary exits, so callers can stay the same"""
+
+    def wrapper(*args):
+        try:
+            return func(*args)
+        except AdbError as e:
+            raise sh.ErrorReturnCode_1(f"adb {name} {' '.join(map(str, args))}", b"", str(e).encode()) from e
+
+    return wrapper
+
+
 def _unparcel(parcel: str):  # extracts the bytes in a Parcel
     # assumes a specific amount of dots, which is not true for longer parcels!
     # should probably fix up the regex parser...
@@ -515,6 +580,14 @@ def _unbound(bounds: str):
     return re.match(r"\[(\d*),(\d*)\]\[(\d*),(\d*)\]", bounds).groups()
 
 
+def _unprop(props: str):  # parses the "[name]: [value]" lines of getprop
+    return dict(re.findall(r"^\[([^\]]*)\]: \[(.*)\]\r?$", props, re.MULTILINE))
+
+
+def _undevices(devices: str):  # parses the "serial\tstate" lines of adb devices
+    return re.findall(r"^(\S+)\tdevice\r?$", devices, re.MULTILINE)
+
+
 def _unpackage(packages):
     # could also be regexed
     return [x.removeprefix("package:") for x in packages.splitlines()]
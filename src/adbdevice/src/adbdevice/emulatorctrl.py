@@ -6,14 +6,29 @@ from pathlib import Path
 import sh
 import tomllib
 
-from adbdevice import AdbRootDevice, run_cmd
+from adbdevice import run_cmd
 
 log = logging.getLogger(__name__)
 
 
+# how long a boot or a snapshot load may take until sys.boot_completed is set
+_BOOT_TIMEOUT = 300
+
+
 class BootNotCompletedInTimeException(Exception):
     pass
 
+
+def avd_names(list_output):
+    """names of the avds in the output of `avdmanager list avd`, from its `Name: <name>` lines"""
+    names = set()
+    for line in list_output.splitlines():
+        key, sep, value = line.strip().partition(":")
+        if sep and key == "Name":
+            names.add(value.strip())
+    return names
+
+
 class EmulatorCTRL:
     def __init__(self, sysimage="system-images;android-34;google_apis;x86_64", name="a34_tracer", device="pixel_6a", port=5560, use_adb_root=True, slot=0, verbose=False):
         if "ANDROID_SDK_HOME" not in os.environ:
@@ -67,7 +82,8 @@ class EmulatorCTRL:
             log.error(f"stderr: \n{stderr}")
             raise NotImplementedError("failed to list avd")
 
-        if self.name in stdout.decode("utf-8"):
+        # whole names, slot 0 a34_tracer is a prefix of slot 2 a34_tracer_2
+        if self.name in avd_names(stdout.decode("utf-8")):
             if force:
                 cmd = f"~/android/sdk/cmdline-tools/latest/bin/avdmanager delete avd -n {self.name}"
                 log.info("avd found, deleting")
@@ -111,36 +127,52 @@ class EmulatorCTRL:
         # sh is being silly but no time to fix, TODO rewrite with subprocess
         return sh.sh("-c", f"~/android/sdk/emulator/emulator {cmd}", _out=_out, _bg=_bg)
 
-    def start_and_wait_in_background(self):
-        log.debug(f"running something like: ~/android/sdk/emulator/emulator @{self.name} -port {self.port} -feature -Vulkan")
-        self._proc_emu = self.emulator(f"@{self.name} -port {self.port} -feature -Vulkan", _bg=True, _out=lambda x: self._startcallback(x)) # for sw rendering, more stable on some devicesa
+    def start_and_wait_in_background(self, save_snapshot_on_exit=True):
+        """boot the emulator and wait until android has finished booting"""
+        options = f"@{self.name} -port {self.port} -feature -Vulkan" # for sw rendering, more stable on some devicesa
+        if not save_snapshot_on_exit:
+            options += " -no-snapshot-save"
+        log.debug(f"running something like: ~/android/sdk/emulator/emulator {options}")
+        self._ready = False
+        self._boot_type = None
+        self._proc_emu = self.emulator(options, _bg=True, _out=lambda x: self._startcallback(x))
         log.info("started emulator, waiting for boot complete")
-        # maybe use https://cs.android.com/search?q=exec-out ?
-        while not self._ready:
-            time.sleep(1)
+        self.wait_boot_completed()
         if self._boot_type == "cold":
             log.info("cold boot complete")
         elif self._boot_type == "snapshot":
             log.info("snapshot boot complete")
-        log.info("waiting for up to 30 sec to run adb")
-        adbdev = AdbRootDevice(self.get_device_name())
-        grace = 30
-        while grace > 0:
-            time.sleep(1)
-            grace -= 1
+
+    def wait_boot_completed(self, timeout=_BOOT_TIMEOUT):
+        """wait until adb reaches the device and android reports sys.boot_completed, instead of fixed sleeps"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._proc_emu is not None and not self._proc_emu.is_alive():
+                raise BootNotCompletedInTimeException("emulator exited during boot")
             try:
-                r = adbdev.shell("echo hello there general kenobi")
-                if "hello there general kenobi" in r:
-                    log.info(" .. done, device can be reached via adb!")
-                    break
-            except sh.ErrorReturnCode_1:
-                pass
-        if self._boot_type == "cold":
-            log.info("cold boot detected, letting the emulator settle for 30s")
-            time.sleep(30)
-        if grace <= 0:
-            log.critical("boot grace period timed out")
-            raise BootNotCompletedInTimeException()
+                if sh.adb("-s", self.get_device_name(), "shell", "getprop", "sys.boot_completed").strip() == "1":
+                    log.info(" .. done, device booted and can be reached via adb!")
+                    return
+            except sh.ErrorReturnCode:
+                pass # not listed in adb yet, or still offline
+            time.sleep(0.5)
+        log.critical(f"boot not completed within {timeout}s")
+        raise BootNotCompletedInTimeException()
+
+    def snapshot_save(self, snapshot):
+        """save the running state as snapshot, through the emulator console"""
+        log.info(f"saving snapshot {snapshot} of {self.get_device_name()}")
+        out = sh.adb("-s", self.get_device_name(), "emu", "avd", "snapshot", "save", snapshot)
+        if "KO" in out:
+            raise NotImplementedError(f"saving snapshot {snapshot} failed: {out.strip()}")
+
+    def snapshot_load(self, snapshot, timeout=_BOOT_TIMEOUT):
+        """go back to snapshot, the emulator keeps running. waits until the device is usable again"""
+        log.info(f"loading snapshot {snapshot} on {self.get_device_name()}")
+        out = sh.adb("-s", self.get_device_name(), "emu", "avd", "snapshot", "load", snapshot)
+        if "KO" in out:
+            raise NotImplementedError(f"loading snapshot {snapshot} failed: {out.strip()}")
+        self.wait_boot_completed(timeout)
 
     def shutdown_and_wait(self):
         log.debug("shutting down emulator")
@@ -0,0 +1,159 @@
+"""
+a pool of warm emulators, handed out through leases.
+
+recreating the avd and cold booting it for every app costs minutes. a pool boots its emulators once,
+saves a clean snapshot of each after the first boot and then only loads that snapshot again before an
+instance is leased out, a few seconds. the snapshot is taken of the running system, so whatever an app
+run changed (installs, tracefs, files) is gone after the load, no reboot needed.
+
+    pool = EmulatorPool.from_config("emu.toml", size=4)
+    pool.start()
+    with pool.lease() as emu:
+        ... emu.get_device_name() is clean and booted ...
+    pool.shutdown()
+
+an instance whose snapshot load fails is booted again from scratch (cold, with a new clean snapshot)
+before it is handed out. an instance that does not boot, in start or after a failed load in lease, is
+shut down and dropped from the pool, ready() lists the ones that are left.
+"""
+import contextlib
+import logging
+import queue
+import threading
+
+from adbdevice.emulatorctrl import EmulatorCTRL
+
+log = logging.getLogger(__name__)
+
+CLEAN_SNAPSHOT = "aproftracer_clean"
+
+
+class EmulatorPool:
+    def __init__(self, emulators, snapshot=CLEAN_SNAPSHOT):
+        self.emulators = {emu.get_device_name(): emu for emu in emulators}
+        self.snapshot = snapshot
+        self._free = []
+        self._cond = threading.Condition()
+        # avdmanager lists, deletes and creates in the one avd folder all instances share, not in parallel
+        self._avd_lock = threading.Lock()
+
+    @staticmethod
+    def from_config(cfg_file, size, verbose=False):
+        """size emulators of the config, each on its own ports. console ports have to be even, adb takes the odd one"""
+        return EmulatorPool([EmulatorCTRL.from_config(cfg_file, slot=2 * i, verbose=verbose) for i in range(size)])
+
+    def _boot(self, emu):
+        # the snapshot of the pool is saved explicitly, quickboot must not overwrite anything on exit
+        emu.start_and_wait_in_background(save_snapshot_on_exit=False)
+        emu.snapshot_save(self.snapshot)
+
+    def _recreate(self, emu):
+        with self._avd_lock:
+            emu.recreate(force=True)
+
+    def _boot_clean(self, emu):
+        self._recreate(emu)
+        self._boot(emu)
+
+    def start(self):
+        """recreate every emulator, one after the other, then boot them in parallel and take their clean snapshots"""
+        failed = []
+        created = []
+        for emu in self.emulators.values():
+            try:
+                self._recreate(emu)
+            except Exception as e:
+                log.error(f"recreating {emu.get_device_name()} failed, dropping it from the pool: {e}")
+                failed.append(emu)
+                continue
+            created.append(emu)
+
+        def boot(emu):
+            try:
+                self._boot(emu)
+            except Exception as e:
+                log.error(f"booting {emu.get_device_name()} failed, dropping it from the pool: {e}")
+                failed.append(emu)
+                return
+            with self._cond:
+                self._free.append(emu.get_device_name())
+                self._cond.notify_all()
+
+        threads = [threading.Thread(target=boot, args=(emu,)) for emu in created]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for emu in failed:
+            self._drop(emu)
+        if not self._free:
+            raise NotImplementedError("no emulator of the pool booted")
+        log.info(f"{len(self._free)}/{len(self.emulators) + len(failed)} emulators of the pool ready")
+
+    def ready(self):
+        """device names of the emulators that booted, the ones lease hands out"""
+        return list(self.emulators)
+
+    def _restore(self, emu):
+        try:
+            emu.snapshot_load(self.snapshot)
+        except Exception as e:
+            log.warning(f"loading the clean snapshot of {emu.get_device_name()} failed ({e}), booting it again")
+            emu.shutdown_and_wait()
+            self._boot_clean(emu)
+
+    def _drop(self, emu):
+        """shut emu down and remove it from the pool, it is not handed out again"""
+        try:
+            emu.shutdown_and_wait()
+        except Exception as e:
+            log.warning(f"shutting down {emu.get_device_name()} failed: {e}")
+        with self._cond:
+            del self.emulators[emu.get_device_name()]
+            # waiters for this one would never get it
+            self._cond.notify_all()
+
+    def _acquire(self, device_name, timeout):
+        def available():
+            # a dropped instance would never come free, the wait ends to raise
+            if device_name is None:
+                return self._free or not self.emulators
+            return device_name in self._free or device_name not in self.emulators
+
+        with self._cond:
+            if not self._cond.wait_for(available, timeout):
+                raise queue.Empty(f"no emulator free within {timeout}s")
+            if device_name is not None and device_name not in self.emulators:
+                raise KeyError(f"{device_name} is not in the pool")
+            if not self.emulators:
+                raise NotImplementedError("no emulator left in the pool")
+            name = device_name if device_name is not None else self._free[0]
+            self._free.remove(name)
+            return self.emulators[name]
+
+    def _release(self, emu):
+        with self._cond:
+            self._free.append(emu.get_device_name())
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def lease(self, device_name=None, timeout=None):
+        """
+        a free emulator (or the one with device_name), restored to the clean snapshot, for the with block.
+        it goes back to the pool afterwards, whatever the run did to it. if it can't be restored it is
+        dropped from the pool and the error raised.
+        """
+        emu = self._acquire(device_name, timeout)
+        try:
+            self._restore(emu)
+        except Exception:
+            self._drop(emu)
+            raise
+        try:
+            yield emu
+        finally:
+            self._release(emu)
+
+    def shutdown(self):
+        for emu in self.emulators.values():
+            emu.shutdown_and_wait()
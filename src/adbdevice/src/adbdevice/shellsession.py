@@ -0,0 +1,159 @@
+"""
+persistent shell session, so shell and root_shell calls don't fork adb (and su) for every command.
+
+one long lived `adb shell` (or `adb shell su`) gets the commands on its stdin. every command runs in a
+fresh `sh -c` on the device, like a separate `adb shell` would, and is followed by a sentinel line with
+its exit code on stdout and one on stderr, so the output of every command can be cut out of the streams.
+two reader threads move the lines to queues, which is what gives calls a timeout. calls from several
+threads are serialized, and if the session died (adb root, reboot, usb hiccup) it is restarted with the
+next command.
+"""
+import contextlib
+import logging
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import threading
+import uuid
+
+import sh
+
+_SENTINEL = "__ADBDEVICE_SESSION__"
+
+
+class ShellSessionError(RuntimeError):
+    pass
+
+
+def _read_lines(stream, lines):
+    for line in iter(stream.readline, b""):
+        lines.put(line)
+    lines.put(None)
+
+
+class ShellSession:
+    """
+    argv starts the shell, e.g. ["adb", "-s", serial, "shell"].
+    evaluate_twice runs commands through eval first, like `su -c` after the device shell parsed the words once.
+    """
+
+    def __init__(self, argv, evaluate_twice=False, timeout=None, log=None):
+        self.argv = list(argv)
+        self.evaluate_twice = evaluate_twice
+        self.timeout = timeout
+        self.log = log or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._proc = None
+
+    def _start(self):
+        self.log.debug(f"starting shell session {' '.join(self.argv)}")
+        self._proc = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+        self._stdout = queue.Queue()
+        self._stderr = queue.Queue()
+        for stream, lines in ((self._proc.stdout, self._stdout), (self._proc.stderr, self._stderr)):
+            threading.Thread(target=_read_lines, args=(stream, lines), daemon=True).start()
+
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def _kill(self):
+        if self._proc is None:
+            return
+        if self._proc.poll() is None:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(os.getpgid(self._proc.pid), signal.SIGTERM)
+            self._proc.wait()
+        for stream in (self._proc.stdin, self._proc.stdout, self._proc.stderr):
+            with contextlib.suppress(OSError):
+                stream.close()
+        self._proc = None
+
+    def close(self):
+        with self._lock:
+            self._kill()
+
+    def _send(self, script):
+        if not self.alive():
+            if self._proc is not None:
+                self.log.info("shell session died, reconnecting")
+                self._kill()
+            self._start()
+        try:
+            self._proc.stdin.write(script)
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            # nothing ran, so it is safe to send it again on a new session
+            self.log.info("shell session died, reconnecting")
+            self._kill()
+            self._start()
+            self._proc.stdin.write(script)
+            self._proc.stdin.flush()
+
+    def _read_until(self, lines, marker, timeout):
+        out = []
+        while True:
+            try:
+                line = lines.get(timeout=timeout)
+            except queue.Empty:
+                self._kill()
+                raise ShellSessionError(f"shell session timed out after {timeout}s") from None
+            if line is None:
+                self._kill()
+                raise ShellSessionError("shell session died while running a command")
+            if line.startswith(marker):
+                # the newline before the marker is ours
+                return b"".join(out)[:-1], line[len(marker):].strip()
+            out.append(line)
+
+    def run(self, command, timeout=None):
+        """run the command line, returns (exit code, stdout, stderr)"""
+        timeout = self.timeout if timeout is None else timeout
+        if self.evaluate_twice:
+            command = f"eval {command}"
+        marker = f"{_SENTINEL}{uuid.uuid4().hex}"
+        script = (
+            f"sh -c {shlex.quote(command)} < /dev/null; "
+            f"printf '\\n{marker} %d\\n' $?; printf '\\n{marker}\\n' >&2\n"
+        )
+        with self._lock:
+            self._send(script.encode())
+            stdout, exit_code = self._read_until(self._stdout, marker.encode(), timeout)
+            stderr, _ = self._read_until(self._stderr, marker.encode(), timeout)
+        return int(exit_code), stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+
+class SessionCommand:
+    """
+    stands in for a baked sh command like adb.bake("shell"): called with the words of a command line,
+    which are joined with spaces like adb does, returns stdout and raises sh.ErrorReturnCode_<n> if it failed.
+    session is a ShellSession or an adbclient.AdbClient, anything with run() and argv.
+    """
+
+    def __init__(self, session, *prefix):
+        self.session = session
+        self.prefix = prefix
+
+    def bake(self, *args):
+        return SessionCommand(self.session, *self.prefix, *args)
+
+    def __getattr__(self, name):
+        # shell.monkey(...) like sh.Command subcommands, only for public names (copy and pickle look for dunders)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.bake(name)
+
+    def __call__(self, *args):
+        command = " ".join(str(a) for a in (*self.prefix, *args))
+        exit_code, stdout, stderr = self.session.run(command)
+        if exit_code != 0:
+            ran = " ".join([*self.session.argv, command])
+            raise getattr(sh, f"ErrorReturnCode_{exit_code}")(ran, stdout.encode(), stderr.encode())
+        return stdout
@@ -0,0 +1,180 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import os
+import socketserver
+import struct
+import subprocess
+import threading
+
+import pytest
+import sh
+
+from adbdevice.adbclient import AdbClient, AdbError
+from adbdevice.shellsession import SessionCommand
+
+SERIAL = "emulator-5554"
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """the parts of the adb server the client uses, the "device" is a local sh and the local filesystem"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeAdbHandler)
+        self.requests = []
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    def read_exact(self, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = self.request.recv(n - len(buf))
+            if not chunk:
+                raise EOFError
+            buf += chunk
+        return buf
+
+    def read_request(self):
+        request = self.read_exact(int(self.read_exact(4), 16)).decode()
+        self.server.requests.append(request)
+        return request
+
+    def okay(self):
+        self.request.sendall(b"OKAY")
+
+    def fail(self, message):
+        self.request.sendall(b"FAIL" + b"%04x" % len(message) + message.encode())
+
+    def handle(self):
+        request = self.read_request()
+        if request == f"host-serial:{SERIAL}:features":
+            self.okay()
+            self.request.sendall(b"%04x" % len(b"shell_v2,cmd") + b"shell_v2,cmd")
+        elif request == f"host:transport:{SERIAL}":
+            self.okay()
+            self.service(self.read_request())
+        else:
+            self.fail(f"device '{request.split(':')[-1]}' not found")
+
+    def service(self, service):
+        if service.startswith("shell,v2,raw:"):
+            self.okay()
+            assert self.read_exact(5) == struct.pack("<BI", 4, 0)
+            p = subprocess.run(["sh", "-c", service[len("shell,v2,raw:"):]], capture_output=True, stdin=subprocess.DEVNULL)
+            for packet_id, data in ((1, p.stdout), (2, p.stderr), (3, bytes([p.returncode]))):
+                self.request.sendall(struct.pack("<BI", packet_id, len(data)) + data)
+        elif service.startswith("exec:"):
+            self.okay()
+            self.request.sendall(subprocess.run(["sh", "-c", service[len("exec:"):]], capture_output=True).stdout)
+        elif service == "sync:":
+            self.okay()
+            self.sync()
+        elif service == "root:":
+            self.okay()
+            self.request.sendall(b"adbd is already running as root\n")
+        else:
+            self.fail(f"unknown service {service}")
+
+    def sync(self):
+        while True:
+            sync_id = self.read_exact(4)
+            (length,) = struct.unpack("<I", self.read_exact(4))
+            if sync_id == b"QUIT":
+                return
+            arg = self.read_exact(length).decode()
+            if sync_id == b"STAT":
+                try:
+                    st = os.stat(arg)
+                    self.request.sendall(b"STAT" + struct.pack("<III", st.st_mode, st.st_size, int(st.st_mtime)))
+                except FileNotFoundError:
+                    self.request.sendall(b"STAT" + struct.pack("<III", 0, 0, 0))
+            elif sync_id == b"RECV":
+                if not os.path.exists(arg):
+                    message = f"remote object '{arg}' does not exist".encode()
+                    self.request.sendall(b"FAIL" + struct.pack("<I", len(message)) + message)
+                    continue
+                with open(arg, "rb") as f:
+                    while chunk := f.read(64 * 1024):
+                        self.request.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+                self.request.sendall(b"DONE" + struct.pack("<I", 0))
+            elif sync_id == b"SEND":
+                path, mode = arg.rsplit(",", 1)
+                with open(path, "wb") as f:
+                    while True:
+                        chunk_id = self.read_exact(4)
+                        (n,) = struct.unpack("<I", self.read_exact(4))
+                        if chunk_id == b"DONE":
+                            break
+                        assert n <= 64 * 1024
+                        f.write(self.read_exact(n))
+                os.chmod(path, int(mode))
+                self.request.sendall(b"OKAY" + struct.pack("<I", 0))
+
+
+@pytest.fixture
+def server():
+    server = FakeAdbServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    return AdbClient(SERIAL, address=server.server_address, timeout=10)
+
+
+def test_shell(client, server):
+    assert client.shell("echo out; echo err >&2; exit 3") == (3, b"out\n", b"err\n")
+    assert client.run("printf 'a b'") == (0, "a b", "")
+    assert server.requests[:2] == [f"host:transport:{SERIAL}", "shell,v2,raw:echo out; echo err >&2; exit 3"]
+
+
+def test_session_command_attribute(client, server):
+    # AdbDevice.shell of the socket backend, used like adbdev.shell.monkey("-p", app, "1")
+    shell = SessionCommand(client)
+    assert shell.echo("a", "b") == "a b\n"
+    # there is no monkey on the host, the command line still has to arrive as adb would send it
+    with pytest.raises(sh.ErrorReturnCode_127):
+        shell.monkey("-p", "com.example.app", "1")
+    assert "shell,v2,raw:monkey -p com.example.app 1" in server.requests
+
+
+def test_exec_out_and_features(client):
+    assert client.exec_out("printf '\\000\\001binary'") == b"\0\1binary"
+    assert "shell_v2" in client.features()
+
+
+def test_unknown_device(server):
+    with pytest.raises(AdbError, match="not found"):
+        AdbClient("nope", address=server.server_address).shell("true")
+
+
+def test_pull_push(client, tmp_path):
+    # a few chunks and a bit
+    data = os.urandom(3 * 64 * 1024 + 123)
+    remote = tmp_path / "remote.bin"
+    remote.write_bytes(data)
+    assert client.stat(remote)[1] == len(data)
+    assert client.stat(tmp_path / "missing") == (0, 0, 0)
+
+    local = tmp_path / "local"
+    local.mkdir()
+    assert client.pull(remote, local) == local / "remote.bin"
+    assert (local / "remote.bin").read_bytes() == data
+
+    client.push(local / "remote.bin", f"{tmp_path}/pushed.bin", mode=0o600)
+    assert (tmp_path / "pushed.bin").read_bytes() == data
+    assert (tmp_path / "pushed.bin").stat().st_mode & 0o777 == 0o600
+
+    with pytest.raises(AdbError, match="does not exist"):
+        client.pull(tmp_path / "missing", local / "missing")
+    assert not (local / "missing").exists()
+
+
+def test_root(client):
+    client.root()
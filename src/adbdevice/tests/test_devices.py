@@ -0,0 +1,16 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+from adbdevice.adbdevice import _undevices
+
+
+def test_undevices():
+    devices = (
+        "List of devices attached\n"
+        "3A121FDJH00BT3\tdevice\n"
+        "38270DLJH004Q0\tunauthorized\n"
+        "emulator-5556\toffline\n"
+        "emulator-5554\tdevice\r\n"
+        "\n"
+    )
+    assert _undevices(devices) == ["3A121FDJH00BT3", "emulator-5554"]
@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import queue
+import threading
+
+import pytest
+
+from adbdevice.emulatorctrl import avd_names
+from adbdevice.emulatorpool import EmulatorPool
+
+
+class FakeEmulator:
+    """records what the pool does with it, instead of running an emulator"""
+
+    def __init__(self, port, fail_load=0, fail_boot=False, fail_recreate=False, log=None):
+        self.port = port
+        self.use_adb_root = True
+        self.calls = []
+        self.fail_load = fail_load
+        self.fail_boot = fail_boot
+        self.fail_recreate = fail_recreate
+        # (device name, call) of every emulator sharing it, in order
+        self.log = log if log is not None else []
+
+    def get_device_name(self):
+        return f"emulator-{self.port}"
+
+    def recreate(self, force=True):
+        if self.fail_recreate:
+            raise NotImplementedError("failed to create avd")
+        self.calls.append("recreate")
+        self.log.append((self.get_device_name(), "recreate"))
+
+    def start_and_wait_in_background(self, save_snapshot_on_exit=True):
+        if self.fail_boot:
+            raise RuntimeError("boot failed")
+        self.calls.append(("start", save_snapshot_on_exit))
+        self.log.append((self.get_device_name(), "start"))
+
+    def snapshot_save(self, snapshot):
+        self.calls.append(("save", snapshot))
+
+    def snapshot_load(self, snapshot):
+        if self.fail_load:
+            self.fail_load -= 1
+            raise RuntimeError("load failed")
+        self.calls.append(("load", snapshot))
+
+    def shutdown_and_wait(self):
+        self.calls.append("shutdown")
+
+
+def test_start_and_lease():
+    emus = [FakeEmulator(5560), FakeEmulator(5562)]
+    pool = EmulatorPool(emus, snapshot="clean")
+    pool.start()
+    assert emus[0].calls == ["recreate", ("start", False), ("save", "clean")]
+
+    with pool.lease() as a, pool.lease() as b:
+        assert {a.get_device_name(), b.get_device_name()} == {"emulator-5560", "emulator-5562"}
+        with pytest.raises(queue.Empty), pool.lease(timeout=0.05):
+            pass
+    # every lease starts from the clean snapshot
+    assert emus[0].calls[-1] == ("load", "clean")
+    assert emus[1].calls[-1] == ("load", "clean")
+
+    with pool.lease("emulator-5562") as emu:
+        assert emu is emus[1]
+    pool.shutdown()
+    assert emus[0].calls[-1] == "shutdown"
+
+
+def test_lease_waits_for_release():
+    pool = EmulatorPool([FakeEmulator(5560)])
+    pool.start()
+    leased = []
+    with pool.lease():
+        waiter = threading.Thread(target=lambda: leased.append(pool.lease(timeout=5).__enter__()))
+        waiter.start()
+        waiter.join(0.1)
+        assert not leased
+    waiter.join()
+    assert leased
+
+
+def test_failed_load_boots_again():
+    emu = FakeEmulator(5560, fail_load=1)
+    pool = EmulatorPool([emu], snapshot="clean")
+    pool.start()
+    emu.calls.clear()
+    with pool.lease():
+        pass
+    assert emu.calls == ["shutdown", "recreate", ("start", False), ("save", "clean")]
+
+
+def test_failed_boot():
+    broken = FakeEmulator(5560, fail_boot=True)
+    pool = EmulatorPool([broken, FakeEmulator(5562)])
+    pool.start()
+    assert pool.ready() == ["emulator-5562"]
+    assert broken.calls[-1] == "shutdown"
+    with pytest.raises(KeyError), pool.lease("emulator-5560"):
+        pass
+    with pool.lease(timeout=1) as emu:
+        assert emu.get_device_name() == "emulator-5562"
+    with pytest.raises(NotImplementedError):
+        EmulatorPool([FakeEmulator(5560, fail_boot=True)]).start()
+
+
+def test_failed_load_and_boot_drops_it():
+    emu = FakeEmulator(5560)
+    pool = EmulatorPool([emu, FakeEmulator(5562)], snapshot="clean")
+    pool.start()
+    emu.calls.clear()
+    emu.fail_load = 1
+    emu.fail_boot = True
+    with pytest.raises(RuntimeError), pool.lease("emulator-5560"):
+        pass
+    assert emu.calls == ["shutdown", "recreate", "shutdown"]
+    assert pool.ready() == ["emulator-5562"]
+    with pytest.raises(KeyError), pool.lease("emulator-5560"):
+        pass
+    with pool.lease(timeout=1) as other:
+        assert other.get_device_name() == "emulator-5562"
+
+
+def test_recreate_one_after_the_other():
+    log = []
+    emus = [FakeEmulator(5560 + 2 * i, log=log) for i in range(4)] + [FakeEmulator(5568, fail_recreate=True)]
+    pool = EmulatorPool(emus)
+    pool.start()
+    assert [call for _, call in log] == ["recreate"] * 4 + ["start"] * 4
+    assert pool.ready() == [emu.get_device_name() for emu in emus[:4]]
+    assert emus[4].calls == ["shutdown"]
+
+
+def test_avd_names():
+    output = (
+        "Available Android Virtual Devices:\n"
+        "    Name: a34_tracer_2\n"
+        "  Device: pixel_6a (Google)\n"
+        "    Path: /home/user/.android/avd/a34_tracer_2.avd\n"
+        "---------\n"
+        "    Name: other\n"
+    )
+    assert avd_names(output) == {"a34_tracer_2", "other"}
+    assert "a34_tracer" not in avd_names(output)
@@ -0,0 +1,19 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+from adbdevice.adbdevice import _unprop
+
+
+def test_unprop():
+    props = (
+        "[dalvik.vm.heapsize]: [512m]\n"
+        "[ro.build.fingerprint]: [google/sdk_gphone64_x86_64/emu64xa:14/UE1A.230829.036.A1/11228894:userdebug/dev-keys]\r\n"
+        "[ro.build.version.sdk]: [34]\n"
+        "[ro.empty]: []\n"
+    )
+    assert _unprop(props) == {
+        "dalvik.vm.heapsize": "512m",
+        "ro.build.fingerprint": "google/sdk_gphone64_x86_64/emu64xa:14/UE1A.230829.036.A1/11228894:userdebug/dev-keys",
+        "ro.build.version.sdk": "34",
+        "ro.empty": "",
+    }
@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import os
+import threading
+
+import pytest
+import sh
+
+from adbdevice.shellsession import SessionCommand, ShellSession, ShellSessionError
+
+# a local sh stands in for `adb shell`
+
+
+@pytest.fixture
+def session():
+    s = ShellSession(["sh"], timeout=10)
+    yield s
+    s.close()
+
+
+def test_run(session):
+    assert session.run("echo hi") == (0, "hi\n", "")
+    assert session.run("printf 'no newline'") == (0, "no newline", "")
+    assert session.run("echo out; echo err >&2; exit 3") == (3, "out\n", "err\n")
+    # every command runs in its own shell, like separate adb shell calls
+    session.run("cd /; export FOO=1")
+    assert session.run("echo $FOO") == (0, "\n", "")
+    # commands don't get the session stdin
+    assert session.run("cat") == (0, "", "")
+
+
+def test_command(session):
+    shell = SessionCommand(session)
+    assert shell("echo", "a", "b") == "a b\n"
+    assert shell.bake("echo", "a")("b").strip() == "a b"
+    with pytest.raises(sh.ErrorReturnCode_1):
+        shell("false")
+    with pytest.raises(sh.ErrorReturnCode_2):
+        shell("exit 2")
+
+
+def test_command_attribute(tmp_path, monkeypatch):
+    # like the sh.Command api callers use, adbdev.shell.monkey("-p", app, "1")
+    monkey = tmp_path / "monkey"
+    monkey.write_text('#!/bin/sh\necho "monkey $*"\n')
+    monkey.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+    session = ShellSession(["sh"], timeout=10)
+    try:
+        session_cmd = SessionCommand(session)
+        assert session_cmd.monkey("-p", "com.example.app", "1") == "monkey -p com.example.app 1\n"
+        with pytest.raises(AttributeError):
+            session_cmd._private  # noqa: B018
+    finally:
+        session.close()
+
+
+def test_evaluate_twice():
+    # like `su -c`, the escaped backticks are substituted by the second evaluation
+    session = ShellSession(["sh"], evaluate_twice=True, timeout=10)
+    assert session.run("echo \\`echo inner\\`") == (0, "inner\n", "")
+    session.close()
+
+
+def test_reconnect(session):
+    # the session dies while running this one, that can't be retried
+    with pytest.raises(ShellSessionError):
+        session.run("kill -9 $PPID")
+    # the dead session is replaced by the next command
+    assert session.run("echo again") == (0, "again\n", "")
+
+
+def test_timeout():
+    session = ShellSession(["sh"])
+    with pytest.raises(ShellSessionError):
+        session.run("sleep 5", timeout=0.2)
+    assert session.run("echo ok", timeout=10) == (0, "ok\n", "")
+    session.close()
+
+
+def test_threads(session):
+    results = {}
+
+    def worker(i):
+        results[i] = session.run(f"echo {i}; echo {i} >&2")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {i: (0, f"{i}\n", f"{i}\n") for i in range(20)}
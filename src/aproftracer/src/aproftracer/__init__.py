@@ -0,0 +1,15 @@
+import logging
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.WARNING)
+
+_ch = logging.StreamHandler()
+_ch.setFormatter(
+    logging.Formatter(
+        "{asctime}|{levelname}|{name}|{message}",
+        style="{",
+    )
+)
+
+# adds the handler to the package logger, submodules propagate to it
+log.addHandler(_ch)
@@ -1,9 +1,7 @@
+import asyncio
 import contextlib
 import glob
 import logging
-import pickle
-import re
-import signal
 import sys
 import time
 import traceback
@@ -13,22 +11,15 @@ from datetime import datetime, timedelta
 
 import click
 import sh
-from adbdevice import AdbRootDevice, SuRootDevice, check_device_ok
+from adbdevice import BACKENDS, AdbError, AdbRootDevice, ShellSessionError, SuRootDevice, check_device_ok
 from adbdevice.emulatorctrl import EmulatorCTRL
 
-log = logging.getLogger(__name__)
-log.setLevel(logging.WARNING)
-
-_ch = logging.StreamHandler()
-_ch.setFormatter(
-    logging.Formatter(
-        "{asctime}|{levelname}|{name}|{message}",
-        style="{",
-    )
-)
+from aproftracer import log as pkglog
+from aproftracer import bpfmap, devicecache, oatdump, oatfile, offsetscache, pipeline, prof, rawtrace, resultdir, retirement, ringbuffer, softreset, supervisor, tracestream, uprobes
+from aproftracer.bitmapset import BitmapSet
 
-# adds the handler to the global variable: log
-log.addHandler(_ch)
+# handler and level live on the package logger, see __init__.py
+log = logging.getLogger(__name__)
 
 TRACE_GROUP_NAME="sonoftroya"
 
@@ -36,18 +27,46 @@ TRACE_GROUP_NAME="sonoftroya"
 # to implement a new one add a function to call it in Tracer.run_tool()
 _SUPPORTED_TOOLS=["time", "monkey", "droidbot", "fastbot"]
 
+# what collects the hits:
+# events are the uprobe events of tracefs, set up by tracepoints.sh, bpf is a bpf program that counts them in a map, see bpfmap.py.
+# no tracer binary implements the bpf contract yet, so the cli only offers events
+_TRACE_BACKENDS=["events", "bpf"]
+
+# how tracepoints.sh registers the uprobes:
+# bulk writes a definitions file to uprobe_events in large blocks, see uprobes.py, echo does one echo per probe
+_PROBE_SETUPS=["bulk", "echo"]
+
+# how the hits get off the ring buffer:
+# text is tail -f of trace_pipe, raw copies the binary pages of every cpu from trace_pipe_raw, see ringbuffer.py,
+# stream reads trace_pipe over adb exec-out and parses it on host during the run, see tracestream.py,
+# aggregate logs only the first hit of every probe like text and takes the hit counts from the kernel, see uprobes.py
+_CAPTURES=["text", "raw", "stream", "aggregate"]
+
+# where the method offsets come from:
+# oatdump runs oatdump on the device and parses its text, odex pulls the odex and vdex and reads them on the host
+_OFFSETS_SOURCES=["oatdump", "odex"]
+
 # default settings
 # ONANDR means it refers to a location on the android system
 # ONHOST means it refers to a location on the system running aproftracer
 _ONANDR_TMPDIR=Path("/data/local/tmp/tracer/")
 _ONHOST_DEFAULT_RESULT_DIR=Path("./_results/")
 _TRACEPOINTS_SH_FNAME="tracepoints.sh"
+_UPROBES_FNAME="uprobes.txt"
 _RAW_OUTPUT_FNAME="raw_output.txt"
+_RAW_CAPTURE_DIRNAME="raw_capture"
+_UPROBE_PROFILE_FNAME="uprobe_profile.txt"
+_OFFSETS_FNAME="offsets.txt"
+_MAP_DUMP_FNAME="map.bin"
+_BPF_TRACER_FNAME="tracer.bin"
+_APPS_SINCE_BOOT_FNAME="apps_since_boot"
 
 _ONANDR_WRITEABLE_DIR=Path("/storage/emulated/0/Download/")
 
 _TIMEOUT_FOR_PROBE_SETUP=300 # uprobe events are fast, but not that fast.
 _DEFAULT_MAX_PROBES=30_000 # TODO still needed? yes
+# apps between two reboots of a device, in between it is only soft reset. see softreset.py
+_REBOOT_EVERY=20
 
 
 class Tracer:
@@ -57,6 +76,8 @@ class Tracer:
 
                 device_id,
                 use_adb_root=False,
+                persistent_shell=False,
+                adb_backend=BACKENDS[0],
                 apks_dm_dir=None,
                 android_tmpdir=_ONANDR_TMPDIR,
                 host_result_dir=_ONHOST_DEFAULT_RESULT_DIR,
@@ -67,26 +88,40 @@ class Tracer:
 
                 force_wifi=None,
 
+                parse_workers=1,
+                offsets_source=_OFFSETS_SOURCES[0],
+                offsets_cache_dir=None,
+                device_cache_dir=None,
+                probe_setup=_PROBE_SETUPS[0],
+                capture=_CAPTURES[0],
+                compress_transfer=False,
+                trace_backend=_TRACE_BACKENDS[0],
+                bpf_tracer=None,
+                retire_probes=False,
+
                 verbose=False,
             ):
         self.apkid = apkid
 
         # set up the adbdevice
         self.device_id = device_id
-        check_device_ok(device_id)
         self._use_adb_root = use_adb_root
-        if use_adb_root:
-            self.adbdev = AdbRootDevice(device_id)
-        else:
-            self.adbdev = SuRootDevice(device_id)
-
-        if verbose:
-            self.adbdev.log.setLevel(logging.DEBUG)
+        self._persistent_shell = persistent_shell
+        self._adb_backend = adb_backend
         self._verbose = verbose
+        self._connect()
 
         log.info("connected to device")
 
+        # facts about the build and the installed app looked up once per device, see devicecache.py
+        self.device_cache = devicecache.DeviceCache(device_cache_dir) if device_cache_dir else None
+        self._build_fingerprint = self.adbdev.getprop("ro.build.fingerprint")
+        self._install_key = None
+        self._install_facts_loaded = False
+
         # check eBPF capabilities
+        self._buffer_size_kb = buffer_size_kb
+        self._buffer_percent = buffer_percent
         self.check_and_enable_tracing(buffer_size_kb, buffer_percent)
 
         if force_wifi:
@@ -102,8 +137,10 @@ class Tracer:
             log.debug(f"crearing result tmpdir {self.host_res_dir}")
             self._host_res_tmpdir.mkdir(parents=True, exist_ok=True)
         self.host_raw_output_path = self._host_res_tmpdir / _RAW_OUTPUT_FNAME
-        self.host_output_path = self.host_res_dir / "result.pickle"
+        self.host_output_path = self.host_res_dir / resultdir.RESULT_DIRNAME
         self.host_tracepoinsts_sh = self._host_res_tmpdir / _TRACEPOINTS_SH_FNAME
+        self.host_uprobes_path = self._host_res_tmpdir / _UPROBES_FNAME
+        self.host_raw_capture_dir = self._host_res_tmpdir / _RAW_CAPTURE_DIRNAME
 
         # set up paths on device
         self.andro_tmpdir = android_tmpdir # where the tracer and other things live on device
@@ -112,20 +149,23 @@ class Tracer:
         self.adbdev.root_shell(f"mkdir -p {self.andro_apkdir}")
         # helpers for parsing
         self.andro_prim_prof = self.andro_apkdir / 'primary.prof'
-        self.andro_prim_profdump = self.andro_apkdir / 'primary.profdump'
         self.andro_base_oatdump = self.andro_apkdir / 'base.oatdump'
         self.andro_tracepoints_sh = self.andro_apkdir / _TRACEPOINTS_SH_FNAME
+        self.andro_uprobes_path = self.andro_apkdir / _UPROBES_FNAME
         self.andro_raw_output_path = self.andro_apkdir / _RAW_OUTPUT_FNAME
 
-        self.host_prim_profdump_path = self._host_res_tmpdir / self.andro_prim_profdump.name
+        self.host_prim_prof_path = self._host_res_tmpdir / self.andro_prim_prof.name
         self.host_base_oatdump_path = self._host_res_tmpdir / self.andro_base_oatdump.name
+        self.host_base_odex_path = self._host_res_tmpdir / "base.odex"
+        self.host_base_vdex_path = self._host_res_tmpdir / "base.vdex"
+        self.host_base_apk_path = self._host_res_tmpdir / "base.apk"
 
         # these are dynamic and depend on the data dir for the app, see the @properties later
         self._andro_dm_path = None
         self._andro_odex_path = None
         self._oatdata_offset = None
 
-        self.profile_info = None # see read_profdump_info
+        self.profile_info = None # see read_profile_info
         self.offsets_info = None # see read_oatdump_info
         self.trace_info = None # see _create_tracepoints_sh
         self.traced_activities = None
@@ -137,17 +177,107 @@ class Tracer:
         self.num_probes_to_attach = 0
         self.max_probes = max_probes
 
+        self.parse_workers = parse_workers
+        if offsets_source not in _OFFSETS_SOURCES:
+            raise NotImplementedError(f"unknown offsets source {offsets_source}")
+        self.offsets_source = offsets_source
+        # shared between all workers on a host, see offsetscache.py
+        self.offsets_cache = offsetscache.OffsetsCache(offsets_cache_dir) if offsets_cache_dir else None
+        # set by fetch_tracepoint_inputs for build_tracepoints
+        self._offsets_key = None
+        self._offsets_cached = False
+        self._host_apk_path = None
+        if probe_setup not in _PROBE_SETUPS:
+            raise NotImplementedError(f"unknown probe setup {probe_setup}")
+        self.probe_setup = probe_setup
+        self._probe_setup_start = None
+        if capture not in _CAPTURES:
+            raise NotImplementedError(f"unknown capture {capture}")
+        self.capture = capture
+        self._trace_stream = None
+        self._streamed_trace = None
+        self.compress_transfer = compress_transfer and self._device_has_gzip()
+        if trace_backend not in _TRACE_BACKENDS:
+            raise NotImplementedError(f"unknown trace backend {trace_backend}")
+        self.trace_backend = trace_backend
+        if trace_backend == "bpf":
+            if not bpf_tracer:
+                raise NotImplementedError("the bpf backend needs the tracer binary for the device")
+            if capture != _CAPTURES[0]:
+                log.warning(f"capture {capture} is for the events backend, the bpf backend dumps its map")
+        self.bpf_tracer = Path(bpf_tracer) if bpf_tracer else None
+        self.host_offsets_path = self._host_res_tmpdir / _OFFSETS_FNAME
+        self.host_map_dump_path = self._host_res_tmpdir / _MAP_DUMP_FNAME
+        self.andro_offsets_path = self.andro_apkdir / _OFFSETS_FNAME
+        self.andro_map_dump_path = self.andro_apkdir / _MAP_DUMP_FNAME
+        self.andro_bpf_tracer = self.andro_tmpdir / _BPF_TRACER_FNAME
+        # the tracer, tools and reboots run on the loop of the supervisor, see supervisor.py
+        self._supervisor = supervisor.shared()
+        self._proc_tracer = None
+        self._proc_activities = None
+        # probe retirement watches the hits as they come in, only the stream capture has them on host during the run
+        if retire_probes and (trace_backend != "events" or capture != "stream"):
+            raise NotImplementedError("retiring probes needs the events backend and the stream capture")
+        self.retire_probes = retire_probes
+        self._retirer = None
+        self.probe_retired = None
+
         log.info("device set up")
 
+    def _connect(self):
+        check_device_ok(self.device_id)
+        if self._use_adb_root:
+            self.adbdev = AdbRootDevice(self.device_id, persistent_shell=self._persistent_shell, backend=self._adb_backend)
+        else:
+            self.adbdev = SuRootDevice(self.device_id, persistent_shell=self._persistent_shell, backend=self._adb_backend)
+        if self._verbose:
+            self.adbdev.log.setLevel(logging.DEBUG)
+
+    def reconnect(self):
+        """
+        the device rebooted after this Tracer was set up (pipelined batches set up the next app early):
+        adb root, the shells and the tracefs settings are gone, the files on the device and the install are not.
+        """
+        self.adbdev.close_sessions()
+        self._connect()
+        self.check_and_enable_tracing(self._buffer_size_kb, self._buffer_percent)
+        self.adbdev.root_shell(f"mkdir -p {self.andro_apkdir}")
+        log.info("reconnected to device")
+
+    def _device_has_gzip(self):
+        try:
+            self.adbdev.root_shell("command -v gzip")
+        except sh.ErrorReturnCode:
+            log.warning("no gzip on the device, pulling uncompressed")
+            return False
+        return True
+
+    def _pull(self, andro_path, host_path):
+        """pull a file, gzipped on the device first with compress_transfer. readers take either, see compression.py"""
+        if not self.compress_transfer:
+            self.adbdev.pull(andro_path, host_path)
+            return
+        andro_gz = f"{andro_path}.gz"
+        self.adbdev.root_shell(f"gzip -1 -c {andro_path} > {andro_gz}")
+        self.adbdev.pull(andro_gz, host_path)
+        self.adbdev.root_shell(f"rm {andro_gz}")
+
     def check_and_enable_tracing(self, buffer_size_kb, buffer_percent):
         """test the kernel config, enable tracing, and mount the debugfs if needed."""
-        kconf = self.adbdev.shell("zcat /proc/config.gz")
-        for setting in [
-                "CONFIG_BPF=y",
-                "CONFIG_BPF_SYSCALL=y",
-                "CONFIG_UPROBES=y",
-                "CONFIG_UPROBE_EVENTS=y"]:
-            assert(setting in kconf)
+        build_facts = self.device_cache.get_build(self._build_fingerprint) if self.device_cache else None
+        if build_facts and build_facts.get("kernel_ok"):
+            log.debug("kernel config checked before for this build")
+        else:
+            kconf = self.adbdev.shell("zcat /proc/config.gz")
+            for setting in [
+                    "CONFIG_BPF=y",
+                    "CONFIG_BPF_SYSCALL=y",
+                    "CONFIG_UPROBES=y",
+                    "CONFIG_UPROBE_EVENTS=y"]:
+                assert(setting in kconf)
+            if self.device_cache:
+                self.device_cache.put_build(self._build_fingerprint, {"kernel_ok": True, "sdk": self.adbdev.version_sdk})
+        # the mount is gone after a reboot, that is checked every time
         # self.adbdev.root_shell("echo '1' > /sys/kernel/tracing/tracing_on")
         # mount debugfs if not mounted
         if self._use_adb_root:
@@ -242,6 +372,10 @@ class Tracer:
         files_to_install.extend(dm_file)
 
         self.adbdev.adb("install-multiple", *files_to_install)
+        # a new install, whatever was looked up is about the old one
+        self._andro_dm_path = self._andro_odex_path = self._oatdata_offset = None
+        self._install_key = None
+        self._install_facts_loaded = False
 
         if compile_all_aot:
             log.info("AOT compiling everyting")
@@ -278,23 +412,68 @@ class Tracer:
     @property
     def andro_odex_path(self):
         """get odex path on emulator for apkid."""
+        self._load_install_facts()
         if not self._andro_odex_path:
             p = self.adbdev.root_shell(f"pm dump {self.apkid} | grep 'codePath' | xargs").strip()[9:]
             self._andro_odex_path = self.adbdev.root_shell(f"find {p} -name '*.odex' 2> /dev/null | head -n 1").strip()
             log.info(f"found oat at: {self._andro_odex_path}")
+            self._store_install_facts()
         return self._andro_odex_path
 
     @property
     def oatdata_offset(self):
         """get oatdata offset to calculate real function offsets within odex"""
+        self._load_install_facts()
         if not self._oatdata_offset:
             readelf = self.adbdev.root_shell(f"readelf -s {self.andro_odex_path}")
             for line in readelf.split('\n'):
                 if line.endswith('oatdata'):
                     self._oatdata_offset = int(line.split()[1], 16)
             log.info(f"found oatdata offset at: {self._oatdata_offset:x}")
+            self._store_install_facts()
         return self._oatdata_offset
 
+    def _install_cache_key(self):
+        """(base.apk path, mtime) of the installed app, or None if it isn't installed. also sets the dm path"""
+        if self._install_key is None:
+            try:
+                stats = self.adbdev.shell(f"for p in $(pm path {self.apkid}); do stat -c '%Y %n' ${{p#package:}}; done")
+            except sh.ErrorReturnCode as e:
+                log.debug(f"no install to key the device cache with: {e}")
+                return None
+            for line in stats.splitlines():
+                mtime, _, path = line.strip().partition(" ")
+                if path.endswith("/base.apk"):
+                    self._install_key = (path, mtime)
+                    self._andro_dm_path = self._andro_dm_path or Path(path).with_suffix(".dm")
+                    break
+        return self._install_key
+
+    def _load_install_facts(self):
+        """
+        odex path and oatdata offset from the device cache, once. keyed by the install, so recompiling
+        the app without reinstalling it (other than install_and_compile_from_path does) isn't noticed.
+        """
+        if self.device_cache is None or self._install_facts_loaded:
+            return
+        key = self._install_cache_key()
+        if key is None:
+            return
+        self._install_facts_loaded = True
+        facts = self.device_cache.get_install(self._build_fingerprint, self.apkid, *key)
+        if facts:
+            log.debug("odex path and oatdata offset from the device cache")
+            self._andro_odex_path = self._andro_odex_path or facts.get("odex_path")
+            self._oatdata_offset = self._oatdata_offset or facts.get("oatdata_offset")
+
+    def _store_install_facts(self):
+        if self.device_cache is None or self._install_cache_key() is None:
+            return
+        self.device_cache.put_install(self._build_fingerprint, self.apkid, *self._install_key, {
+                "odex_path": self._andro_odex_path,
+                "oatdata_offset": self._oatdata_offset,
+            })
+
     @property
     def andro_dm_path(self):
         """get dm path"""
@@ -314,68 +493,184 @@ class Tracer:
         - prioritize the appid methods
         - create tracepoints.sh and push it to device
         """
+        self.fetch_tracepoint_inputs(code_coverage)
+        self.build_tracepoints(code_coverage, also_startup_poststartup, only_appid)
+        self.push_tracepoints()
+
+    def fetch_tracepoint_inputs(self, code_coverage):
+        """the device part of prepare_tracepoints_sh: pull what build_tracepoints parses, unless the offsets cache has it"""
         if code_coverage:
             log.warning("code coverage is experimental and times out if app has many (>30k methods)")
 
-        self._prepare_profile_and_oatdump()
-
-        self.profile_info, self.offsets_info = Tracer.generate_profile_and_offsets_info(
-                self.host_prim_profdump_path,
-                self.host_base_oatdump_path,
-                self.oatdata_offset,
-                code_coverage)
+        self._offsets_key = None
+        self._offsets_cached = False
+        if self.offsets_cache is not None:
+            self._offsets_key = self._offsets_cache_key(code_coverage)
+            cached = self.offsets_cache.get(self._offsets_key)
+            if cached is not None:
+                log.info("profile and offsets info from cache")
+                self.profile_info, self.offsets_info, self._oatdata_offset = cached
+                self._offsets_cached = True
+        if not self._offsets_cached:
+            self._pull_profile_and_offsets_inputs()
+        # the probes are defined on the odex, looked up now so building them needs no device
+        log.debug(f"tracing {self.andro_odex_path}")
+
+    def build_tracepoints(self, code_coverage, also_startup_poststartup, only_appid):
+        """the host part of prepare_tracepoints_sh, no device needed: parse, filter and write tracepoints.sh"""
+        if not self._offsets_cached:
+            if self.offsets_cache is None:
+                self._generate_profile_and_offsets_info(code_coverage)
+            else:
+                with self.offsets_cache.lock(self._offsets_key):
+                    cached = self.offsets_cache.get(self._offsets_key)
+                    if cached is not None:
+                        log.info("profile and offsets info from cache")
+                        self.profile_info, self.offsets_info, self._oatdata_offset = cached
+                    else:
+                        self._generate_profile_and_offsets_info(code_coverage)
+                        self.offsets_cache.put(self._offsets_key, self.profile_info, self.offsets_info, self._oatdata_offset)
 
         self.filter_offsets_to_trace(
             also_startup_poststartup,
             code_coverage,
             only_appid)
 
+        if self.trace_backend == "bpf":
+            # the same probes the uprobe events would get, see bpfmap.py
+            self.trace_info = self._select_tracepoints()
+            bpfmap.write_offsets(self.host_offsets_path, self.trace_info)
+            return
+
         self._create_tracepoints_sh()
+
+    def push_tracepoints(self):
+        """the last part of prepare_tracepoints_sh, push what build_tracepoints wrote"""
+        if self.trace_backend == "bpf":
+            self.push_thru_writable(self.host_offsets_path, self.andro_offsets_path)
+            self.push_thru_writable(self.bpf_tracer, self.andro_bpf_tracer)
+            self.adbdev.root_shell(f"chmod +x {self.andro_bpf_tracer}")
+            return
+
         self.push_thru_writable(self.host_tracepoinsts_sh, self.andro_tracepoints_sh)
+        if self.probe_setup == "bulk":
+            self.push_thru_writable(self.host_uprobes_path, self.andro_uprobes_path)
         self.adbdev.root_shell(f"chmod +x {self.andro_tracepoints_sh}")
 
-    def _prepare_profile_and_oatdump(self):
-        """assumes dm file available at install directory, not tempdir. creates and pulls primary.prof, profdump, and oatdump"""
-        log.debug("preparing prof, profdump, and oatdump")
+    def _offsets_cache_key(self, code_coverage):
+        """hashes the dm and the odex on the device, so a cache hit pulls nothing"""
+        dm_hash = self.adbdev.root_shell(f"sha256sum {self.andro_dm_path}").split()[0]
+        odex_hash = self.adbdev.root_shell(f"sha256sum {self.andro_odex_path}").split()[0]
+        fingerprint = self.adbdev.getprop("ro.build.fingerprint")
+        return offsetscache.cache_key(dm_hash, odex_hash, fingerprint, code_coverage)
+
+    def _pull_profile_and_offsets_inputs(self):
+        """pull the profile and the odex or oatdump, and look up the oatdata offset for the oatdump"""
+        self._prepare_profile()
+        if self.offsets_source == "odex":
+            self._host_apk_path = self._prepare_odex()
+        else:
+            self._prepare_oatdump()
+            log.debug(f"oatdata offset {self.oatdata_offset:x}")
+
+    def _generate_profile_and_offsets_info(self, code_coverage):
+        """set profile_info and offsets_info from what _pull_profile_and_offsets_inputs pulled"""
+        if self.offsets_source == "odex":
+            self.profile_info, self.offsets_info, self._oatdata_offset = Tracer.generate_profile_and_offsets_info_from_odex(
+                    self.host_prim_prof_path,
+                    self.host_base_odex_path,
+                    self.host_base_vdex_path,
+                    self._host_apk_path,
+                    code_coverage)
+        else:
+            self.profile_info, self.offsets_info = Tracer.generate_profile_and_offsets_info(
+                    self.host_prim_prof_path,
+                    self.host_base_oatdump_path,
+                    self._oatdata_offset,
+                    code_coverage,
+                    parse_workers=self.parse_workers)
+
+    def _prepare_profile(self):
+        """
+        assumes dm file available at install directory, not tempdir. extracts and pulls primary.prof.
+        it is decoded on the host, see prof.py, no need for profman --dump-only on the device.
+        """
+        log.debug("preparing prof")
 
         # extract primary prof from base_dm
         # -o to overwrite existing files
         self.adbdev.root_shell(f"unzip -o {self.andro_dm_path} primary.prof -d {self.andro_apkdir}")
-        self.adbdev.pull(self.andro_prim_prof, (self._host_res_tmpdir / self.andro_prim_prof.name))
+        self.adbdev.pull(self.andro_prim_prof, self.host_prim_prof_path)
         log.debug("unzipped dm and pulled primary.prof")
 
-        # create readable profdump file
-        # because pErMiSsIoNs, the following does not work:
-        # self.adbdev.root_shell(f"profman --dump-only --profile-file={self.andro_prim_prof} > {self.andro_prim_profdump}")
-        # instead we need to dump to a writeable dir and then mv it where we want it
-        tmpfile = _ONANDR_WRITEABLE_DIR / self.andro_prim_profdump.name
-        self.adbdev.root_shell(f"profman --dump-only --profile-file={self.andro_prim_prof} > {tmpfile}")
-        self.adbdev.root_shell(f"mv {tmpfile} {self.andro_prim_profdump}")
-        self.adbdev.root_shell(f"chmod o+r {self.andro_prim_profdump}")
-        self.adbdev.pull(self.andro_prim_profdump, self.host_prim_profdump_path)
-        log.debug("created and pulled profdump")
-
+    def _prepare_oatdump(self):
+        """creates and pulls the oatdump"""
         # create oatdump
-        # also because permissions >_< see above
+        # because pErMiSsIoNs, the following does not work:
         # self.adbdev.root_shell(f"oatdump --oat-file={self.andro_odex_path} --no-disassemble > {self.andro_base_oatdump}")
+        # instead we need to dump to a writeable dir and then mv it where we want it
         tmpfile = _ONANDR_WRITEABLE_DIR / self.andro_base_oatdump.name
-        self.adbdev.root_shell(f"oatdump --oat-file={self.andro_odex_path} --no-disassemble > {tmpfile}")
+        # compressed right away, the plain oatdump never touches the disk of the device
+        compress = " | gzip -1 -c" if self.compress_transfer else ""
+        self.adbdev.root_shell(f"oatdump --oat-file={self.andro_odex_path} --no-disassemble{compress} > {tmpfile}")
         self.adbdev.root_shell(f"mv {tmpfile} {self.andro_base_oatdump}")
         self.adbdev.root_shell(f"chmod o+r {self.andro_base_oatdump}")
         self.adbdev.pull(self.andro_base_oatdump, self.host_base_oatdump_path)
         log.debug("created and pulled oatdump")
 
+    def _prepare_odex(self):
+        """
+        pulls odex and vdex to read the offsets on the host instead of running oatdump.
+        if the vdex has no dex files (uncompressed dex in the apk) the apk is pulled too, its path is returned.
+        """
+        andro_odex_path = Path(self.andro_odex_path)
+        # copy them to our dir first, because permissions, see above
+        for andro_path, host_path in (
+                    (andro_odex_path, self.host_base_odex_path),
+                    (andro_odex_path.with_suffix(".vdex"), self.host_base_vdex_path),
+                ):
+            tmpfile = self.andro_apkdir / host_path.name
+            self.adbdev.root_shell(f"cp {andro_path} {tmpfile}")
+            self.adbdev.root_shell(f"chmod o+r {tmpfile}")
+            self.adbdev.pull(tmpfile, host_path)
+        log.debug("pulled odex and vdex")
+
+        if oatfile.has_dex_files(self.host_base_vdex_path):
+            return None
+        self.adbdev.pull(self.andro_dm_path.with_suffix(".apk"), self.host_base_apk_path)
+        log.debug("vdex has no dex files, pulled apk")
+        return self.host_base_apk_path
+
     @staticmethod
-    def generate_profile_and_offsets_info(profdump_path, oatdump_path, oatdata_offset, code_coverage):
+    def generate_profile_and_offsets_info(profile_path, oatdump_path, oatdata_offset, code_coverage, parse_workers=1):
         """
         profile_info contains a parsed profile mapped based on startup/poststartup/hot methods
 
         offsets_info contains the methods we are interested in, or all, if code_coverage is set to true.
+
+        parse_workers other than 1 parse the dex locations of the oatdump in a process pool, 0 uses one per cpu.
         """
-        profile_info = Tracer.read_profdump_info(profdump_path)
-        oatdump_info = Tracer.read_oatdump_info(profile_info, oatdump_path, oatdata_offset, code_coverage)
+        profile_info = Tracer.read_profile_info(profile_path)
+        oatdump_info = Tracer.read_oatdump_info(profile_info, oatdump_path, oatdata_offset, code_coverage, workers=parse_workers)
         return profile_info, oatdump_info
 
+    @staticmethod
+    def generate_profile_and_offsets_info_from_odex(profile_path, odex_path, vdex_path, apk_path, code_coverage):
+        """
+        same as generate_profile_and_offsets_info, but the offsets are read from the odex, see oatfile.py.
+        also returns the oatdata offset from the odex, no need for readelf on the device.
+        """
+        profile_info = Tracer.read_profile_info(profile_path)
+        oatdump_info, oatdata_offset = oatfile.read_odex_info(profile_info, odex_path, vdex_path, apk_path, code_coverage)
+        return profile_info, oatdump_info, oatdata_offset
+
+    @staticmethod
+    def read_profile_info(profile_path):
+        """decodes a binary profile, or parses the output of `profman --dump-only` for one"""
+        if prof.is_prof(profile_path):
+            return prof.read_prof_info(profile_path)
+        return Tracer.read_profdump_info(profile_path)
+
     @staticmethod
     def read_profdump_info(profdump_path):
         profile_info = {
@@ -393,110 +688,25 @@ class Tracer:
                     _current_dex = line.split()[0].strip()
                 elif 'hot methods:' in line.strip():
                     methods = [int(x.split('[')[0]) for x in line.strip().split()[2:]] # hot methods have more info "36353[],"
-                    profile_info['hot'][_current_dex] = set(methods)
+                    profile_info['hot'][_current_dex] = BitmapSet.from_indices(methods)
                 elif 'post startup methods' in line.strip():
                     methods = [int(x.split(',')[0]) for x in line.strip().split()[3:]] # more words
-                    profile_info['startup'][_current_dex] = set(methods)
+                    profile_info['startup'][_current_dex] = BitmapSet.from_indices(methods)
                 elif 'startup methods' in line.strip():
                     methods = [int(x.split(',')[0]) for x in line.strip().split()[2:]]
-                    profile_info['poststartup'][_current_dex] = set(methods)
+                    profile_info['poststartup'][_current_dex] = BitmapSet.from_indices(methods)
             if _unknown_version:
                 raise NotImplementedError("got a profile dump in an unknown version, compatibility not certain.")
         log.debug("parsed profman output")
         return profile_info
 
     @staticmethod
-    def read_oatdump_info(profile_info, oatdump_path, oatdata_offset, include_nonprofile=False):
-        """[str(dex-location); int(method_idx); hexstr(offset); hexstr(oatdata_offset); int(computed_offset); str(name)]"""
-        oatdump_info = {'hot':[], 'startup':[], 'poststartup':[], 'other':[]}
-
-        # important: oatdump sometimes has non-utf-8 chars :(
-        with open(oatdump_path, errors='backslashreplace') as f:
-            cur_loc = None # dex file location
-            cur_method_idx = None # method id of dex method
-            cur_offset = None # offset in binary (before adding oatdata offset)
-            cur_method_name = None # always on same line as method idx
-
-            _magic_check = 0
-            for line in f.readlines():
-                if _magic_check == 0 and line.startswith("MAGIC:"):
-                    _magic_check = 1
-                elif _magic_check == 1 and line.startswith("oat"):
-                    _magic_check = 2
-                elif _magic_check == 2 and line.startswith("236"):
-                    _magic_check = 3
-
-                # each dex is seperate and provided as /path/to/base.apk[!classesN.dex]
-                if line.startswith("location:"):
-                    cur_loc = line.split()[1].split('/')[-1].strip()
-                    log.info(f"  reading oatdump at: {cur_loc}")
-                    cur_method_idx = None
-                    cur_offset = None
-
-                    # check early if location is in profile
-                    if cur_loc not in profile_info['hot'] and cur_loc not in profile_info['startup'] and cur_loc not in profile_info['poststartup']:
-                        # one case is that the apk got more files than the profile. in such a case we will continue to the next and skip all lines
-                        log.warning(f"found {cur_loc} in oatdump but not in profile keys (hot: {profile_info['hot'].keys()}, startup: {profile_info['startup'].keys()}, poststartup: {profile_info['poststartup'].keys()}) - skipping for now")
-                        cur_loc = "SPECIAL_SKIP"
-                        continue
-                        # FIXME sometimes it is clases.dex instead base.apk, maybe one day we can errorhandle this better
-
-                # skip dex locations that are not in profiles
-                if cur_loc == "SPECIAL_SKIP":
-                    continue
-                # if we are not in a method, we scan for methods
-                elif not cur_method_idx and (m := re.match(r"  [0-9]+: (.*)( \(dex_method_idx=)([0-9]+).*", line)):
-                    cur_method_idx = int(m.group(3))
-                    # check if it's an index we actually care about
-                    if not include_nonprofile and cur_method_idx not in profile_info['hot'][cur_loc] and cur_method_idx not in profile_info['startup'][cur_loc] and cur_method_idx not in profile_info['poststartup'][cur_loc]:
-                        cur_method_idx = None
-                        continue
-                    cur_method_name = m.group(1)
-                    cur_offset = None
-                    #log.info(line)
-                    #log.info(cur_loc, cur_method_idx, cur_method_name)
-
-                #if we are in a method and don't have the binary offset, we scan for the latter
-                elif cur_method_idx and not cur_offset and (m := re.match(r"    CODE: \(code_offset=0x([0-9a-f]+) ", line)):
-                    cur_offset = m.group(1)
-                    #log.info(line)
-                    #log.info(cur_offset)
-
-                    __loc = str(cur_loc)
-                    __mi = int(cur_method_idx)
-                    __off = f"0x{cur_offset}"
-                    __odo = f"0x{oatdata_offset:x}"
-                    __cof = (int(cur_offset, 16)+oatdata_offset)
-                    __nam = str(cur_method_name)
-
-                    # str(dex-location);int(method_idx);hexstr(offset);hexstr(oatdata_offset);int(computed_offset);str(name)
-                    __dat = (__loc, __mi, __off, __odo, __cof, __nam)
-
-                    _in_prof = False
-                    # can be optimized as it can appear in multiple sets, but it makes accessing it later easier for differentiating those cases
-                    if cur_method_idx in profile_info['hot'][cur_loc]:
-                        oatdump_info['hot'].append(__dat)
-                        _in_prof = True
-                    if cur_method_idx in profile_info['startup'][cur_loc]:
-                        oatdump_info['startup'].append(__dat)
-                        _in_prof = True
-                    if cur_method_idx in profile_info['poststartup'][cur_loc]:
-                        oatdump_info['poststartup'].append(__dat)
-                        _in_prof = True
-
-                    if not _in_prof:
-                        oatdump_info['other'].append(__dat)
-
-                    cur_method_idx = None
-
-            if _magic_check != 3:
-                raise NotImplementedError("oatdump magic does not match expected value!")
-
-        if len(oatdump_info['hot']) + len(oatdump_info['startup']) + len(oatdump_info['poststartup']) == 0:
-            raise NotImplementedError("Parsed oatdump but found 0 methods. Probably the mapping to locations failed.")
-
-        log.debug("oatdump parsed for offsets")
-        return oatdump_info
+    def read_oatdump_info(profile_info, oatdump_path, oatdata_offset, include_nonprofile=False, workers=1):
+        """[str(dex-location); int(method_idx); hexstr(offset); hexstr(oatdata_offset); int(computed_offset); str(name)]
+
+        streams the oatdump in chunks instead of reading it line by line, see oatdump.py
+        """
+        return oatdump.read_oatdump_info(profile_info, oatdump_path, oatdata_offset, include_nonprofile, workers=workers)
 
     def filter_offsets_to_trace(self,
         also_startup_poststartup,
@@ -540,10 +750,41 @@ class Tracer:
         self.adbdev.push(host_path, (_ONANDR_WRITEABLE_DIR / andro_path.name))
         self.adbdev.root_shell(f"mv {(_ONANDR_WRITEABLE_DIR / andro_path.name)} {andro_path}")
 
+    def _select_tracepoints(self):
+        """trace_info of offsets_to_trace: [(hex offset in the odex, is an apkid method)], the probes of every backend"""
+        trace_info = [] # array of tracepoints set, using oatdata offsets
+
+        counter = 0
+        _unique_offsets = set()
+        for _, _, offset, _, computed_offset, method_name in self.offsets_to_trace:
+            # sometimes functions are removed, leaving no offset to work with
+            if int(offset, 16) == 0:
+                continue
+            # sometimes multiple functions are mapped to the same offset, we only take it once
+            if computed_offset in _unique_offsets:
+                continue
+            else:
+                _unique_offsets.add(computed_offset)
+
+            counter += 1
+            if counter >= self.max_probes:
+                log.warning(f"max probes ({self.max_probes}) reached, not tracing more")
+                break
+
+            is_apkid_method = self.apkid in method_name
+            trace_info.append((hex(computed_offset), is_apkid_method))
+            # print(f"echo 'disable_event:{group}:event{counter}' > events/{group}/event{counter}/trigger") (doesn't show anything in the trace)
+            # print(f"echo 'traceoff:1' > events/{group}/event{counter}/trigger") (shows one event)
+            # print(f"echo 'disable_event:{group}:event{counter}:2 if nr_rq > 1' > events/{group}/event{counter}/trigger") (shows nothing)
+            # these all seem to not work as intended
+
+        log.info(f"tracing {len(trace_info)}/{counter} methods")
+        return trace_info
+
     def _create_tracepoints_sh(self):
         """create a .sh file that contains instructions to set up uprobes"""
 
-        trace_info = [] # array of tracepoints set, using oatdata offsets
+        trace_info = self._select_tracepoints()
 
         with open(self.host_tracepoinsts_sh, "w") as outfile:
             outfile.write(f"echo '[{_TRACEPOINTS_SH_FNAME}] starting!'\n")
@@ -556,82 +797,98 @@ class Tracer:
             outfile.write("echo > /sys/kernel/tracing/trace;\n")
             outfile.write(f"echo '[{_TRACEPOINTS_SH_FNAME}] starting setup of uprobes'\n")
 
-            counter = 0
-            _unique_offsets = set()
-            for _, _, offset, _, computed_offset, method_name in self.offsets_to_trace:
-                # sometimes functions are removed, leaving no offset to work with
-                if int(offset, 16) == 0:
-                    continue
-                # sometimes multiple functions are mapped to the same offset, we only take it once
-                if computed_offset in _unique_offsets:
-                    continue
-                else:
-                    _unique_offsets.add(computed_offset)
-
-                counter += 1
-                if counter >= self.max_probes:
-                    log.warning(f"max probes ({self.max_probes}) reached, not tracing more")
-                    break
-
-                if counter % 1000 == 0 and counter > 0:
-                    outfile.write(f"echo '[{_TRACEPOINTS_SH_FNAME}] set up {counter} probes'\n")
-                computed_offset = hex(computed_offset)
-                outfile.write(
-                    f"echo 'p:{TRACE_GROUP_NAME}/event{computed_offset} {self.andro_odex_path}:{computed_offset}' >> /sys/kernel/tracing/uprobe_events;\n"
-                )
-                is_apkid_method = self.apkid in method_name
-                trace_info.append((computed_offset, is_apkid_method))
-                # print(f"echo 'disable_event:{group}:event{counter}' > events/{group}/event{counter}/trigger") (doesn't show anything in the trace)
-                # print(f"echo 'traceoff:1' > events/{group}/event{counter}/trigger") (shows one event)
-                # print(f"echo 'disable_event:{group}:event{counter}:2 if nr_rq > 1' > events/{group}/event{counter}/trigger") (shows nothing)
-                # these all seem to not work as intended
-
-            log.info(f"tracing {len(trace_info)}/{counter} methods")
-
-            outfile.write(f"echo '[{_TRACEPOINTS_SH_FNAME}] {counter} uprobes set up, starting tracing group {TRACE_GROUP_NAME}'\n")
+            definitions = [uprobes.probe_definition(TRACE_GROUP_NAME, offset, self.andro_odex_path) for offset, _ in trace_info]
+            if self.probe_setup == "echo":
+                for counter, definition in enumerate(definitions, start=1):
+                    if counter % 1000 == 0:
+                        outfile.write(f"echo '[{_TRACEPOINTS_SH_FNAME}] set up {counter} probes'\n")
+                    outfile.write(f"echo '{definition}' >> {uprobes.UPROBE_EVENTS};\n")
+
+            if self.probe_setup == "bulk":
+                packed = uprobes.pack_definitions(definitions)
+                with open(self.host_uprobes_path, "wb") as f:
+                    f.write(packed)
+                outfile.write(uprobes.register_script(
+                        self.andro_uprobes_path,
+                        uprobes.num_blocks(len(packed)),
+                        log_prefix=f"[{_TRACEPOINTS_SH_FNAME}] "))
+
+            # the number actually registered, the host reports the setup rate with it
+            outfile.write(f"echo '[{_TRACEPOINTS_SH_FNAME}] '$(grep -c '^p:{TRACE_GROUP_NAME}/' {uprobes.UPROBE_EVENTS})' uprobes set up, starting tracing group {TRACE_GROUP_NAME}'\n")
             outfile.write(f"echo 1 > /sys/kernel/tracing/events/{TRACE_GROUP_NAME}/enable;\n")
+            if self.capture == "raw":
+                self._write_raw_capture_metadata(outfile)
+            elif self.capture == "aggregate":
+                outfile.write(uprobes.first_hit_triggers_script(TRACE_GROUP_NAME, log_prefix=f"[{_TRACEPOINTS_SH_FNAME}] "))
             outfile.write(f"echo '[{_TRACEPOINTS_SH_FNAME}] tracing set up, ready for on and app start'\n")
-            outfile.write(f'tail -f -n +1 /sys/kernel/tracing/trace_pipe > {self.andro_raw_output_path} \n')
+            if self.capture == "raw":
+                # one reader per cpu, the pages are copied as they are, the kernel formats nothing
+                outfile.write("for cpu in /sys/kernel/tracing/per_cpu/cpu*; do\n")
+                outfile.write(f"  cat $cpu/trace_pipe_raw > {self.andro_apkdir}/raw_${{cpu##*/}}.bin &\n")
+                outfile.write("done\n")
+                outfile.write("wait\n")
+            elif self.capture in ("text", "aggregate"):
+                outfile.write(f'tail -f -n +1 /sys/kernel/tracing/trace_pipe > {self.andro_raw_output_path} \n')
+            # for stream the host reads trace_pipe itself once tracing is on, see _start_trace_stream
 
         self.trace_info = trace_info
 
+    def _write_raw_capture_metadata(self, outfile):
+        """what ringbuffer.read_capture needs next to the pages to decode them, see ringbuffer.py"""
+        events = f"/sys/kernel/tracing/events/{TRACE_GROUP_NAME}"
+        outfile.write(f"cat /sys/kernel/tracing/events/header_page > {self.andro_apkdir / ringbuffer.HEADER_PAGE_FNAME}\n")
+        # the common fields are the same for every event, one format is enough
+        outfile.write(f"for e in {events}/event*; do cat $e/format > {self.andro_apkdir / ringbuffer.FORMAT_FNAME}; break; done\n")
+        outfile.write(f"for e in {events}/event*; do read id < $e/id; echo \"${{e##*/}} $id\"; done > {self.andro_apkdir / ringbuffer.EVENT_IDS_FNAME}\n")
+        # pids of the trace are named from saved_cmdlines later, keep more than the default 128 around
+        outfile.write("echo 8192 > /sys/kernel/tracing/saved_cmdlines_size 2> /dev/null\n")
+
     # TOOLS START HERE ----------------------------------------------
 
+    @staticmethod
+    def _monkey_stopped(line):
+        return "Monkey aborted due to error" in line or "Events injected" in line
+
     def _monkey_callback_print(self, line):
-        if "Monkey aborted due to error" in line or "Events injected" in line:
-            self._should_stop_monkey = True
         if line.startswith("Got IOException") or "// Injection Failed" in line or "activityResuming" in line or line.strip() == "":
             return # swallow these things, very verbose
         log.debug(f"MONKEY: {line.rstrip()}")
 
-    def run_monkey(self, max_runtime):
-        self._should_stop_monkey = False
+    def _device_argv(self, *args):
+        return ["adb", "-s", self.device_id, *args]
+
+    def _root_exec_argv(self, cmd):
+        """argv that runs cmd as root on the device, its output streamed to us"""
+        # exec-out is a non-buffering mode for adbdev to react to output
+        # this is hacky because undocumented, but whatever. google does it the same way lol
+        if self._use_adb_root: # IDK why emu and hw are different here. This is another hack that works. sue me. # TODO is this still relevant?
+            return self._device_argv("exec-out", cmd)
+        return self._device_argv("exec-out", "su", "-c", f"'{cmd}'")
 
+    def _run_tool_proc(self, name, proc, max_runtime, stop=None):
+        """wait until the tool ran for max_runtime, or exited or printed a stop line before"""
+        log.info("waiting for timeout")
+        if self._supervisor.run(proc.run_for(max_runtime, stop)):
+            log.warning(f"uh-oh, {name} terminated earlier than expected")
+
+    def _kill_tool_proc(self, name, proc):
+        log.info(f"waiting for {name} process to get killed")
+        self._supervisor.run(proc.kill())
 
+    def run_monkey(self, max_runtime):
         monkeycmd = f"monkey -p {self.apkid} -s 20240412 --throttle 1000 --ignore-crashes --kill-process-after-error --ignore-security-exceptions 10000000" # seed with date
 
         log.info(f"starting monkey as: {monkeycmd}")
 
-        proc_monkey = self.adbdev.adb("exec-out", monkeycmd, _bg=True, _bg_exc=False,  _out=lambda x: self._monkey_callback_print(x))
-
-        log.info("waiting for timeout")
-        time_in_monkey = 0
-        while time_in_monkey < max_runtime:
-            time.sleep(1)
-            time_in_monkey+=1
-            if self._should_stop_monkey:
-                log.warning("uh-oh, monkey terminated earlier than expected")
-                break
+        proc_monkey = self._supervisor.spawn(self._device_argv("exec-out", monkeycmd), self._monkey_callback_print)
+        self._run_tool_proc("monkey", proc_monkey, max_runtime, Tracer._monkey_stopped)
 
+        # killing the local adb does not stop monkey on the device
         try:
             self.adbdev.root_shell("kill -9 \\`pgrep monkey\\`")
-            proc_monkey.signal(signal.SIGKILL) # TODO didn't work during testing so above added. figure out why
-            log.info("waiting for monkey process to get killed")
-            proc_monkey.wait()
-        except sh.SignalException_SIGKILL:
-            log.info("handled expected sigkill exception of monkey process")
-        except ProcessLookupError:
-                log.info("handled expected ProcessLookupError if monkey terminated early.")
+        except sh.ErrorReturnCode_1:
+            log.info("handled expected fail of kill when monkey already terminated")
+        self._kill_tool_proc("monkey", proc_monkey)
 
     def _droidbot_callback_print(self, line):
         if line.strip() == "":
@@ -639,9 +896,6 @@ class Tracer:
         log.debug(f"DROIDBOT: {line.rstrip()}")
 
     def run_droidbot(self, max_runtime):
-        # shitty impl because it does arg parsing
-        from sh import droidbot
-
         if not self.apks_dm_dir:
             raise NotImplementedError("droidbot needs access to apk files")
 
@@ -650,40 +904,23 @@ class Tracer:
         outdir = self._host_res_tmpdir / "_droidbot_res"
         outdir.mkdir(exist_ok=True)
 
-        self._should_stop_bot=False
-
-        cmd = ["-d", self.device_id,
+        cmd = ["droidbot",
+               "-d", self.device_id,
                "-a", apk_path,
                "-o", outdir,
                "-t", max_runtime,
         ]
         cmd = [str(x) for x in cmd] # Path to str >(
-        log.info(f"running droidbot as droidbot {' '.join(cmd)}")
-        proc_droidbot = droidbot(*cmd, _bg=True, _bg_exc=False,
-                 _out=lambda x: self._droidbot_callback_print(x),
-                 _err_to_out=True)
+        log.info(f"running droidbot as {' '.join(cmd)}")
+        proc_droidbot = self._supervisor.spawn(cmd, self._droidbot_callback_print)
+        self._run_tool_proc("droidbot", proc_droidbot, max_runtime)
+        self._kill_tool_proc("droidbot", proc_droidbot)
 
-        log.info("waiting for timeout")
-        time_in_bot = 0
-        while time_in_bot< max_runtime:
-            time.sleep(1)
-            time_in_bot+=1
-            if self._should_stop_bot:
-                log.warning("uh-oh, droidbot terminated earlier than expected")
-                break
-
-        try:
-            proc_droidbot.signal(signal.SIGKILL)
-            log.info("waiting for droidbot process to get killed")
-            proc_droidbot.wait()
-        except sh.SignalException_SIGKILL:
-            log.info("handled expected sigkill exception of droidbot process")
-        except ProcessLookupError:
-                log.info("handled expected ProcessLookupError if droidbot terminated early.")
+    @staticmethod
+    def _fastbot_stopped(line):
+        return "aborted due to error" in line or "Events injected" in line
 
     def _fastbot_callback_print(self, line):
-        if "aborted due to error" in line or "Events injected" in line:
-            self._should_stop_fastbot = True
         if "  event time:" in line \
                 or " rpc cost time: " in line \
                 or " action type: " in line \
@@ -695,8 +932,6 @@ class Tracer:
         log.debug(f"FASTBOT: {line.rstrip()}")
 
     def run_fastbot(self, max_runtime):
-        self._should_stop_fastbot = False
-
         log.warning("TODO: implement checking and pushing fastbot files if necessary") # TODO
 
         _run_minutes = max_runtime/60
@@ -708,7 +943,7 @@ class Tracer:
         # we use exec-out to stream the output and add a seed
         # verbosity removed since it doesn't do much
         # otherwise it's the same
-        proc_fastbot = self.adbdev.adb("exec-out",
+        proc_fastbot = self._supervisor.spawn(self._device_argv("exec-out",
                         "CLASSPATH=/sdcard/monkeyq.jar:/sdcard/framework.jar:/sdcard/fastbot-thirdpart.jar",
                         "exec", "app_process",
                         "/system/bin", "com.android.commands.monkey.Monkey",
@@ -716,33 +951,16 @@ class Tracer:
                         "-s", "20240412",
                         "--agent", "reuseq",
                         "--running-minutes", str(int(_run_minutes)),
-                        "--throttle", "1000",
-                        _bg=True,
-                        _bg_exc=False,
-                        _out=lambda x: self._fastbot_callback_print(x))
-
-        log.info("waiting for timeout")
-        time_in_fastbot = 0
-        while time_in_fastbot < max_runtime:
-            time.sleep(1)
-            time_in_fastbot+=1
-            if self._should_stop_fastbot:
-                log.warning("uh-oh, fastbot terminated earlier than expected")
-                break
+                        "--throttle", "1000"),
+                        self._fastbot_callback_print)
+        self._run_tool_proc("fastbot", proc_fastbot, max_runtime, Tracer._fastbot_stopped)
 
         try:
             self.adbdev.root_shell("kill -9 \\`pgrep monkey\\`") # fastbot based on monkey
         except sh.ErrorReturnCode_1:
             log.info("handled expected fail of kill when if fastbot already terminated")
 
-        try:
-            proc_fastbot.signal(signal.SIGKILL) # TODO didn't work during testing so above added. figure out why, see monkey
-            log.info("waiting for fastbot process to get killed")
-            proc_fastbot.wait()
-        except sh.SignalException_SIGKILL:
-            log.info("handled expected sigkill exception of fastbot process")
-        except ProcessLookupError:
-            log.info("handled expected ProcessLookupError if fastbot terminated early.")
+        self._kill_tool_proc("fastbot", proc_fastbot)
 
     # TOOLS END HERE ------------------------------------------------
 
@@ -771,12 +989,20 @@ class Tracer:
         #    if len(self._raw_hit_uprobes) % 5000 == 0:
         #        log.debug(f"hit {len(self._raw_hit_uprobes)} total uprobes")
         #    return
-        if "tracing set up, ready for on and app start" in line:
-            log.debug(f"{line.rstrip()}")
-            log.debug("setting /sys/kernel/tracing/tracing_on to 1")
-            self.adbdev.root_shell("echo 1 > /sys/kernel/tracing/tracing_on")
-            self._canStartTool = True
-            return
+        if "starting setup of uprobes" in line:
+            self._probe_setup_start = time.monotonic()
+        elif "uprobes set up, starting tracing group" in line and self._probe_setup_start is not None:
+            took = time.monotonic() - self._probe_setup_start
+            registered = int(line.split("]", 1)[1].split()[0])
+            log.info(f"registered {registered}/{len(self.trace_info)} uprobes in {took:.1f}s ({registered / max(took, 1e-3):.0f} probes/s)")
+            if registered < len(self.trace_info):
+                log.warning(f"{len(self.trace_info) - registered} uprobes failed to register")
+        log.debug(f"{line.rstrip()}")
+
+    def _bpf_tracer_callback_print(self, line):
+        """output of the bpf tracer, see bpfmap.py"""
+        if bpfmap.READY_LINE in line:
+            log.info(f"{len(self.trace_info)} bpf probes attached")
         log.debug(f"{line.rstrip()}")
 
     def _trace_activities_callback(self, line):
@@ -792,28 +1018,35 @@ class Tracer:
             self.traced_activities_set.add(activity)
 
     def _start_tracing(self, also_trace_activities):
-        self._canStartTool = False
-        self._canEndEmulator = False
-
         tracecmd = f"{self.andro_tracepoints_sh}"
+        callback = self._tracer_callback_print
+        ready_line = "tracing set up, ready for on and app start"
+        if self.trace_backend == "bpf":
+            tracecmd = f"{self.andro_bpf_tracer} {self.andro_odex_path} {self.andro_offsets_path} {self.andro_map_dump_path}"
+            callback = self._bpf_tracer_callback_print
+            ready_line = bpfmap.READY_LINE
         log.info(f"starting tracer with command: {tracecmd}")
 
-        # exec-out is a non-buffering mode for adbdev to react to output
-        # this is hacky because undocumented, but whatever. google does it the same way lol
-        if self._use_adb_root: # IDK why emu and hw are different here. This is another hack that works. sue me. # TODO is this still relevant?
-            proc_tracer = self.adbdev.adb("exec-out", tracecmd, _bg=True, _bg_exc=False,  _out=lambda x: self._tracer_callback_print(x))
-        else:
-            proc_tracer = self.adbdev.adb("exec-out", "su", "-c", tracecmd, _bg=True, _bg_exc=False,  _out=lambda x: self._tracer_callback_print(x))
+        self._proc_tracer = supervisor.Proc(self._root_exec_argv(tracecmd), callback)
+        ready = self._supervisor.call(self._proc_tracer.expect, lambda line: ready_line in line)
+        self._supervisor.run(self._proc_tracer.start())
 
         # wait for expected output from tracer to start app
         log.debug("waiting for tracer to signal ready")
-        grace = _TIMEOUT_FOR_PROBE_SETUP
-        while not self._canStartTool:
-            time.sleep(1)
-            grace -= 1
-            if grace < 0:
-                proc_tracer.signal(signal.SIGKILL) # TODO can this actually kill the scrip withthe uprobest?
-                raise NotImplementedError(f"setting up tracer probes took more than {_TIMEOUT_FOR_PROBE_SETUP}s, aborting")
+        try:
+            line = self._supervisor.run(asyncio.wait_for(ready, _TIMEOUT_FOR_PROBE_SETUP))
+        except asyncio.TimeoutError:
+            self._supervisor.run(self._proc_tracer.kill()) # TODO can this actually kill the scrip withthe uprobest?
+            raise NotImplementedError(f"setting up tracer probes took more than {_TIMEOUT_FOR_PROBE_SETUP}s, aborting") from None
+        if line is None:
+            raise NotImplementedError(f"tracer exited with {self._proc_tracer.returncode} before it was ready")
+        log.debug(f"{line.rstrip()}")
+        if self.trace_backend == "events":
+            log.debug("setting /sys/kernel/tracing/tracing_on to 1")
+            self.adbdev.root_shell("echo 1 > /sys/kernel/tracing/tracing_on")
+
+        if self.capture == "stream":
+            self._start_trace_stream()
 
         self._activities_starttime = None
         self._proc_activities = None
@@ -823,7 +1056,7 @@ class Tracer:
             activities_tracecmd = "sh -c 'while true; do dumpsys activity a | grep topResumedActivity; sleep 0.5; done'"
 
             self._activities_starttime = datetime.now()
-            self._proc_activities = self.adbdev.adb("exec-out", activities_tracecmd, _bg=True, _bg_exc=False,  _out=lambda x: self._trace_activities_callback(x))
+            self._proc_activities = self._supervisor.spawn(self._device_argv("exec-out", activities_tracecmd), self._trace_activities_callback)
 
             # finally wake up display so we can actually get activities
             self.adbdev.shell("input keyevent KEYCODE_WAKEUP")
@@ -832,18 +1065,39 @@ class Tracer:
             time.sleep(0.5)
 
 
+    def _start_trace_stream(self):
+        """read trace_pipe on host while the tool runs, checkpointed to the host raw output, see tracestream.py"""
+        argv = self._root_exec_argv("cat /sys/kernel/tracing/trace_pipe")
+        self._trace_stream = tracestream.TraceStream(argv, self.host_raw_output_path)
+        self._trace_stream.start()
+
+    def _start_retirement(self):
+        """disable the probes that were hit while the tool runs, see retirement.py"""
+        self._retirer = retirement.ProbeRetirer(
+                self._trace_stream.take_new_probes,
+                self._disable_probes,
+                [offset for offset, _ in self.trace_info])
+        self._retirer.start()
+
+    def _root_exec(self, script):
+        """run script as root in one adb call, returns its output. no single quotes in script"""
+        if self._use_adb_root:
+            return str(self.adbdev.adb("exec-out", script))
+        return str(self.adbdev.adb("exec-out", "su", "-c", f"'{script}'"))
+
+    def _disable_probes(self, offsets):
+        self._root_exec(uprobes.disable_events_script(TRACE_GROUP_NAME, offsets))
+
     def _stop_tracing(self):
-        """turn tracing off but don't clean up the uprobes - reboot handles this."""
+        """turn tracing off but don't clean up the uprobes - reset_device handles this."""
         log.debug("turning tracing off")
         self.adbdev.adb("exec-out", "su", "-c", "echo 0 > /sys/kernel/tracing/tracing_on")
+        if self.trace_backend == "bpf":
+            self._stop_bpf_tracer()
 
         if self._activities_starttime:
             log.info("tearing down activity tracing")
-            with contextlib.suppress(sh.ErrorReturnCode_1):
-                try:
-                    self._proc_activities.signal(signal.SIGKILL)
-                except ProcessLookupError:
-                    log.warning("could not close activity dumpsys")
+            self._supervisor.run(self._proc_activities.kill())
             log.info(f"found {len(self.traced_activities)} activites in foreground during run.")
 
         # TODO test on emulaotr, do we need to wait with uprobes?
@@ -856,6 +1110,18 @@ class Tracer:
         #        log.info("grace period for tracer ended")
         #        break
 
+    def _stop_bpf_tracer(self, timeout=30):
+        """SIGINT makes the bpf tracer dump its map, wait for it"""
+        dumped = self._supervisor.call(self._proc_tracer.expect, lambda line: bpfmap.DUMPED_LINE in line)
+        self.adbdev.root_shell(f"killall -2 {self.andro_bpf_tracer.name}")
+        try:
+            line = self._supervisor.run(asyncio.wait_for(dumped, timeout))
+        except asyncio.TimeoutError:
+            raise NotImplementedError(f"bpf tracer did not dump its map within {timeout}s") from None
+        if line is None:
+            raise NotImplementedError(f"bpf tracer exited with {self._proc_tracer.returncode} without dumping its map")
+        log.debug("bpf tracer dumped its map")
+
     def run_tracer(self, tool="time", max_runtime=5, also_trace_activities=False):
         """start the tracer and the tool to be evaluated"""
         if tool not in _SUPPORTED_TOOLS:
@@ -868,97 +1134,117 @@ class Tracer:
             log.debug("killing app if it runs")
             self.adbdev.root_shell("killall", self.apkid) # TODO check if running
 
+        self.probe_retired = None
         self._start_tracing(also_trace_activities)
-        self._run_tool(tool, max_runtime)
+        if self.retire_probes:
+            self._start_retirement()
+        try:
+            self._run_tool(tool, max_runtime)
+        finally:
+            if self._retirer is not None:
+                self.probe_retired = self._retirer.stop()
+                self._retirer = None
         self._stop_tracing()
 
         log.info("done tracing")
 
     @staticmethod
-    def parse_raw_hit_uprobes(raw_output_path):
-
-        first_probe_hit_time = None
-        hit_uprobes = []
-        total_lost_events = 0
-
-        with open(raw_output_path) as f:
-            for line in f.readlines():
-                line = line.rstrip()
-                # bpf can have lost events, handle those
-                if "LOST" in line and "EVENTS" in line:
-                    #log.debug(f"lost events: {line}")
-                    with contextlib.suppress(ValueError):
-                        total_lost_events += int(line.split()[-2])
-                    continue
-                elif " bpf_trace_printk: " in line:
-                    # ignore kerneltraces
-                    continue
-                # check expected layout:
-                # "app.organicmaps-24536   [002] .....  4423.725704: event0x1d96b0: (0x6e16e3e6b0)"
-                # "AsyncTask #2-10249 [005] ..... 184.273432: event0xa4610: (0x767e1bc610)" -> process name can have space!
-                if "event0x" not in line or "[" not in line:
-                    log.warning(f"unexpected raw line: '{line}'")
-                    continue
-                name_n_other = line.split("[")
-                if len(name_n_other) != 2:
-                    log.warning(f"multiple '[' found, assuming part of name: {name_n_other}")
-                parts = name_n_other[-1].split()
-
-                # get process name
-                pname = ' '.join(name_n_other[:-1]).strip()
-                if "-" not in pname:
-                    log.warning(f"no process name in line: '{line}'")
-                    continue
-
-                # get timestamp
-                if parts[2][-1] != ':':
-                    log.warning(f"timestamp format wrong in line: '{line}'")
-                    continue
-                try:
-                    timestamp = float(parts[2][:-1])
-                except ValueError:
-                    log.warning(f"timestamp format not float in line: '{line}'")
-                    continue
-                if not first_probe_hit_time:
-                    first_probe_hit_time = timestamp
-                timestamp = timestamp - first_probe_hit_time
-
-                # get offset
-                if parts[3][:7] != "event0x" or parts[3][-1] != ':':
-                    log.warning(f"event tag wrong in line: '{line}'")
-                    continue
-                try:
-                    computed_offset = parts[3][5:-1]
-                    int(computed_offset, 16)
-                except ValueError:
-                    log.waring(f"offset not an int in line: '{line}'")
-                    continue
-                # put in list
-                hit_uprobes.append((pname, timestamp, computed_offset))
+    def parse_raw_hit_uprobes(raw_output_path, trace_info):
+        """rawtrace.HitRecords of every hit, with probe indices into trace_info and timestamps relative to the first hit"""
+        trace = rawtrace.read_raw_trace(raw_output_path)
+        hit_uprobes = trace.to_hit_records(trace_info)
 
         log.info(f"processed {len(hit_uprobes)} events")
-        log.info(f"total lost events: {total_lost_events}")
+        log.info(f"total lost events: {trace.lost_events}")
+        return hit_uprobes
+
+    def _pull_raw_capture(self):
+        """pull the per cpu pages and their metadata, see _write_raw_capture_metadata"""
+        self.adbdev.root_shell(f"cat /sys/kernel/tracing/saved_cmdlines > {self.andro_apkdir / ringbuffer.SAVED_CMDLINES_FNAME}")
+        # let the readers write out what tracing_on = 0 flushed
+        time.sleep(1)
+        self.host_raw_capture_dir.mkdir(parents=True, exist_ok=True)
+        for old in self.host_raw_capture_dir.glob(ringbuffer.CPU_GLOB):
+            old.unlink()
+        cpu_files = self.adbdev.root_shell(f"ls {self.andro_apkdir}/{ringbuffer.CPU_GLOB}").split()
+        metadata = [ringbuffer.HEADER_PAGE_FNAME, ringbuffer.FORMAT_FNAME, ringbuffer.EVENT_IDS_FNAME, ringbuffer.SAVED_CMDLINES_FNAME]
+        for andro_path in [*cpu_files, *(str(self.andro_apkdir / name) for name in metadata)]:
+            self._pull(andro_path, self.host_raw_capture_dir / Path(andro_path).name)
+
+    def _parse_raw_capture(self):
+        """decode what _pull_raw_capture pulled"""
+        trace = ringbuffer.read_capture(self.host_raw_capture_dir)
+        hit_uprobes = trace.to_hit_records(self.trace_info)
+        log.info(f"processed {len(hit_uprobes)} events from {len(list(self.host_raw_capture_dir.glob(ringbuffer.CPU_GLOB)))} cpus")
+        log.info(f"total lost events: {trace.lost_events}")
         return hit_uprobes
 
+    def _pull_uprobe_profile(self):
+        andro_path = self.andro_apkdir / _UPROBE_PROFILE_FNAME
+        self.adbdev.root_shell(f"cat {uprobes.UPROBE_PROFILE} > {andro_path}")
+        self.adbdev.pull(andro_path, self._host_res_tmpdir / _UPROBE_PROFILE_FNAME)
+
+    def _read_hitcounts(self, probes):
+        """hits of each of probes, as the kernel counted them in uprobe_profile"""
+        hits = uprobes.read_uprobe_profile(self._host_res_tmpdir / _UPROBE_PROFILE_FNAME, self.andro_odex_path)
+        hitcount = [hits.get(int(p, 16), 0) for p in probes]
+        log.info(f"{sum(1 for h in hitcount if h)}/{len(probes)} probes hit {sum(hitcount)} times in total")
+        return hitcount
+
     def save_results(self):
         """write results to file and print summary."""
+        self.collect_results()
+        self.write_results()
+
+    def collect_results(self):
+        """the device part of save_results: get everything write_results needs to the host"""
+        if self.trace_backend == "bpf":
+            self.adbdev.pull(self.andro_map_dump_path, self.host_map_dump_path)
+        elif self.capture == "raw":
+            self._pull_raw_capture()
+        elif self.capture == "stream":
+            # everything is on host already, only the rest of the pipe is left
+            self._streamed_trace = self._trace_stream.stop()
+            self._trace_stream = None
+        else:
+            self._pull(self.andro_raw_output_path, self.host_raw_output_path)
+
+        if self.trace_backend == "events" and self.capture == "aggregate":
+            self._pull_uprobe_profile()
+
+    def write_results(self):
+        """the host part of save_results, no device needed: parse what collect_results got and write the result"""
         log.debug(f"saving results as {self.host_output_path}")
 
-        self.adbdev.pull(self.andro_raw_output_path, self.host_raw_output_path)
+        probe_hitcount = None
+        if self.trace_backend == "bpf":
+            hit_uprobes, probe_hitcount = bpfmap.read_map_dump(self.host_map_dump_path, self.trace_info)
+        elif self.capture == "raw":
+            hit_uprobes = self._parse_raw_capture()
+        elif self.capture == "stream":
+            trace = self._streamed_trace
+            self._streamed_trace = None
+            hit_uprobes = trace.to_hit_records(self.trace_info)
+            log.info(f"processed {len(hit_uprobes)} events")
+            log.info(f"total lost events: {trace.lost_events}")
+        else:
+            hit_uprobes = Tracer.parse_raw_hit_uprobes(self.host_raw_output_path, self.trace_info)
 
-        hit_uprobes = Tracer.parse_raw_hit_uprobes(self.host_raw_output_path)
+        if self.trace_backend == "events" and self.capture == "aggregate":
+            probe_hitcount = self._read_hitcounts(hit_uprobes.probes)
 
-        results = (
+        # columnar, see resultdir.py. results used to be pickled as one tuple of these to result.pickle
+        resultdir.write_result(
+                self.host_output_path,
                 self.profile_info,
                 self.offsets_info,
                 self.trace_info,
                 self.traced_activities,
-                hit_uprobes
+                hit_uprobes,
+                probe_hitcount,
+                self.probe_retired,
             )
 
-        with open(self.host_output_path, "wb") as f:
-            pickle.dump(results, f)
-
     def cleanup_android(self):
         """delete artifacts on device"""
         log.debug("cleaning up android")
@@ -973,35 +1259,91 @@ class Tracer:
         log.debug("cleaning up host")
         sh.rm("-r", self._host_res_tmpdir)
 
+    def soft_reset(self):
+        """
+        undo what the run did to the tracefs and kill the app and the tracer, without a reboot.
+        returns what is still not clean afterwards, empty if the device is as good as rebooted
+        """
+        log.debug("soft resetting")
+        for proc in (self._proc_tracer, self._proc_activities):
+            if proc is not None:
+                self._supervisor.run(proc.kill())
+        self._proc_tracer = self._proc_activities = None
+        if self._trace_stream is not None:
+            # a run that failed before its results were collected
+            self._trace_stream.stop(idle=0)
+            self._trace_stream = None
+        processes = [_TRACEPOINTS_SH_FNAME, _BPF_TRACER_FNAME, "trace_pipe"]
+        self._root_exec(softreset.reset_script(TRACE_GROUP_NAME, self.apkid, processes))
+        state = softreset.parse_state(self._root_exec(softreset.state_script(TRACE_GROUP_NAME, self.apkid, processes)))
+        return softreset.dirty(state)
+
+    def is_healthy(self):
+        """the device is listed, answers and finished booting"""
+        try:
+            check_device_ok(self.device_id)
+            return self.adbdev.shell("getprop sys.boot_completed").strip() == "1"
+        except Exception as e:
+            log.warning(f"health check failed: {e}")
+            return False
+
+    def reset_device(self, reboot_every=_REBOOT_EVERY):
+        """
+        clean up the device after an app: cleanup_android and a soft reset, a reboot only every reboot_every
+        apps since the last boot (0 never), or if the soft reset left the device dirty or unhealthy.
+        returns if it rebooted
+        """
+        self.cleanup_android()
+        reason = None
+        try:
+            left = self.soft_reset()
+            if left:
+                reason = f"soft reset left {', '.join(left)}"
+            elif not self.is_healthy():
+                reason = "device not healthy after the soft reset"
+            elif reboot_every:
+                apps = int(self._root_exec(softreset.count_app_script(self.andro_tmpdir / _APPS_SINCE_BOOT_FNAME)).strip())
+                if apps >= reboot_every:
+                    reason = f"{apps} apps since the last boot"
+        except Exception as e:
+            reason = f"soft reset failed: {e}"
+        if reason is None:
+            log.info("soft reset done")
+            return False
+        log.info(f"rebooting, {reason}")
+        self.reboot_and_wait_ok()
+        return True
+
     def reboot_and_wait_ok(self, timeout=60):
-        """reboot the device afterwards an wait for it to come back in 60 seconds"""
+        """reboot the device afterwards an wait for it to come back and finish booting in 60 seconds"""
         log.debug("rebooting")
         try:
             self.adbdev.shell("reboot")
-        except sh.ErrorReturnCode_255:
+        except (sh.ErrorReturnCode_255, ShellSessionError, AdbError):
+            # a persistent shell just dies with the device, the socket backend loses its connection before the exit packet
             log.debug("got expected returncode 255 from reboot, waiting for device to pop back up")
         except Exception as e:
             raise NotImplementedError("failed to handle reboot error") from e
 
-        grace = timeout
-        while True:
-            time.sleep(1)
-            grace -= 1
-            with contextlib.suppress(sh.ErrorReturnCode_1):
-                self.adbdev.shell("echo hi")
-                break
-            if grace < 0:
-                log.critical("grace period for reboot ended")
-                raise NotImplementedError(f"failed to reboot in {timeout}s")
-        log.info("reboot complete, waiting 10s to settle")
-        time.sleep(10)
+        # sys.boot_completed is what the 10s of settling after the first "echo hi" waited for
+        try:
+            self._supervisor.run(supervisor.boot_completed(self.device_id, timeout))
+        except asyncio.TimeoutError:
+            log.critical("grace period for reboot ended")
+            raise NotImplementedError(f"failed to reboot in {timeout}s") from None
+        # the persistent shells died with the device, don't make the next call find out
+        self.adbdev.close_sessions()
+        log.info("reboot complete")
 
 @click.command()
-@click.argument('apkid')
+@click.argument('apkid', required=False)
+@click.option("--pipeline-apps", default=None, type=click.Path(exists=True, dir_okay=False, path_type=Path), help="instead of APKID, run every app in this file (one per line) on the device, the host work of the next and the last app overlaps with each run. {} in --fresh-install is the app")
 @click.option("--verbose", default=False, is_flag=True)
 @click.option('--device-id', default="emulator-5555", help="serial or emulaotor name. ignored when --emulator-config is set.")
 @click.option("--emulator-config", default=None, type=click.Path(dir_okay=False, path_type=Path), help="use emulatorCTRL with given config file")
 @click.option("--use-adb-root", default=False, is_flag=True, help="use adb root instead of adb sh su. if emulator-config given, read from there.")
+@click.option("--persistent-shell", default=False, is_flag=True, help="run shell commands in one long lived adb shell instead of an adb process each")
+@click.option("--adb-backend", default=BACKENDS[0], type=click.Choice(BACKENDS), help="fork the adb binary, or talk to the adb server socket directly")
 @click.option("--slot", default=0, help="for parallelization, adds to emulator port")
 @click.option("--android-tmpdir", default=_ONANDR_TMPDIR, type=click.Path(file_okay=False, path_type=Path), help="directory for files on android")
 @click.option("--max-probes", default=_DEFAULT_MAX_PROBES, help="limit probe numbers for stability")
@@ -1019,12 +1361,24 @@ class Tracer:
 @click.option("--buffer-size-kb", default=None, help="set uprobe buffer size in /sys/kernel/tracing/buffer_size_kb. increase to avoid lost events")
 @click.option("--buffer-percent", default=None, help="set when uprobe buffer starts reading in /sys/kernel/tracing/buffer_percent. decrease to avoid read spikes")
 @click.option("--force-wifi", default=None, help="make sure we are connected to wifi as 'ssid wpa2 passwd', see `cmd -w wifi help` for more info")
+@click.option("--parse-workers", default=1, help="processes for parsing the oatdump, one dex location each. 0 uses one per cpu")
+@click.option("--offsets-source", default=_OFFSETS_SOURCES[0], type=click.Choice(_OFFSETS_SOURCES), help="oatdump on device, or read the pulled odex on host")
+@click.option("--probe-setup", default=_PROBE_SETUPS[0], type=click.Choice(_PROBE_SETUPS), help="register the uprobes in large batched writes, or one echo each")
+@click.option("--reboot-every", default=_REBOOT_EVERY, help=f"reboot a hardware device after this many apps (default {_REBOOT_EVERY}), it is only soft reset after the others (and rebooted if that fails). 1 reboots after every app, 0 only on failures")
+@click.option("--retire-probes", default=False, is_flag=True, help="disable probes once they were hit, while the tool runs (needs --capture stream)")
+@click.option("--capture", default=_CAPTURES[0], type=click.Choice(_CAPTURES), help="read the trace as text from trace_pipe, the binary pages of every cpu from trace_pipe_raw, stream trace_pipe to host during the run, or log only first hits and count in the kernel")
+@click.option("--compress-transfer", default=False, is_flag=True, help="gzip the oatdump and the trace on the device before pulling them, they stay gzipped on host")
+@click.option("--device-cache", default=None, type=click.Path(file_okay=False, path_type=Path), help="directory to cache device and install facts in, keyed by build fingerprint, share it between all workers on a host")
+@click.option("--offsets-cache", default=None, type=click.Path(file_okay=False, path_type=Path), help="directory to cache profile and offsets info in, share it between all workers on a host")
 def main(
             apkid,
+            pipeline_apps,
             verbose,
             device_id,
             emulator_config,
             use_adb_root,
+            persistent_shell,
+            adb_backend,
             slot,
             android_tmpdir,
             max_probes,
@@ -1040,7 +1394,16 @@ def main(
             also_trace_activities,
             buffer_size_kb,
             buffer_percent,
-            force_wifi
+            force_wifi,
+            parse_workers,
+            offsets_source,
+            offsets_cache,
+            device_cache,
+            probe_setup,
+            capture,
+            compress_transfer,
+            retire_probes,
+            reboot_every,
         ):
     """
     The Tracer assumes `adb -s <device_id>` can connect to the device and we have root.
@@ -1055,7 +1418,7 @@ def main(
     - (at this point we assume we have an oat file for the app)
     - generate tracepoints.sh
         - read DM and grab profile methods
-        - oatdump oat and grab 1. oat offset and 2. offsets of profile methods
+        - oatdump oat (or read the pulled odex on host) and grab 1. oat offset and 2. offsets of profile methods
         - create info.json containing method <-> event mapping + method metadata
         - create tracepoints.sh settinung up all the events
         - push tracepoints.sh to device
@@ -1067,22 +1430,76 @@ def main(
         - terminate dynamic tool
         - tear down uprobes
         - collect results
-    - reboot if hw device
+    - soft reset if hw device, reboot every --reboot-every apps or if that fails
+
+    with --pipeline-apps, all apps run on one device in a batch, see pipeline.py.
     """
-    global log
     emu = None
     retcode = 0
 
     if verbose:
-        log.setLevel(logging.DEBUG)
+        pkglog.setLevel(logging.DEBUG)
 
     log.debug("starting aproftracer")
 
+    if (apkid is None) == (pipeline_apps is None):
+        raise click.UsageError("give either APKID or --pipeline-apps")
+
+    tracer_kwargs = {
+            "use_adb_root": use_adb_root,
+            "persistent_shell": persistent_shell,
+            "adb_backend": adb_backend,
+            "android_tmpdir": android_tmpdir,
+            "host_result_dir": result_dir,
+            "max_probes": max_probes,
+            "buffer_size_kb": buffer_size_kb,
+            "buffer_percent": buffer_percent,
+            "force_wifi": force_wifi,
+            "parse_workers": parse_workers,
+            "offsets_source": offsets_source,
+            "offsets_cache_dir": offsets_cache,
+            "device_cache_dir": device_cache,
+            "probe_setup": probe_setup,
+            "capture": capture,
+            "compress_transfer": compress_transfer,
+            "retire_probes": retire_probes,
+            "verbose": verbose,
+        }
+    if code_coverage and also_startup_poststartup:
+        log.warning("tracing code coverage will include startup and poststartup methods by definition, no need to set both.")
+
+    if pipeline_apps:
+        if emulator_config:
+            raise click.UsageError("--pipeline-apps runs on one device, for emulators see aproftracer-fleet --emulator-pool")
+        with open(pipeline_apps) as f:
+            apps = [line.strip() for line in f if line.strip()]
+
+        def install(t):
+            if fresh_install:
+                t.uninstall_and_log_errors()
+                t.install_and_compile_from_path(compile_all_aot=code_coverage)
+
+        retcodes = pipeline.Pipeline(
+                lambda app: Tracer(
+                    apkid=app,
+                    device_id=device_id,
+                    apks_dm_dir=fresh_install.replace("{}", app) if fresh_install else None,
+                    **tracer_kwargs),
+                install,
+                (code_coverage, also_startup_poststartup, only_appid),
+                {"tool": tool, "max_runtime": tool_max_runtime, "also_trace_activities": also_trace_activities},
+                cleanup_android=not no_cleanup_android,
+                cleanup_host=not no_cleanup_host,
+                reboot_every=reboot_every,
+            ).run(apps)
+        log.info("done!")
+        sys.exit(0 if all(code == 0 for code in retcodes.values()) else 131)
+
     try: # always terminate emulator
         if emulator_config:
             # start emulator and override device_id
             emu = EmulatorCTRL.from_config(cfg_file=emulator_config, slot=int(slot), verbose=verbose)
-            use_adb_root = emu.use_adb_root
+            tracer_kwargs["use_adb_root"] = emu.use_adb_root
             if device_id != "emulator-5555":
                 log.warning("overriding device-id when controlling the emulator")
             device_id = emu.get_device_name()
@@ -1093,23 +1510,14 @@ def main(
         t = Tracer(
                     apkid=apkid,
                     device_id=device_id,
-                    use_adb_root=use_adb_root,
                     apks_dm_dir=fresh_install,
-                    android_tmpdir=android_tmpdir,
-                    host_result_dir=result_dir,
-                    max_probes=max_probes,
-                    buffer_size_kb=buffer_size_kb,
-                    buffer_percent=buffer_percent,
-                    force_wifi=force_wifi,
-                    verbose=verbose,
+                    **tracer_kwargs,
                 )
 
         if fresh_install:
             t.uninstall_and_log_errors()
             t.install_and_compile_from_path(compile_all_aot=code_coverage)
 
-        if code_coverage and also_startup_poststartup:
-            log.warning("tracing code coverage will include startup and poststartup methods by definition, no need to set both.")
         t.prepare_tracepoints_sh(code_coverage, also_startup_poststartup, only_appid)
 
         t.run_tracer(tool=tool, max_runtime=tool_max_runtime, also_trace_activities=also_trace_activities)
@@ -1125,8 +1533,7 @@ def main(
             emu.shutdown_and_wait()
         elif not no_cleanup_android and t: # confusing but better for cli
             # only if not emulator, we throw the emulator away anyway (on next start)
-            t.cleanup_android()
-            t.reboot_and_wait_ok()
+            t.reset_device(reboot_every)
         if not no_cleanup_host and t:
             t.cleanup_host()
 
@@ -0,0 +1,104 @@
+"""
+compact set of method (or type) indices of one dex file, used for the sets in profile_info.
+
+a python set of ints costs ~60 bytes per method, a profile of a 100k method app easily a few MB per
+category. a bitmap over the indices costs one bit per method id, the profile format itself stores
+startup and post startup methods like that. BitmapSet keeps the usual read-only set interface
+(in, iteration, len, ==, |, &, ...), so callers don't need to know.
+"""
+from collections.abc import Set
+
+
+class BitmapSet(Set):
+    """immutable set of non-negative ints, bit i % 8 of byte i // 8 is set for every member i"""
+
+    __slots__ = ("_len", "bits")
+
+    def __init__(self, bits=b""):
+        # no trailing zero bytes, so equal sets have equal bits
+        self.bits = bytes(bits).rstrip(b"\0")
+        self._len = None
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return cls.from_indices(it)
+
+    @classmethod
+    def _from_int(cls, value):
+        return cls(value.to_bytes((value.bit_length() + 7) // 8, "little"))
+
+    @classmethod
+    def from_indices(cls, idxs):
+        if isinstance(idxs, BitmapSet):
+            return idxs
+        idxs = list(idxs)
+        bits = bytearray((max(idxs) >> 3) + 1 if idxs else 0)
+        for idx in idxs:
+            bits[idx >> 3] |= 1 << (idx & 7)
+        return cls(bits)
+
+    @classmethod
+    def from_bitmap(cls, bitmap, start, count):
+        """bits [start, start + count) of a little endian bitmap, like the method regions in profiles"""
+        return cls._from_int((int.from_bytes(bitmap, "little") >> start) & ((1 << count) - 1))
+
+    def _int(self):
+        return int.from_bytes(self.bits, "little")
+
+    def __contains__(self, idx):
+        try:
+            i = idx >> 3
+        except TypeError:
+            return False
+        return 0 <= i < len(self.bits) and (self.bits[i] >> (idx & 7)) & 1 == 1
+
+    def __iter__(self):
+        # the reversed binary string has bit i at position i
+        s = bin(self._int())[:1:-1]
+        i = s.find("1")
+        while i != -1:
+            yield i
+            i = s.find("1", i + 1)
+
+    def __len__(self):
+        if self._len is None:
+            self._len = self._int().bit_count()
+        return self._len
+
+    def __eq__(self, other):
+        if isinstance(other, BitmapSet):
+            return self.bits == other.bits
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __or__(self, other):
+        if isinstance(other, BitmapSet):
+            return BitmapSet._from_int(self._int() | other._int())
+        return super().__or__(other)
+
+    __ror__ = __or__
+
+    def __and__(self, other):
+        if isinstance(other, BitmapSet):
+            return BitmapSet._from_int(self._int() & other._int())
+        return super().__and__(other)
+
+    __rand__ = __and__
+
+    def __reduce__(self):
+        return (BitmapSet, (self.bits,))
+
+    def __repr__(self):
+        return f"BitmapSet({list(self)})"
+
+
+EMPTY = BitmapSet()
+
+
+def union(*sets):
+    """union of any sets of indices as a BitmapSet, e.g. the hot, startup and poststartup methods of a dex"""
+    value = 0
+    for s in sets:
+        value |= BitmapSet.from_indices(s)._int()
+    return BitmapSet._from_int(value)
@@ -0,0 +1,73 @@
+"""
+host side of the bpf backend: a bpf program counts the probe hits in an array map instead of
+logging every hit as a uprobe event, nothing goes through the ring buffer.
+
+the program is a binary for the device, passed to the Tracer as bpf_tracer. none exists yet (the
+tracer.bin of adbdevice/tracer.py has a different command line and output), so the backend is not on
+the command line until one does. it has to implement:
+
+  tracer.bin ODEX OFFSETS MAPDUMP
+
+  ODEX     the odex file containing the AOT compiled code
+  OFFSETS  one hex offset into ODEX per line, written by write_offsets, probe i is line i
+  MAPDUMP  where the map goes when the program gets SIGINT
+
+it attaches a uprobe to every offset, prints READY_LINE once they are all attached, and on SIGINT
+writes the values of its array map (index i is probe i, MAP_VALUE_DTYPE each, in order) to MAPDUMP,
+prints DUMPED_LINE and exits. a probe writes first_ns (bpf_ktime_get_ns), pid and comm on its first
+hit (first_ns == 0) and counts every hit in hits.
+
+the probes are the trace_info of the uprobe events backend, the decoded map is the same HitRecords
+with the first hit of every probe plus the hit counts, like the aggregate capture gives.
+"""
+import logging
+
+import numpy as np
+
+from aproftracer.rawtrace import HIT_DTYPE, HitRecords
+
+log = logging.getLogger(__name__)
+
+READY_LINE = "[INFO] - Starting to collect probes"
+DUMPED_LINE = "[INFO] - Map dumped"
+
+# struct { u64 first_ns; u64 hits; u32 pid; char comm[16]; u32 pad; }
+MAP_VALUE_DTYPE = np.dtype([
+    ('first_ns', '<u8'),
+    ('hits', '<u8'),
+    ('pid', '<u4'),
+    ('comm', 'S16'),
+    ('pad', '<u4'),
+])
+
+
+def write_offsets(path, trace_info):
+    with open(path, "w") as f:
+        for offset, _ in trace_info:
+            f.write(f"{offset}\n")
+
+
+def read_map_dump(path, trace_info):
+    """(HitRecords of the first hit of every probe that was hit, hits of every probe) of a map dump"""
+    values = np.fromfile(path, dtype=MAP_VALUE_DTYPE)
+    if len(values) != len(trace_info):
+        raise RuntimeError(f"map dump has {len(values)} probes, traced {len(trace_info)}")
+
+    probes = [offset for offset, _ in trace_info]
+    probe_hitcount = values['hits'].tolist()
+    log.info(f"{np.count_nonzero(values['hits'])}/{len(values)} probes hit {sum(probe_hitcount)} times in total")
+
+    hit = np.flatnonzero(values['hits'])
+    hit = hit[np.argsort(values['first_ns'][hit], kind="stable")]
+    hits = np.empty(len(hit), dtype=HIT_DTYPE)
+    if not len(hit):
+        return HitRecords(hits, [], probes), probe_hitcount
+
+    # process names like the text trace has them
+    first = values[hit]
+    names = [f"{comm.decode(errors='replace')}-{pid}" for comm, pid in zip(first['comm'].tolist(), first['pid'].tolist(), strict=True)]
+    comms, comm = np.unique(names, return_inverse=True)
+    hits['probe'] = hit
+    hits['comm'] = comm
+    hits['time'] = (first['first_ns'] - first['first_ns'][0]) / 1e9
+    return HitRecords(hits, comms.tolist(), probes), probe_hitcount
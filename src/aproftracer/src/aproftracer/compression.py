@@ -0,0 +1,23 @@
+"""
+gzipped artifacts, for --compress-transfer.
+
+oatdumps and text traces are large and compress several fold, so with --compress-transfer they are
+gzipped on the device (toybox has gzip) before the pull and stay gzipped on the host. the host files
+keep their names, readers tell them apart by the gzip magic and decompress them while parsing, no
+plain text copy is ever written.
+"""
+import gzip
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == _GZIP_MAGIC
+
+
+def open_stream(path):
+    """binary file object of the contents of path, decompressed if it is gzipped"""
+    if is_gzip(path):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
@@ -0,0 +1,81 @@
+"""
+host side cache of device facts, so a batch of apps on one device only looks them up once.
+
+two kinds of entries, plain json files in one directory that all workers of a host can share:
+- build: facts that only depend on the build of the device (the kernel config check, sdk),
+  keyed by ro.build.fingerprint
+- install: facts about one installed app (odex path, oatdata offset), keyed by the fingerprint, the
+  package, the path of its base.apk and its mtime. a reinstall gets a new random install dir and a
+  new mtime, so entries never outlive the install they describe.
+
+entries are written to a temporary file and renamed, like the offsets cache, so readers never see
+half an entry. entries are small and cheap to recompute, so concurrent writers just race.
+"""
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# bump when the facts in an entry change, old entries are ignored then
+_VERSION = 1
+
+
+def build_key(build_fingerprint):
+    return hashlib.sha256(f"{_VERSION}\n{build_fingerprint}".encode()).hexdigest()
+
+
+def install_key(build_fingerprint, package, apk_path, apk_mtime):
+    key = f"{_VERSION}\n{build_fingerprint}\n{package}\n{apk_path}\n{apk_mtime}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class DeviceCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, kind, key):
+        return self.cache_dir / kind / f"{key}.json"
+
+    def _get(self, kind, key):
+        path = self._path(kind, key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            log.warning(f"ignoring broken device cache entry {path}")
+            return None
+        log.debug(f"device cache hit {kind} {key}")
+        return entry
+
+    def _put(self, kind, key, entry):
+        path = self._path(kind, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{key}.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp)
+            raise
+        log.debug(f"device cache stored {kind} {key}")
+
+    def get_build(self, build_fingerprint):
+        return self._get("build", build_key(build_fingerprint))
+
+    def put_build(self, build_fingerprint, facts):
+        self._put("build", build_key(build_fingerprint), facts)
+
+    def get_install(self, build_fingerprint, package, apk_path, apk_mtime):
+        return self._get("install", install_key(build_fingerprint, package, apk_path, apk_mtime))
+
+    def put_install(self, build_fingerprint, package, apk_path, apk_mtime, facts):
+        self._put("install", install_key(build_fingerprint, package, apk_path, apk_mtime), facts)
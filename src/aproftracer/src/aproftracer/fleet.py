@@ -0,0 +1,332 @@
+"""
+fleet scheduler: one queue of apps, spread over every attached device.
+
+the experiments used to give every device a static shard (`parallel -j1` over a csv with a fixed
+--device-id), so a device that finished early sat idle while another still had hundreds of apps
+queued, and a device dropping off usb failed the rest of its shard.
+
+here all apps are in one queue and every healthy device has a worker that takes the next app as soon
+as it is done with the last one, so the fast devices just run more apps. every app runs in its own
+`aproftracer` process, like before, with its output in log_dir/<app>/<attempt>-<device>.log.
+
+an app that fails is queued again for another device, up to max_attempts times. a failure after which
+the device is no longer healthy is blamed on the device instead: the app goes back to the queue without
+using up an attempt, and the worker waits until its device is back. an app that keeps taking its device
+down (it comes back healthy after a reboot) is given up after max_lost such runs. if no device is
+healthy for no_device_timeout, the apps still queued are given up and the fleet ends.
+
+everything that happens is appended to the journal (json lines, fsynced), so a fleet that is killed
+starts where it stopped: apps that are done or given up are skipped, apps that were running are queued
+again. this replaces the joblog of parallel and the fix-meta-results cleanup.
+
+with --emulator-pool the devices are the warm emulators of an adbdevice.emulatorpool.EmulatorPool
+instead, every run leases its emulator, which loads the clean snapshot, so there is no reboot after it.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import click
+from adbdevice.adbdevice import attached_devices
+from adbdevice.emulatorpool import EmulatorPool
+
+from aproftracer import log as pkglog
+
+log = logging.getLogger(__name__)
+
+_MAX_ATTEMPTS = 3
+# runs of an app that took its device down, counted apart from the failed ones
+_MAX_LOST = 3
+# how long the fleet waits for any device to be healthy again before it gives up on the queue
+_NO_DEVICE_TIMEOUT = 1800.0
+# how often a worker without a healthy device checks again
+_RECHECK_INTERVAL = 30.0
+# a worker only leases its own emulator, a restore that failed may have to boot it again first
+_LEASE_TIMEOUT = 600.0
+
+
+class Journal:
+    """append only json lines of what happened to which app"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def record(self, event, app, **fields):
+        entry = {"time": time.time(), "event": event, "app": app, **fields}
+        line = json.dumps(entry) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replay(self):
+        """{app: AppState} of everything recorded so far"""
+        states = {}
+        if not self.path.exists():
+            return states
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a killed fleet can be cut off
+                    log.warning(f"ignoring broken journal line: '{line.rstrip()}'")
+                    continue
+                states.setdefault(entry["app"], AppState()).apply(entry)
+        return states
+
+
+class AppState:
+    def __init__(self):
+        self.attempts = 0
+        # runs that ended with the device gone, they don't use up attempts
+        self.lost = 0
+        self.failed_devices = set()
+        # None, "done" or "given_up", running apps were interrupted and count as queued
+        self.final = None
+
+    def apply(self, entry):
+        event = entry["event"]
+        if event == "failed":
+            self.attempts += 1
+            self.failed_devices.add(entry["device"])
+        elif event == "device_lost":
+            self.lost += 1
+            self.failed_devices.add(entry["device"])
+        elif event in ("done", "given_up"):
+            self.final = event
+
+
+class Fleet:
+    """
+    run_app(app, device) runs one app on one device and returns the exit code, is_healthy(device)
+    tells if the device can take apps.
+    """
+
+    def __init__(self, apps, devices, run_app, journal, is_healthy, max_attempts=_MAX_ATTEMPTS, recheck_interval=_RECHECK_INTERVAL,
+                 max_lost=_MAX_LOST, no_device_timeout=_NO_DEVICE_TIMEOUT):
+        self.devices = list(devices)
+        self.run_app = run_app
+        self.journal = journal
+        self.is_healthy = is_healthy
+        self.max_attempts = max_attempts
+        self.recheck_interval = recheck_interval
+        self.max_lost = max_lost
+        self.no_device_timeout = no_device_timeout
+
+        self.states = journal.replay()
+        self.pending = []
+        skipped = 0
+        for app in dict.fromkeys(apps):
+            state = self.states.setdefault(app, AppState())
+            if state.final is None:
+                self.pending.append(app)
+            else:
+                skipped += 1
+        if skipped:
+            log.info(f"resuming, {skipped} apps are done or given up already")
+
+        self._cond = threading.Condition()
+        self._running = 0
+        self._healthy = set(self.devices)
+        # since when no device is healthy, None while one is
+        self._none_healthy_since = None
+
+    def _finished(self):
+        return not self.pending and not self._running
+
+    def _take(self, device):
+        """next app for device, None once everything is finished. called with the lock held"""
+        while not self._finished():
+            for app in self.pending:
+                # a failed app goes to another device, unless no other healthy one is left for it
+                others = self._healthy - self.states[app].failed_devices - {device}
+                if device not in self.states[app].failed_devices or not others:
+                    self.pending.remove(app)
+                    self._running += 1
+                    return app
+            self._cond.wait(self.recheck_interval)
+        return None
+
+    def _work(self, device):
+        while True:
+            if not self.is_healthy(device):
+                with self._cond:
+                    self._healthy.discard(device)
+                    self._check_no_device()
+                    if self._finished():
+                        return
+                    self._cond.notify_all()
+                log.warning(f"{device} is not healthy, checking again in {self.recheck_interval}s")
+                time.sleep(self.recheck_interval)
+                continue
+            with self._cond:
+                if device not in self._healthy:
+                    log.info(f"{device} is back")
+                    self._healthy.add(device)
+                self._none_healthy_since = None
+                app = self._take(device)
+            if app is None:
+                return
+
+            state = self.states[app]
+            self.journal.record("started", app, device=device, attempt=state.attempts + 1)
+            log.info(f"{app} on {device} (attempt {state.attempts + 1}), {len(self.pending)} apps queued")
+            try:
+                retcode = self.run_app(app, device)
+            except Exception as e:
+                log.warning(f"{app} on {device} raised {e}")
+                retcode = None
+            self._finish(app, device, retcode)
+
+    def _give_up(self, app, reason):
+        self.journal.record("given_up", app, reason=reason)
+        self.states[app].apply({"event": "given_up"})
+
+    def _check_no_device(self):
+        """give up the queue once no device was healthy for no_device_timeout. called with the lock held"""
+        if self._healthy:
+            self._none_healthy_since = None
+            return
+        now = time.monotonic()
+        if self._none_healthy_since is None:
+            self._none_healthy_since = now
+        if now - self._none_healthy_since < self.no_device_timeout or not self.pending:
+            return
+        log.error(f"no healthy device for {self.no_device_timeout}s, giving up on {len(self.pending)} queued apps")
+        for app in self.pending:
+            self._give_up(app, "no healthy device")
+        self.pending = []
+        self._cond.notify_all()
+
+    def _finish(self, app, device, retcode):
+        state = self.states[app]
+        if retcode == 0:
+            entry = {"event": "done", "app": app, "device": device}
+        elif not self.is_healthy(device):
+            # most likely the device dropped out, not the app's fault
+            entry = {"event": "device_lost", "app": app, "device": device, "retcode": retcode}
+        else:
+            entry = {"event": "failed", "app": app, "device": device, "retcode": retcode}
+        self.journal.record(**entry)
+        state.apply(entry)
+        if entry["event"] == "failed" and state.attempts >= self.max_attempts:
+            self._give_up(app, "failed")
+            log.warning(f"{app} failed {state.attempts} times, giving up on it")
+        elif entry["event"] == "device_lost" and state.lost >= self.max_lost:
+            self._give_up(app, "device_lost")
+            log.warning(f"{app} took its device down {state.lost} times, giving up on it")
+        elif entry["event"] != "done":
+            log.warning(f"{app} on {device}: {entry['event']} with {retcode}, queued again")
+
+        with self._cond:
+            self._running -= 1
+            if state.final is None:
+                self.pending.append(app)
+            self._cond.notify_all()
+
+    def run(self):
+        """run every queued app, returns {app: AppState}"""
+        log.info(f"running {len(self.pending)} apps on {len(self.devices)} devices")
+        workers = [threading.Thread(target=self._work, args=(device,), name=device, daemon=True) for device in self.devices]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        done = sum(1 for s in self.states.values() if s.final == "done")
+        log.info(f"{done}/{len(self.states)} apps done")
+        return self.states
+
+
+def _run_aproftracer(args, log_dir, pool=None, lease_timeout=_LEASE_TIMEOUT):
+    """
+    run_app for Fleet, one aproftracer process per app. {} in args is replaced with the app, like parallel does.
+    with a pool, the emulator of device is leased for the run, the snapshot load replaces the reboot.
+    """
+    def run(app, device, extra):
+        app_log_dir = Path(log_dir) / app
+        app_log_dir.mkdir(parents=True, exist_ok=True)
+        attempt = len(list(app_log_dir.glob("*.log"))) + 1
+        argv = [sys.executable, "-m", "aproftracer.aproftracer", app, "--device-id", device, *extra, *(a.replace("{}", app) for a in args)]
+        with open(app_log_dir / f"{attempt}-{device}.log", "w") as out:
+            return subprocess.run(argv, stdout=out, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL).returncode
+
+    def run_app(app, device):
+        if pool is None:
+            return run(app, device, [])
+        # queue.Empty after lease_timeout, the run counts as failed
+        with pool.lease(device, timeout=lease_timeout) as emu:
+            extra = ["--no-cleanup-android", *(["--use-adb-root"] if emu.use_adb_root else [])]
+            return run(app, device, extra)
+    return run_app
+
+
+def _is_healthy(device):
+    return device in attached_devices()
+
+
+def _read_apps(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option("--verbose", default=False, is_flag=True)
+@click.option("--apps", "apps_path", required=True, type=click.Path(exists=True, dir_okay=False, path_type=Path), help="one apkid per line")
+@click.option("--device-id", "device_ids", multiple=True, help="device to use, repeat for more. default is every device adb lists")
+@click.option("--journal", "journal_path", required=True, type=click.Path(dir_okay=False, path_type=Path), help="journal of the fleet, an existing one is resumed")
+@click.option("--log-dir", default=Path("fleet_logs"), type=click.Path(file_okay=False, path_type=Path), help="output of every aproftracer run")
+@click.option("--max-attempts", default=_MAX_ATTEMPTS, help="runs of an app that may fail before it is given up")
+@click.option("--max-lost", default=_MAX_LOST, help="runs of an app after which its device was gone that are allowed before it is given up")
+@click.option("--no-device-timeout", default=_NO_DEVICE_TIMEOUT, help="seconds without any healthy device after which the queued apps are given up")
+@click.option("--emulator-pool", default=None, type=click.Path(exists=True, dir_okay=False, path_type=Path), help="boot --pool-size emulators of this emulator config and run the apps on them instead of attached devices")
+@click.option("--pool-size", default=1, help="emulators in the pool")
+@click.argument("aproftracer_args", nargs=-1, type=click.UNPROCESSED)
+def main(verbose, apps_path, device_ids, journal_path, log_dir, max_attempts, max_lost, no_device_timeout, emulator_pool, pool_size, aproftracer_args):
+    """
+    run aproftracer for every app in --apps on all devices, the rest of the arguments go to aproftracer.
+    {} in them is replaced with the apkid, e.g. --fresh-install apks/{}
+    """
+    if verbose:
+        pkglog.setLevel(logging.DEBUG)
+    pool = None
+    if emulator_pool:
+        if device_ids:
+            log.warning("ignoring --device-id, the pool emulators are the devices")
+        pool = EmulatorPool.from_config(emulator_pool, pool_size, verbose=verbose)
+        pool.start()
+        # only the ones that booted, a worker for a dropped one would wait for its lease forever
+        devices = pool.ready()
+    else:
+        devices = list(device_ids) or attached_devices()
+    if not devices:
+        raise click.UsageError("no devices")
+    try:
+        fleet = Fleet(
+                _read_apps(apps_path),
+                devices,
+                _run_aproftracer(aproftracer_args, log_dir, pool),
+                Journal(journal_path),
+                _is_healthy,
+                max_attempts=max_attempts,
+                max_lost=max_lost,
+                no_device_timeout=no_device_timeout,
+            )
+        states = fleet.run()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    given_up = [app for app, s in states.items() if s.final == "given_up"]
+    if given_up:
+        log.warning(f"gave up on {len(given_up)} apps: {' '.join(given_up)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+streaming parser for the text output of `oatdump --no-disassemble`.
+
+the oatdump of a large app is hundreds of MB up to GBs, almost all of it method bodies
+(dex code, vmap tables, frame info, ...) that we don't care about. instead of decoding
+every line, the file is read in large byte chunks and substring searches jump straight to
+the few lines we need, precompiled patterns only confirm those. method bodies are skipped
+without ever becoming python objects, so memory is bounded by the chunk size plus the
+result lists.
+"""
+import logging
+import mmap
+import os
+import re
+from multiprocessing import Pool
+
+from aproftracer import compression
+from aproftracer.bitmapset import EMPTY, union
+
+log = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 16 * 1024 * 1024
+
+# a dex location that is not in the profile, all methods until the next location are skipped
+_SPECIAL_SKIP = "SPECIAL_SKIP"
+
+# the only three kinds of lines that matter, see Tracer.read_oatdump_info for the line based original:
+#   "location: /data/app/.../base.apk!classes2.dex"
+#   "  12: void com.foo.Bar.<init>() (dex_method_idx=1234)"
+#   "    CODE: (code_offset=0x0012abcd size=123)..."
+# candidates are found with substring searches, which are a lot faster than letting the regex
+# engine scan. the patterns only confirm a candidate line has the layout the original matched.
+_LOCATION_MARK = b"\nlocation:"
+_HEADER_MARK = b" (dex_method_idx="
+_CODE_MARK = b"\n    CODE: (code_offset=0x"
+_RE_DIGITS = re.compile(rb"[0-9]+")
+_RE_HEADER = re.compile(rb"  [0-9]+: ([^\n]*) \(dex_method_idx=([0-9]+)")
+_RE_CODE = re.compile(rb"    CODE: \(code_offset=0x([0-9a-f]+) ")
+
+# header lines: "MAGIC:", then "oat", then the version "236"
+_RE_MAGIC = re.compile(rb"^(?:MAGIC:|oat|236)", re.MULTILINE)
+_MAGIC_SEQUENCE = (b"MAGIC:", b"oat", b"236")
+
+
+def _decode(b):
+    # important: oatdump sometimes has non-utf-8 chars :(
+    return b.decode("utf-8", errors="backslashreplace")
+
+
+def new_oatdump_info():
+    return {'hot': [], 'startup': [], 'poststartup': [], 'other': []}
+
+
+class OatdumpScanner:
+    """
+    incremental state machine over oatdump text. feed it buffers that end on a line boundary,
+    the results are collected in `oatdump_info`, same layout as Tracer.read_oatdump_info.
+    """
+
+    def __init__(self, profile_info, oatdata_offset, include_nonprofile=False):
+        self.profile_info = profile_info
+        self.include_nonprofile = include_nonprofile
+        self.oatdata_offset = oatdata_offset
+        self._odo = f"0x{oatdata_offset:x}"
+        self.oatdump_info = new_oatdump_info()
+        self.magic_check = 0
+
+        self._cur_loc = None # dex file location
+        self._cur_method_idx = None # method id of dex method
+        self._cur_method_name = None # always on same line as method idx
+        self._hot = self._startup = self._poststartup = None # profile sets of the current location
+        self._any = b"" # bitmap of all methods of the current location in any of them
+
+    def check_magic(self, buf, start, end):
+        for m in _RE_MAGIC.finditer(buf, start, end):
+            if m.group() == _MAGIC_SEQUENCE[self.magic_check]:
+                self.magic_check += 1
+                if self.magic_check == 3:
+                    return
+
+    def _enter_location(self, line):
+        cur_loc = _location_from_line(line)
+        log.info(f"  reading oatdump at: {cur_loc}")
+        self._cur_method_idx = None
+
+        # check early if location is in profile
+        if not location_in_profile(self.profile_info, cur_loc):
+            cur_loc = _SPECIAL_SKIP
+        else:
+            self._hot = self.profile_info['hot'].get(cur_loc, EMPTY)
+            self._startup = self.profile_info['startup'].get(cur_loc, EMPTY)
+            self._poststartup = self.profile_info['poststartup'].get(cur_loc, EMPTY)
+            # most method headers are skipped based on this alone, so make it a single bit test
+            self._any = union(self._hot, self._startup, self._poststartup).bits
+        self._cur_loc = cur_loc
+
+    def feed(self, buf, start=0, end=None):
+        """
+        scan buf[start:end]. the range has to end on a line boundary (or the end of the file) and
+        start on one, i.e. buf[start-1] is a newline unless start is 0.
+        buf can be anything bytes-like with find/rfind, in particular an mmap of the whole file.
+        """
+        if end is None:
+            end = len(buf)
+        if start == 0 and buf[:1] != b"\n":
+            # the marks include the newline in front of a line, so we need one in front of the first
+            buf = b"\n" + buf
+            start, end = 1, end + 1
+        if self.magic_check != 3:
+            self.check_magic(buf, start, end)
+
+        # pos always points at the newline in front of the next line
+        pos = start - 1
+        while pos < end:
+            if buf.find(_LOCATION_MARK, pos, min(end, pos + len(_LOCATION_MARK))) == pos:
+                le = _line_end(buf, pos + 1, end)
+                self._enter_location(buf[pos + 1:le])
+                pos = le
+            # everything up to the next location belongs to the current one
+            seg_end = buf.find(_LOCATION_MARK, pos, end)
+            if seg_end == -1:
+                seg_end = end
+            # skip dex locations that are not in profiles
+            if self._cur_loc is not None and self._cur_loc != _SPECIAL_SKIP:
+                self._scan_methods(buf, pos, seg_end)
+            pos = seg_end
+
+    def _scan_methods(self, buf, pos, end):
+        oatdump_info = self.oatdump_info
+        include_nonprofile = self.include_nonprofile
+        hot, startup, poststartup = self._hot, self._startup, self._poststartup
+        any_bits = self._any
+        any_len = len(any_bits)
+        cur_loc = self._cur_loc
+        cur_method_idx = self._cur_method_idx
+        cur_method_name = self._cur_method_name
+        find, rfind = buf.find, buf.rfind
+        match_header, match_code = _RE_HEADER.match, _RE_CODE.match
+        mark_len = len(_HEADER_MARK)
+        while pos < end:
+            if not cur_method_idx:
+                # if we are not in a method, we jump to the next method header
+                i = find(_HEADER_MARK, pos, end)
+                if i == -1:
+                    break
+                # cheap look at the index first, most methods are not in the profile
+                j = find(b")", i, end)
+                if j == -1:
+                    break
+                pos = j
+                try:
+                    method_idx = int(buf[i + mark_len:j])
+                except ValueError:
+                    continue
+                # check if it's an index we actually care about
+                if not include_nonprofile:
+                    k = method_idx >> 3
+                    if k >= any_len or not (any_bits[k] >> (method_idx & 7)) & 1:
+                        continue
+                # only now make sure it's really a method header
+                le = find(b"\n", j, end)
+                if le == -1:
+                    le = end
+                pos = le
+                if (m := match_header(buf, rfind(b"\n", 0, i) + 1, le)) is None or int(m.group(2)) != method_idx:
+                    continue
+                cur_method_idx = method_idx
+                cur_method_name = m.group(1)
+            else:
+                # if we are in a method, we skip its body up to the binary offset
+                i = find(_CODE_MARK, pos, end)
+                if i == -1:
+                    break
+                pos = i + 1
+                if (m := match_code(buf, pos, end)) is None:
+                    continue
+                offset = m.group(1).decode('ascii')
+
+                # str(dex-location);int(method_idx);hexstr(offset);hexstr(oatdata_offset);int(computed_offset);str(name)
+                dat = (
+                    cur_loc,
+                    cur_method_idx,
+                    f"0x{offset}",
+                    self._odo,
+                    int(offset, 16) + self.oatdata_offset,
+                    _decode(cur_method_name),
+                )
+
+                add_to_oatdump_info(oatdump_info, dat, hot, startup, poststartup)
+
+                cur_method_idx = None
+        self._cur_method_idx = cur_method_idx
+        self._cur_method_name = cur_method_name
+
+
+def add_to_oatdump_info(oatdump_info, dat, hot, startup, poststartup):
+    """sort a method record into the categories of the profile sets of its location"""
+    method_idx = dat[1]
+    _in_prof = False
+    # can be optimized as it can appear in multiple sets, but it makes accessing it later easier for differentiating those cases
+    if method_idx in hot:
+        oatdump_info['hot'].append(dat)
+        _in_prof = True
+    if method_idx in startup:
+        oatdump_info['startup'].append(dat)
+        _in_prof = True
+    if method_idx in poststartup:
+        oatdump_info['poststartup'].append(dat)
+        _in_prof = True
+
+    if not _in_prof:
+        oatdump_info['other'].append(dat)
+
+
+def _location_from_line(line):
+    # each dex is seperate and provided as /path/to/base.apk[!classesN.dex]
+    return _decode(line.split()[1]).split('/')[-1].strip()
+
+
+def location_in_profile(profile_info, loc):
+    if loc not in profile_info['hot'] and loc not in profile_info['startup'] and loc not in profile_info['poststartup']:
+        # one case is that the apk got more files than the profile. in such a case we will continue to the next and skip all lines
+        log.warning(f"found {loc} in oatdump but not in profile keys (hot: {profile_info['hot'].keys()}, startup: {profile_info['startup'].keys()}, poststartup: {profile_info['poststartup'].keys()}) - skipping for now")
+        # FIXME sometimes it is clases.dex instead base.apk, maybe one day we can errorhandle this better
+        return False
+    return True
+
+
+def _line_end(buf, pos, end):
+    le = buf.find(b"\n", pos, end)
+    return end if le == -1 else le
+
+
+def iter_line_chunks(f, chunk_size=_CHUNK_SIZE, limit=None):
+    """
+    read a binary file object in chunks of whole lines, without copying them around more than once.
+    yields (buf, end) where buf[0] is the newline in front of the first line and buf[1:end] are the lines,
+    ready for OatdumpScanner.feed(buf, 1, end). if limit is set, at most limit bytes are read.
+    """
+    rest = b"\n"
+    while True:
+        size = chunk_size if limit is None else min(chunk_size, limit)
+        chunk = f.read(size) if size > 0 else b""
+        if limit is not None:
+            limit -= len(chunk)
+        if not chunk:
+            if len(rest) > 1:
+                yield rest, len(rest)
+            return
+        buf = rest + chunk
+        cut = buf.rfind(b"\n") + 1
+        if cut <= 1:
+            rest = buf # line longer than a chunk, keep reading
+            continue
+        yield buf, cut
+        rest = buf[cut - 1:]
+
+
+def check_oatdump_info(oatdump_info, magic_check):
+    if magic_check != 3:
+        raise NotImplementedError("oatdump magic does not match expected value!")
+
+    if len(oatdump_info['hot']) + len(oatdump_info['startup']) + len(oatdump_info['poststartup']) == 0:
+        raise NotImplementedError("Parsed oatdump but found 0 methods. Probably the mapping to locations failed.")
+
+
+def read_oatdump_info(profile_info, oatdump_path, oatdata_offset, include_nonprofile=False, chunk_size=_CHUNK_SIZE, workers=1):
+    """
+    [str(dex-location); int(method_idx); hexstr(offset); hexstr(oatdata_offset); int(computed_offset); str(name)]
+
+    workers other than 1 parse the dex locations in parallel, see read_oatdump_info_parallel.
+    a gzipped oatdump is decompressed while it is parsed, always in this process, it can't be mapped.
+    """
+    if workers != 1:
+        if not compression.is_gzip(oatdump_path):
+            return read_oatdump_info_parallel(profile_info, oatdump_path, oatdata_offset, include_nonprofile, workers)
+        log.info("oatdump is gzipped, parsing it in one process")
+
+    scanner = OatdumpScanner(profile_info, oatdata_offset, include_nonprofile)
+
+    with compression.open_stream(oatdump_path) as f:
+        for buf, end in iter_line_chunks(f, chunk_size):
+            scanner.feed(buf, 1, end)
+
+    check_oatdump_info(scanner.oatdump_info, scanner.magic_check)
+
+    log.debug("oatdump parsed for offsets")
+    return scanner.oatdump_info
+
+
+def _find_sections(mm):
+    """byte ranges [start, end) of the sections starting at each 'location:' line"""
+    starts = []
+    pos = mm.find(_LOCATION_MARK)
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = mm.find(_LOCATION_MARK, pos + 1)
+    return list(zip(starts, [*starts[1:], len(mm)], strict=True))
+
+
+def _read_oatdump_section(oatdump_path, start, end, profile_info, oatdata_offset, include_nonprofile):
+    """pool worker: parse one dex location straight from the shared mapping of the file"""
+    scanner = OatdumpScanner(profile_info, oatdata_offset, include_nonprofile)
+    scanner.magic_check = 3 # checked once for the whole file
+    with open(oatdump_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        scanner.feed(mm, start, end)
+    return scanner.oatdump_info
+
+
+def read_oatdump_info_parallel(profile_info, oatdump_path, oatdata_offset, include_nonprofile=False, workers=0):
+    """
+    same as read_oatdump_info, but every dex location is parsed in its own worker process.
+    the sections are independent, so the file is only split at the 'location:' lines of an mmap,
+    nothing is copied, and each worker gets just the profile sets of its location.
+    workers=0 uses one process per cpu.
+    """
+    oatdump_info = new_oatdump_info()
+    tasks = []
+    with open(oatdump_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        sections = _find_sections(mm)
+        # the magic is in the header in front of the first location
+        header = OatdumpScanner(profile_info, oatdata_offset, include_nonprofile)
+        header.check_magic(mm, 0, sections[0][0] if sections else len(mm))
+
+        for start, end in sections:
+            loc = _location_from_line(mm[start:_line_end(mm, start, end)])
+            if not location_in_profile(profile_info, loc):
+                continue
+            sub_profile_info = {k: ({loc: v[loc]} if loc in v else {}) for k, v in profile_info.items()}
+            tasks.append((oatdump_path, start, end, sub_profile_info, oatdata_offset, include_nonprofile))
+
+    workers = min(workers or os.cpu_count(), len(tasks))
+    log.info(f"parsing {len(tasks)} dex locations of the oatdump with {workers} processes")
+    if workers <= 1:
+        results = [_read_oatdump_section(*task) for task in tasks]
+    else:
+        with Pool(processes=workers) as pool:
+            # biggest sections first to keep all workers busy, results are merged in file order
+            pending = {}
+            for i in sorted(range(len(tasks)), key=lambda i: tasks[i][1] - tasks[i][2]):
+                pending[i] = pool.apply_async(_read_oatdump_section, tasks[i])
+            results = [pending[i].get() for i in range(len(tasks))]
+
+    for result in results:
+        for category, dats in result.items():
+            oatdump_info[category].extend(dats)
+
+    check_oatdump_info(oatdump_info, header.magic_check)
+
+    log.debug("oatdump parsed for offsets")
+    return oatdump_info
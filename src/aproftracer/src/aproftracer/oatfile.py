@@ -0,0 +1,398 @@
+"""
+host side reader for the method offsets of an odex, replaces dumping and parsing `oatdump` text.
+
+an odex is an ELF file whose `oatdata` symbol points at the OAT header. the header is followed
+by one OatDexFile record per dex file, which points at the OatClass of every class def, which in
+turn holds the code offsets of the compiled methods in class data order. method indices and names
+only live in the dex files, those come from the vdex next to the odex (or the apk if the vdex has
+none). all files are mmapped and decoded with struct.unpack_from, only the records we keep become
+python objects.
+
+the result has the same layout as oatdump.read_oatdump_info.
+"""
+import logging
+import mmap
+import struct
+import zipfile
+from contextlib import ExitStack
+
+from aproftracer.bitmapset import EMPTY, union
+from aproftracer.oatdump import (
+    add_to_oatdump_info,
+    check_oatdump_info,
+    location_in_profile,
+    new_oatdump_info,
+)
+
+log = logging.getLogger(__name__)
+
+_ELF_MAGIC = b"\x7fELF"
+_ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_SHT_SYMTAB = 2
+_SHT_DYNSYM = 11
+_PT_LOAD = 1
+
+_OAT_MAGIC = b"oat\n"
+_OAT_VERSION = b"236" # same version the oatdump parser expects
+# OatClassType
+_ALL_COMPILED = 0
+_SOME_COMPILED = 1
+_NONE_COMPILED = 2
+
+_VDEX_MAGIC = b"vdex"
+_VDEX_VERSIONS = (b"027",)
+_VDEX_DEX_SECTION = 1
+
+_DEX_MAGIC = b"dex\n"
+_DEX_VERSIONS = (b"035", b"037", b"038", b"039")
+
+# how many offsets after class_offsets_offset we try when looking for the next OatDexFile record
+_MAX_TRAILING_FIELDS = 16
+
+_PRIMITIVES = {
+    b"B": b"byte",
+    b"C": b"char",
+    b"D": b"double",
+    b"F": b"float",
+    b"I": b"int",
+    b"J": b"long",
+    b"S": b"short",
+    b"Z": b"boolean",
+    b"V": b"void",
+}
+
+
+def _decode(b):
+    # dex strings are MUTF-8, oatdump prints them as they are. decode them the same way as the oatdump text
+    return b.decode("utf-8", errors="backslashreplace")
+
+
+def _uleb128(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _pretty_descriptor(descriptor):
+    """art's PrettyDescriptor: b"[[Lcom/foo/Bar;" -> b"com.foo.Bar[][]", b"I" -> b"int" """
+    dim = len(descriptor) - len(descriptor.lstrip(b"["))
+    c = descriptor[dim:]
+    if c[:1] == b"L":
+        c = c[1:]
+    elif c[:1] in _PRIMITIVES:
+        c = _PRIMITIVES[c[:1]]
+    else:
+        return descriptor
+    return c.split(b";", 1)[0].replace(b"/", b".") + b"[]" * dim
+
+
+class DexFile:
+    """
+    the parts of a dex file oatdump uses to list methods: class defs, class data and method ids.
+    buf is anything bytes-like with find, the dex starts at base (e.g. inside the dex section of a vdex).
+    """
+
+    def __init__(self, buf, base=0):
+        magic = bytes(buf[base:base + 8])
+        if magic[:4] != _DEX_MAGIC or magic[4:7] not in _DEX_VERSIONS:
+            raise NotImplementedError(f"unsupported dex file with magic {magic!r}")
+        self.buf = buf
+        self.base = base
+        (self.checksum,) = struct.unpack_from("<I", buf, base + 0x08)
+        self.signature = bytes(buf[base + 0x0c:base + 0x20])
+        (self.file_size,) = struct.unpack_from("<I", buf, base + 0x20)
+        (
+            _, self._string_ids_off,
+            _, self._type_ids_off,
+            _, self._proto_ids_off,
+            _, _, # field ids
+            self.num_method_ids, self._method_ids_off,
+            self.num_class_defs, self._class_defs_off,
+        ) = struct.unpack_from("<12I", buf, base + 0x38)
+        self._pretty_types = {}
+
+    def _u32(self, off):
+        return struct.unpack_from("<I", self.buf, self.base + off)[0]
+
+    def _string(self, string_idx):
+        pos = self.base + self._u32(self._string_ids_off + 4 * string_idx)
+        _, pos = _uleb128(self.buf, pos) # utf-16 length, we want the bytes
+        return bytes(self.buf[pos:self.buf.find(b"\0", pos)])
+
+    def _pretty_type(self, type_idx):
+        pretty = self._pretty_types.get(type_idx)
+        if pretty is None:
+            descriptor = self._string(self._u32(self._type_ids_off + 4 * type_idx))
+            pretty = self._pretty_types[type_idx] = _pretty_descriptor(descriptor)
+        return pretty
+
+    def pretty_method(self, method_idx):
+        """the method name as oatdump prints it, art's PrettyMethod with signature: 'void com.foo.Bar.run(int, java.lang.String[])'"""
+        buf, base = self.buf, self.base
+        class_idx, proto_idx, name_idx = struct.unpack_from("<HHI", buf, base + self._method_ids_off + 8 * method_idx)
+        _, return_type_idx, parameters_off = struct.unpack_from("<3I", buf, base + self._proto_ids_off + 12 * proto_idx)
+        params = ()
+        if parameters_off:
+            (size,) = struct.unpack_from("<I", buf, base + parameters_off)
+            params = struct.unpack_from(f"<{size}H", buf, base + parameters_off + 4)
+        name = b"%s %s.%s(%s)" % (
+            self._pretty_type(return_type_idx),
+            self._pretty_type(class_idx),
+            self._string(name_idx),
+            b", ".join(self._pretty_type(t) for t in params),
+        )
+        return _decode(name)
+
+    def class_methods(self):
+        """yields (class_def_idx, [method_idx, ...]) in the order of the OatClass entries: direct, then virtual methods"""
+        buf, base = self.buf, self.base
+        for class_def_idx in range(self.num_class_defs):
+            class_data_off = self._u32(self._class_defs_off + 32 * class_def_idx + 24)
+            if not class_data_off:
+                continue
+            pos = base + class_data_off
+            num_static_fields, pos = _uleb128(buf, pos)
+            num_instance_fields, pos = _uleb128(buf, pos)
+            num_direct_methods, pos = _uleb128(buf, pos)
+            num_virtual_methods, pos = _uleb128(buf, pos)
+            # fields: field_idx_diff, access_flags
+            for _ in range(2 * (num_static_fields + num_instance_fields)):
+                _, pos = _uleb128(buf, pos)
+            method_idxs = []
+            for num_methods in (num_direct_methods, num_virtual_methods):
+                method_idx = 0 # the diffs restart for the virtual methods
+                for _ in range(num_methods):
+                    diff, pos = _uleb128(buf, pos)
+                    method_idx += diff
+                    method_idxs.append(method_idx)
+                    _, pos = _uleb128(buf, pos) # access_flags
+                    _, pos = _uleb128(buf, pos) # code_off
+            yield class_def_idx, method_idxs
+
+
+def vdex_dex_files(buf):
+    """the dex files stored in a vdex, empty if it has none (e.g. the apk has uncompressed dex files)"""
+    if bytes(buf[:4]) != _VDEX_MAGIC:
+        raise NotImplementedError("vdex magic does not match expected value!")
+    version = bytes(buf[4:8]).rstrip(b"\0")
+    if version not in _VDEX_VERSIONS:
+        raise NotImplementedError(f"got a vdex in an unknown version {version}, compatibility not certain.")
+    (num_sections,) = struct.unpack_from("<I", buf, 8)
+    dex_files = []
+    for i in range(num_sections):
+        kind, offset, size = struct.unpack_from("<3I", buf, 12 + 12 * i)
+        if kind != _VDEX_DEX_SECTION:
+            continue
+        pos = offset
+        while pos < offset + size:
+            dex = DexFile(buf, pos)
+            dex_files.append(dex)
+            pos += (dex.file_size + 3) & ~3 # dex files are 4 byte aligned
+    return dex_files
+
+
+def apk_dex_files(apk_path):
+    """classes.dex, classes2.dex, ... of an apk, in the order they are compiled into the odex"""
+    dex_files = []
+    with zipfile.ZipFile(apk_path) as z:
+        names = set(z.namelist())
+        while (name := "classes.dex" if not dex_files else f"classes{len(dex_files) + 1}.dex") in names:
+            dex_files.append(DexFile(z.read(name)))
+    return dex_files
+
+
+# struct formats of ELF header (from e_type on), section header, program header and symbol, by ELF class
+_ELF_FORMATS = {
+    True: ("<HHIQQQIHHHHHH", "<IIQQQQIIQQ", "<IIQQQQQQ", "<IBBHQQ"),
+    False: ("<HHIIIIIHHHHHH", "<10I", "<8I", "<IIIBBH"),
+}
+
+
+def _elf_oatdata(buf):
+    """
+    value of the oatdata symbol (what `readelf -s` shows) and its offset in the file.
+    the value is what the offsets in the oatdump are relative to.
+    """
+    if bytes(buf[:4]) != _ELF_MAGIC or buf[5] != _ELFDATA2LSB:
+        raise NotImplementedError("odex is not a little endian ELF file")
+    is64 = buf[4] == _ELFCLASS64
+    ehdr_fmt, shdr_fmt, phdr_fmt, sym_fmt = _ELF_FORMATS[is64]
+    ehdr = struct.unpack_from(ehdr_fmt, buf, 16)
+    phoff, shoff = ehdr[4], ehdr[5]
+    phentsize, phnum, shentsize, shnum = ehdr[8], ehdr[9], ehdr[10], ehdr[11]
+
+    # (sh_type, sh_offset, sh_size, sh_link), same field order for both classes
+    sections = [struct.unpack_from(shdr_fmt, buf, shoff + i * shentsize) for i in range(shnum)]
+    sections = [(s[1], s[4], s[5], s[6]) for s in sections]
+    value = _elf_symbol(buf, sections, sym_fmt, b"oatdata")
+    if value is None:
+        raise NotImplementedError("odex has no oatdata symbol")
+
+    for i in range(phnum):
+        phdr = struct.unpack_from(phdr_fmt, buf, phoff + i * phentsize)
+        # (p_type, p_offset, p_vaddr, p_filesz)
+        p_type, p_offset, p_vaddr, p_filesz = (phdr[0], phdr[2], phdr[3], phdr[5]) if is64 else (phdr[0], phdr[1], phdr[2], phdr[4])
+        if p_type == _PT_LOAD and p_vaddr <= value < p_vaddr + p_filesz:
+            return value, value - p_vaddr + p_offset
+    raise NotImplementedError("oatdata symbol is not in a loaded segment")
+
+
+def _elf_symbol(buf, sections, sym_fmt, wanted):
+    sym_size = struct.calcsize(sym_fmt)
+    value_idx = 4 if sym_size == 24 else 1
+    # .dynsym is what readelf -s lists first, .symtab is usually stripped
+    for sh_type in (_SHT_DYNSYM, _SHT_SYMTAB):
+        for s_type, s_offset, s_size, s_link in sections:
+            if s_type != sh_type:
+                continue
+            strtab = sections[s_link][1]
+            for pos in range(s_offset, s_offset + s_size, sym_size):
+                sym = struct.unpack_from(sym_fmt, buf, pos)
+                name = strtab + sym[0]
+                if bytes(buf[name:buf.find(b"\0", name)]) == wanted:
+                    return sym[value_idx]
+    return None
+
+
+def _oat_dex_files(buf, oat, dex_files):
+    """
+    yields (location, dex, class_offsets_offset) for the OatDexFile records following the OAT header at oat.
+
+    a record is: u32 location size, location, u32 dex checksum, [20 byte dex sha1 in newer versions],
+    u32 dex_file_offset, u32 class_offsets_offset, then offsets of the lookup table, layout sections and
+    bss mappings, whose number also changed between versions. instead of hardcoding one layout the
+    variable parts are pinned down against the dex files: the sha1 is the signature of the dex and the
+    next record has to start with the location and checksum of the next dex.
+    """
+    # magic, version, oat_checksum, instruction_set, instruction_set_features, then these two
+    num_dex_files, pos = struct.unpack_from("<II", buf, oat + 20)
+    if num_dex_files != len(dex_files):
+        raise NotImplementedError(f"odex has {num_dex_files} dex files, but got {len(dex_files)} to read methods from")
+    pos += oat
+    trailing = None
+    for i, dex in enumerate(dex_files):
+        location, checksum, pos = _oat_dex_file_start(buf, pos)
+        if checksum != dex.checksum:
+            raise NotImplementedError(f"checksum of {location} in odex does not match its dex file")
+        if bytes(buf[pos:pos + 20]) == dex.signature:
+            pos += 20
+        _, class_offsets_offset = struct.unpack_from("<II", buf, pos)
+        pos += 8
+        if trailing is None and i + 1 < len(dex_files):
+            trailing = _find_trailing_fields(buf, pos, dex_files[i + 1])
+        pos += 4 * (trailing or 0)
+        yield location, dex, class_offsets_offset
+
+
+def _oat_dex_file_start(buf, pos):
+    (size,) = struct.unpack_from("<I", buf, pos)
+    location = _decode(bytes(buf[pos + 4:pos + 4 + size]))
+    (checksum,) = struct.unpack_from("<I", buf, pos + 4 + size)
+    return location, checksum, pos + 8 + size
+
+
+def _find_trailing_fields(buf, pos, next_dex):
+    for n in range(_MAX_TRAILING_FIELDS):
+        start = pos + 4 * n
+        (size,) = struct.unpack_from("<I", buf, start)
+        if not 0 < size < 4096 or start + 8 + size > len(buf):
+            continue
+        _, checksum, _ = _oat_dex_file_start(buf, start)
+        if checksum == next_dex.checksum:
+            return n
+    raise NotImplementedError("could not find the next OatDexFile record, unknown oat layout")
+
+
+def _code_offsets(buf, oat_class, num_methods):
+    """code offsets of the methods of an OatClass in class data order, 0 for methods without code (like oatdump)"""
+    _, class_type = struct.unpack_from("<HH", buf, oat_class) # status, type
+    if class_type == _NONE_COMPILED:
+        return (0,) * num_methods
+    (n,) = struct.unpack_from("<I", buf, oat_class + 4)
+    if n != num_methods:
+        raise NotImplementedError(f"OatClass has {n} methods, but the class data {num_methods}")
+    pos = oat_class + 8
+    if class_type == _ALL_COMPILED:
+        return struct.unpack_from(f"<{n}I", buf, pos)
+    if class_type != _SOME_COMPILED:
+        raise NotImplementedError(f"unknown OatClass type {class_type}")
+    # bitmap of compiled methods in u32 words, only those have an entry
+    bitmap_size = (n + 31) // 32 * 4
+    bitmap = int.from_bytes(buf[pos:pos + bitmap_size], "little")
+    compiled = [(bitmap >> i) & 1 for i in range(n)]
+    offsets = iter(struct.unpack_from(f"<{sum(compiled)}I", buf, pos + bitmap_size))
+    return [next(offsets) if c else 0 for c in compiled]
+
+
+def _mmap(stack, path):
+    # the mapping stays valid after the file is closed
+    with open(path, "rb") as f:
+        return stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def has_dex_files(vdex_path):
+    with ExitStack() as stack:
+        return len(vdex_dex_files(_mmap(stack, vdex_path))) > 0
+
+
+def read_odex_info(profile_info, odex_path, vdex_path, apk_path=None, include_nonprofile=False):
+    """
+    same records as oatdump.read_oatdump_info, but straight from the odex:
+    [str(dex-location); int(method_idx); hexstr(offset); hexstr(oatdata_offset); int(computed_offset); str(name)]
+
+    returns (oatdump_info, oatdata_offset). the dex files are read from the vdex, or apk_path if the vdex has none.
+    """
+    oatdump_info = new_oatdump_info()
+    with ExitStack() as stack:
+        odex = _mmap(stack, odex_path)
+        oatdata_offset, oat = _elf_oatdata(odex)
+        if bytes(odex[oat:oat + 4]) != _OAT_MAGIC or bytes(odex[oat + 4:oat + 8]).rstrip(b"\0") != _OAT_VERSION:
+            raise NotImplementedError("oat magic does not match expected value!")
+
+        dex_files = vdex_dex_files(_mmap(stack, vdex_path))
+        if not dex_files:
+            if apk_path is None:
+                raise NotImplementedError("vdex has no dex files and no apk to read them from")
+            dex_files = apk_dex_files(apk_path)
+
+        odo = f"0x{oatdata_offset:x}"
+        for location, dex, class_offsets_offset in _oat_dex_files(odex, oat, dex_files):
+            # each dex is seperate and provided as /path/to/base.apk[!classesN.dex]
+            loc = location.split('/')[-1].strip()
+            log.info(f"  reading odex at: {loc}")
+            if not location_in_profile(profile_info, loc):
+                continue
+            hot = profile_info['hot'].get(loc, EMPTY)
+            startup = profile_info['startup'].get(loc, EMPTY)
+            poststartup = profile_info['poststartup'].get(loc, EMPTY)
+            in_any = union(hot, startup, poststartup)
+
+            for class_def_idx, method_idxs in dex.class_methods():
+                if not include_nonprofile and not any(m in in_any for m in method_idxs):
+                    continue
+                (class_offset,) = struct.unpack_from("<I", odex, oat + class_offsets_offset + 4 * class_def_idx)
+                code_offsets = _code_offsets(odex, oat + class_offset, len(method_idxs))
+                for method_idx, code_offset in zip(method_idxs, code_offsets, strict=True):
+                    if not include_nonprofile and method_idx not in in_any:
+                        continue
+                    dat = (
+                        loc,
+                        method_idx,
+                        f"0x{code_offset:08x}",
+                        odo,
+                        code_offset + oatdata_offset,
+                        dex.pretty_method(method_idx),
+                    )
+                    add_to_oatdump_info(oatdump_info, dat, hot, startup, poststartup)
+
+    check_oatdump_info(oatdump_info, magic_check=3) # magic checked above
+
+    log.debug("odex parsed for offsets")
+    return oatdump_info, oatdata_offset
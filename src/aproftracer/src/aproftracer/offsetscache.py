@@ -0,0 +1,81 @@
+"""
+content addressed cache for profile_info and offsets_info, shared by all runs on a host.
+
+extracting the profile, pulling the odex or running oatdump, and parsing it all is the same work
+for every run of an app as long as the dm, the compiled odex and the device build are the same.
+entries are keyed by a hash over exactly these (plus whether non profile methods are included),
+all three are hashed on the device, so a hit doesn't need a single pull.
+
+the cache is a plain directory, point all workers of a host at the same one. entries are written
+to a temporary file and renamed, so readers never see half an entry, and computing an entry holds
+a lock on it, so workers that start the same app at the same time wait for the first one instead
+of all doing the work.
+"""
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# bump when the layout of profile_info or offsets_info changes, old entries are ignored then
+_VERSION = 1
+
+
+def cache_key(dm_hash, odex_hash, build_fingerprint, include_nonprofile):
+    key = f"{_VERSION}\n{dm_hash}\n{odex_hash}\n{build_fingerprint}\n{bool(include_nonprofile)}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class OffsetsCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.pickle"
+
+    def get(self, key):
+        """(profile_info, offsets_info, oatdata_offset) or None"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError):
+            log.warning(f"ignoring broken offsets cache entry {path}")
+            return None
+        log.debug(f"offsets cache hit {key}")
+        return entry['profile_info'], entry['offsets_info'], entry['oatdata_offset']
+
+    def put(self, key, profile_info, offsets_info, oatdata_offset):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        entry = {'profile_info': profile_info, 'offsets_info': offsets_info, 'oatdata_offset': oatdata_offset}
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{key}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(entry, f)
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp)
+            raise
+        log.debug(f"offsets cache stored {key}")
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """exclusive between all processes using this cache dir, while an entry is looked up or computed"""
+        path = self._path(key).with_suffix(".lock")
+        path.parent.mkdir(exist_ok=True)
+        with open(path, "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
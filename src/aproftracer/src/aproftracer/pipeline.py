@@ -0,0 +1,130 @@
+"""
+pipelined batches: the host work of the next and the last app overlaps with the device run of this one.
+
+one app after the other, the device idles while the host parses the oatdump or odex and writes
+tracepoints.sh, and the host idles while the tool runs for minutes. so every app is split into the
+steps of the Tracer that need the device and the ones that only need the host:
+
+  device  setup(N+1)   install, fetch_tracepoint_inputs (pulls what is parsed)
+  host    build(N+1)   build_tracepoints: parse, filter, write tracepoints.sh
+  device  run(N)       push_tracepoints, run_tracer, collect_results
+  host    write(N)     write_results: parse the trace, write the result, cleanup_host
+  device  reset(N)     reset_device: cleanup_android and a soft reset (or a reboot, then the Tracer
+                       of N+1 reconnects)
+
+the device steps run one after the other on the calling thread, the host steps on a few worker
+threads (the parsers release the gil in numpy, or use processes, see --parse-workers). so while app N
+runs on the device, N+1 is built and N-1 is written, the device only waits for the host if building an
+app takes longer than running the one before.
+
+the next app is installed before this one runs. it is not started, and the tool only starts this one.
+"""
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+_HOST_WORKERS = 2
+# exit code of an app that failed, like main
+FAILED = 131
+
+
+class Pipeline:
+    """
+    new_tracer(app) makes the Tracer of an app, install(tracer) installs it (or does nothing),
+    prepare_args are the arguments of prepare_tracepoints_sh and run_kwargs the ones of run_tracer.
+    reboot_every goes to reset_device.
+    """
+
+    def __init__(self, new_tracer, install, prepare_args, run_kwargs, cleanup_android=True, cleanup_host=True, host_workers=_HOST_WORKERS, reboot_every=1):
+        self.new_tracer = new_tracer
+        self.install = install
+        self.code_coverage, self.also_startup_poststartup, self.only_appid = prepare_args
+        self.run_kwargs = run_kwargs
+        self.cleanup_android = cleanup_android
+        self.cleanup_host = cleanup_host
+        self.host_workers = host_workers
+        self.reboot_every = reboot_every
+        self.retcodes = {}
+
+    def _failed(self, app, step):
+        log.critical(f"{app}: generic exception caught in {step}")
+        log.critical(traceback.format_exc())
+        self.retcodes[app] = FAILED
+
+    def _setup(self, app, executor):
+        """device part of preparing app, its build is started on the host. (tracer, build future) or None"""
+        tracer = None
+        try:
+            tracer = self.new_tracer(app)
+            self.install(tracer)
+            tracer.fetch_tracepoint_inputs(self.code_coverage)
+        except Exception:
+            self._failed(app, "setup")
+            if tracer is not None and self.cleanup_android:
+                tracer.cleanup_android()
+            return None
+        build = executor.submit(tracer.build_tracepoints, self.code_coverage, self.also_startup_poststartup, self.only_appid)
+        return tracer, build
+
+    def _run(self, app, tracer, build, executor):
+        """device run of app, its result is written on the host. the write future or None"""
+        try:
+            build.result()
+            tracer.push_tracepoints()
+            tracer.run_tracer(**self.run_kwargs)
+            tracer.collect_results()
+        except Exception:
+            self._failed(app, "run")
+            return None
+        return executor.submit(self._write, app, tracer)
+
+    def _write(self, app, tracer):
+        try:
+            tracer.write_results()
+            self.retcodes[app] = 0
+        except Exception:
+            self._failed(app, "write")
+        finally:
+            if self.cleanup_host:
+                tracer.cleanup_host()
+
+    def _reset(self, tracer, next_setup):
+        if not self.cleanup_android:
+            return
+        rebooted = tracer.reset_device(self.reboot_every)
+        if rebooted and next_setup is not None:
+            next_setup[0].reconnect()
+
+    def run(self, apps):
+        """run all apps, returns {app: exit code}"""
+        apps = list(dict.fromkeys(apps))
+        writes = []
+        with ThreadPoolExecutor(max_workers=self.host_workers, thread_name_prefix="host") as executor:
+            setup = self._setup(apps[0], executor) if apps else None
+            for i, app in enumerate(apps):
+                current, setup = setup, None
+                if i + 1 < len(apps):
+                    setup = self._setup(apps[i + 1], executor)
+                if current is None:
+                    continue
+                tracer, build = current
+                log.info(f"running {app} ({i + 1}/{len(apps)})")
+                write = self._run(app, tracer, build, executor)
+                if write is not None:
+                    writes.append(write)
+                try:
+                    self._reset(tracer, setup)
+                except Exception:
+                    # the device is gone, nothing after this app can run
+                    log.critical(f"resetting the device after {app} failed, stopping the batch")
+                    log.critical(traceback.format_exc())
+                    break
+            for write in writes:
+                write.result()
+        for app in apps:
+            self.retcodes.setdefault(app, FAILED)
+        done = sum(1 for code in self.retcodes.values() if code == 0)
+        log.info(f"{done}/{len(apps)} apps done")
+        return self.retcodes
@@ -0,0 +1,235 @@
+"""
+decoder for binary ART profiles (primary.prof, baseline.prof), replaces `profman --dump-only` and parsing its text.
+
+two versions are supported:
+- 015 (android 12+): header, section table, then separately zlib compressed sections for dex files,
+  extra descriptors, classes and methods. the methods of a dex are a bitmap per non-hot flag plus a
+  list of hot methods with their inline caches.
+- 010 (android 9-11, also what androidx writes to assets/dexopt/baseline.prof): header, then one zlib
+  stream with the line headers of all dex files followed by their data (hot methods, classes, and a
+  startup/post startup bitmap).
+
+a decoded profile is a list of dicts, one per dex file in profile index order:
+{'key': str, 'checksum': int, 'num_type_ids': int, 'num_method_ids': int,
+ 'hot': BitmapSet, 'startup': BitmapSet, 'poststartup': BitmapSet, 'classes': BitmapSet}
+the bitmap regions of the file become BitmapSets as they are, without going through python ints.
+"""
+import logging
+import struct
+import zlib
+
+from aproftracer.bitmapset import EMPTY, BitmapSet
+
+log = logging.getLogger(__name__)
+
+_MAGIC = b"pro\0"
+_VERSION_015 = b"015\0"
+_VERSION_010 = b"010\0"
+
+# FileSectionType
+_SECTION_DEX_FILES = 0
+_SECTION_CLASSES = 2
+_SECTION_METHODS = 3
+
+# MethodHotness::Flag, the bitmap has a region for every flag but hot
+_FLAG_HOT = 1 << 0
+_FLAG_STARTUP = 1 << 1
+_FLAG_POST_STARTUP = 1 << 2
+
+# inline caches with these sizes have no classes following
+_IS_MISSING_TYPES_ENCODING = 6
+_IS_MEGAMORPHIC_ENCODING = 7
+
+
+def is_prof(path):
+    """binary profile, as opposed to a text dump of one"""
+    with open(path, "rb") as f:
+        return f.read(4) == _MAGIC
+
+
+def read_prof(prof_path):
+    with open(prof_path, "rb") as f:
+        return decode_prof(f.read())
+
+
+def decode_prof(data):
+    if data[:4] != _MAGIC:
+        raise NotImplementedError("profile magic does not match expected value!")
+    version = data[4:8]
+    if version == _VERSION_015:
+        return _decode_015(data)
+    if version == _VERSION_010:
+        return _decode_010(data)
+    raise NotImplementedError("got a profile in an unknown version, compatibility not certain.")
+
+
+def _new_dex(key, checksum, num_type_ids, num_method_ids):
+    return {
+        'key': key,
+        'checksum': checksum,
+        'num_type_ids': num_type_ids,
+        'num_method_ids': num_method_ids,
+        'hot': EMPTY,
+        'startup': EMPTY,
+        'poststartup': EMPTY,
+        'classes': EMPTY,
+    }
+
+
+def _read_diffs(data, pos, count):
+    """count u16 deltas as written for sorted indices, returns (indices, new pos)"""
+    idx = 0
+    result = []
+    for diff in struct.unpack_from(f"<{count}H", data, pos):
+        idx += diff
+        result.append(idx)
+    return result, pos + 2 * count
+
+
+def _decode_015(data):
+    (num_sections,) = struct.unpack_from("<I", data, 8)
+    sections = {}
+    for i in range(num_sections):
+        kind, offset, size, inflated_size = struct.unpack_from("<4I", data, 12 + 16 * i)
+        section = data[offset:offset + size]
+        if inflated_size:
+            section = zlib.decompress(section)
+            if len(section) != inflated_size:
+                raise NotImplementedError(f"profile section {kind} inflated to an unexpected size")
+        sections[kind] = section
+    if _SECTION_DEX_FILES not in sections:
+        raise NotImplementedError("profile has no dex files section")
+
+    # number_of_dex_files, then (checksum, num_type_ids, num_method_ids, u16 length prefixed profile_key)
+    section = sections[_SECTION_DEX_FILES]
+    (num_dex_files,) = struct.unpack_from("<H", section, 0)
+    pos = 2
+    dex_files = []
+    for _ in range(num_dex_files):
+        checksum, num_type_ids, num_method_ids, key_size = struct.unpack_from("<3IH", section, pos)
+        pos += 14
+        key = section[pos:pos + key_size].decode("utf-8", errors="backslashreplace")
+        pos += key_size
+        dex_files.append(_new_dex(key, checksum, num_type_ids, num_method_ids))
+
+    # records of (profile_index, number_of_classes, type_index_diff[number_of_classes])
+    section = sections.get(_SECTION_CLASSES, b"")
+    pos = 0
+    while pos < len(section):
+        profile_index, num_classes = struct.unpack_from("<HH", section, pos)
+        classes, pos = _read_diffs(section, pos + 4, num_classes)
+        dex_files[profile_index]['classes'] |= BitmapSet.from_indices(classes)
+
+    # records of (profile_index, following_data_size, method_flags, bitmap_data, method_encoding[])
+    section = sections.get(_SECTION_METHODS, b"")
+    pos = 0
+    while pos < len(section):
+        profile_index, following_size, method_flags = struct.unpack_from("<HIH", section, pos)
+        end = pos + 6 + following_size
+        pos += 8
+        dex = dex_files[profile_index]
+        num_method_ids = dex['num_method_ids']
+
+        # one region of num_method_ids bits for every flag but hot, in flag order
+        bitmap_flags = method_flags & ~_FLAG_HOT
+        bitmap_size = (bin(bitmap_flags).count("1") * num_method_ids + 7) // 8
+        bitmap = section[pos:pos + bitmap_size]
+        pos += bitmap_size
+        region = 0
+        flag = _FLAG_STARTUP
+        while flag <= bitmap_flags:
+            if bitmap_flags & flag:
+                if flag == _FLAG_STARTUP:
+                    dex['startup'] = BitmapSet.from_bitmap(bitmap, region * num_method_ids, num_method_ids)
+                elif flag == _FLAG_POST_STARTUP:
+                    dex['poststartup'] = BitmapSet.from_bitmap(bitmap, region * num_method_ids, num_method_ids)
+                region += 1
+            flag <<= 1
+
+        # hot methods: method_index_diff, number_of_inline_caches, (dex_pc, size, type_index_diff[size])[]
+        method_idx = 0
+        hot = []
+        while pos < end:
+            diff, num_inline_caches = struct.unpack_from("<HH", section, pos)
+            pos += 4
+            method_idx += diff
+            hot.append(method_idx)
+            for _ in range(num_inline_caches):
+                size = section[pos + 2]
+                pos += 3
+                if size not in (_IS_MISSING_TYPES_ENCODING, _IS_MEGAMORPHIC_ENCODING):
+                    pos += 2 * size
+        if pos != end:
+            raise NotImplementedError(f"profile methods of {dex['key']} do not end where expected")
+        dex['hot'] = BitmapSet.from_indices(hot)
+    return dex_files
+
+
+def _decode_010(data):
+    num_dex_files, uncompressed_size, compressed_size = struct.unpack_from("<BII", data, 8)
+    body = zlib.decompress(data[17:17 + compressed_size])
+    if len(body) != uncompressed_size:
+        raise NotImplementedError("profile inflated to an unexpected size")
+
+    # line headers: (u16 key size, u16 class set size, u32 methods region size, u32 checksum, u32 num_method_ids, key)
+    pos = 0
+    lines = []
+    for _ in range(num_dex_files):
+        key_size, num_classes, methods_size, checksum, num_method_ids = struct.unpack_from("<HHIII", body, pos)
+        pos += 16
+        key = body[pos:pos + key_size].decode("utf-8", errors="backslashreplace")
+        pos += key_size
+        # num_type_ids is not part of this version
+        lines.append((_new_dex(key, checksum, 0, num_method_ids), num_classes, methods_size))
+
+    # line data: hot methods, classes, then a bitmap with a startup and a post startup region
+    for dex, num_classes, methods_size in lines:
+        end = pos + methods_size
+        method_idx = 0
+        hot = []
+        while pos < end:
+            diff, num_inline_caches = struct.unpack_from("<HH", body, pos)
+            pos += 4
+            method_idx += diff
+            hot.append(method_idx)
+            for _ in range(num_inline_caches):
+                size = body[pos + 2]
+                pos += 3
+                if size in (_IS_MISSING_TYPES_ENCODING, _IS_MEGAMORPHIC_ENCODING):
+                    continue
+                # (u8 profile index, u8 number of classes, class ids) per dex
+                for _ in range(size):
+                    pos += 2 + 2 * body[pos + 1]
+        dex['hot'] = BitmapSet.from_indices(hot)
+        classes, pos = _read_diffs(body, pos, num_classes)
+        dex['classes'] = BitmapSet.from_indices(classes)
+        num_method_ids = dex['num_method_ids']
+        bitmap_size = (2 * num_method_ids + 7) // 8
+        bitmap = body[pos:pos + bitmap_size]
+        pos += bitmap_size
+        dex['startup'] = BitmapSet.from_bitmap(bitmap, 0, num_method_ids)
+        dex['poststartup'] = BitmapSet.from_bitmap(bitmap, num_method_ids, num_method_ids)
+    return [dex for dex, _, _ in lines]
+
+
+def to_profile_info(dex_files):
+    """
+    the profile_info of Tracer.read_profdump_info. it files the 'post startup methods' of the dump under
+    'startup' and the 'startup methods' under 'poststartup', this keeps that labeling so results stay comparable.
+    """
+    profile_info = {
+            'startup':{},
+            'poststartup':{},
+            'hot':{}
+        }
+    for dex in dex_files:
+        profile_info['hot'][dex['key']] = dex['hot']
+        profile_info['startup'][dex['key']] = dex['poststartup']
+        profile_info['poststartup'][dex['key']] = dex['startup']
+    return profile_info
+
+
+def read_prof_info(prof_path):
+    profile_info = to_profile_info(read_prof(prof_path))
+    log.debug("decoded profile")
+    return profile_info
@@ -0,0 +1,437 @@
+"""
+bulk parser for the raw uprobe trace, the trace_pipe output that is pulled as raw_output.txt.
+
+a run easily has millions of hits, going through them line by line with split and float is what
+made saving results slow. instead the file is memory-mapped and handled in large chunks with numpy:
+the usual hit line
+
+  "app.organicmaps-24536   [002] .....  4423.725704: event0x1d96b0: (0x6e16e3e6b0)"
+
+is found by its ": event0x", and the timestamp, offset and the rest of the line are read from
+fixed size windows around it for all lines of a chunk at once. the part in front of the timestamp
+(task, cpu and flags) only has a handful of distinct values, so checking it and interning the
+process name happens once per distinct value, not once per line. everything else (LOST EVENTS,
+bpf_trace_printk, unusual layouts) is rare and goes through the line based original, so the hits
+are exactly the ones Tracer.parse_raw_hit_uprobes always returned.
+
+results keep the hits as HitRecords, 16 bytes per hit instead of a tuple with two strings and a float.
+"""
+import contextlib
+import logging
+import mmap
+import os
+import re
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from aproftracer import compression
+from aproftracer.oatdump import iter_line_chunks
+
+log = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 4 * 1024 * 1024
+
+# hit lines with longer fields than these go through feed_line
+_PAD = 64
+_PREFIX_WIDTH = 48
+_STAMP_WIDTH = 16
+_HEX_WIDTH = 16
+_TAIL_WIDTH = 24
+
+_MARKER = b": event0x"
+_RE_PREFIX = re.compile(rb"[^\[\n\r]*\[[0-9]+\][ \t]+[.0-9a-zA-Z]+[ \t]+")
+
+# a prefix that is skipped with all its lines, or that needs to go through feed_line
+_SKIP = -1
+_SLOW = -2
+
+
+def _table(chars, values, default):
+    table = np.full(256, default, dtype=np.uint8)
+    table[np.frombuffer(chars, dtype=np.uint8)] = values
+    return table
+
+
+_STAMP = _table(b"0123456789.", 1, 0)
+_STAMP_DUMMY = np.frombuffer(b"0".ljust(_STAMP_WIDTH, b"\0"), dtype=np.uint8)
+_HEX = _table(b"0123456789abcdef", np.arange(16), 255)
+# what may follow the offset without changing how the original saw the line, no '[', no letters of LOST EVENTS
+_TAIL = _table(b"0123456789abcdefx(): \t", 1, 0).astype(bool)
+
+
+def _decode(b):
+    return b.decode("utf-8", errors="backslashreplace")
+
+
+class RawTrace:
+    """
+    hits of a raw trace in typed arrays: hit i is process comms[comm[i]] hitting the probe at offset[i]
+    at time[i], as printed by the kernel. lost_events is the sum over all LOST EVENTS lines.
+    """
+
+    def __init__(self, time, offset, comm, comms, lost_events):
+        self.time = time
+        self.offset = offset
+        self.comm = comm
+        self.comms = comms
+        self.lost_events = lost_events
+
+    def __len__(self):
+        return len(self.time)
+
+    def relative_time(self):
+        """timestamps relative to the first hit"""
+        nonzero = np.flatnonzero(self.time)
+        if not len(nonzero):
+            return np.zeros_like(self.time)
+        # a first timestamp of 0 is no first timestamp, the original parser took the next one
+        first = nonzero[0]
+        relative = self.time - self.time[first]
+        relative[:first] = 0.0
+        return relative
+
+    def to_hit_uprobes(self):
+        """[(process name, relative timestamp, "0x.." offset)], the hits as they used to be saved"""
+        comms = self.comms
+        return list(zip(
+            [comms[c] for c in self.comm.tolist()],
+            self.relative_time().tolist(),
+            map(hex, self.offset.tolist()),
+            strict=True,
+        ))
+
+    def to_hit_records(self, trace_info):
+        """HitRecords with probe indices into trace_info"""
+        probes = [offset for offset, _ in trace_info]
+        index = {int(offset, 16): i for i, offset in enumerate(probes)}
+        offsets, inverse = np.unique(self.offset, return_inverse=True)
+        probe = []
+        for offset in offsets.tolist():
+            i = index.get(offset)
+            if i is None:
+                log.warning(f"hit probe {hex(offset)} that is not in trace_info")
+                i = len(probes)
+                probes.append(hex(offset))
+            probe.append(i)
+        hits = np.empty(len(self), dtype=HIT_DTYPE)
+        hits['probe'] = np.array(probe, dtype=np.uint32)[inverse]
+        hits['comm'] = self.comm
+        hits['time'] = self.relative_time()
+        return HitRecords(hits, list(self.comms), probes)
+
+
+# 16 bytes per hit: index into HitRecords.probes, index into HitRecords.comms, seconds since the first hit
+HIT_DTYPE = np.dtype([('probe', '<u4'), ('comm', '<u4'), ('time', '<f8')])
+
+
+class HitRecords:
+    """
+    the hits of a run as in older result.pickle files, a structured array of HIT_DTYPE plus the two string tables.
+    probes starts with the offsets of trace_info in the same order, so a probe index is an index into trace_info
+    (probes that were hit but are not in trace_info follow). iterating gives the old
+    (process name, relative timestamp, "0x.." offset) tuples.
+    """
+
+    def __init__(self, hits, comms, probes):
+        self.hits = hits
+        self.comms = comms
+        self.probes = probes
+
+    @classmethod
+    def from_hit_uprobes(cls, hit_uprobes, trace_info):
+        """from the list of tuples that older results have"""
+        probes = [offset for offset, _ in trace_info]
+        probe_ids = {offset: i for i, offset in enumerate(probes)}
+        comms = []
+        comm_ids = {}
+        hits = np.empty(len(hit_uprobes), dtype=HIT_DTYPE)
+        for i, (pname, ts, offset) in enumerate(hit_uprobes):
+            if offset not in probe_ids:
+                probe_ids[offset] = len(probes)
+                probes.append(offset)
+            if pname not in comm_ids:
+                comm_ids[pname] = len(comms)
+                comms.append(pname)
+            hits[i] = (probe_ids[offset], comm_ids[pname], ts)
+        return cls(hits, comms, probes)
+
+    @property
+    def probe(self):
+        return self.hits['probe']
+
+    @property
+    def comm(self):
+        return self.hits['comm']
+
+    @property
+    def time(self):
+        return self.hits['time']
+
+    def __len__(self):
+        return len(self.hits)
+
+    def __iter__(self):
+        comms, probes = self.comms, self.probes
+        for probe, comm, ts in self.hits.tolist():
+            yield comms[comm], ts, probes[probe]
+
+
+class RawTraceParser:
+    """feed it buffers of whole lines, collects the hits and lost events."""
+
+    def __init__(self):
+        self.comms = []
+        self.lost_events = 0
+        self._comm_ids = {}
+        # task, cpu and flags in front of the timestamp -> comm id, _SKIP or _SLOW
+        self._prefixes = {}
+        # arrays of (time, offset, comm), in line order
+        self._pieces = []
+        # hits from feed_line that are not in a piece yet
+        self._time, self._offset, self._comm = [], [], []
+        # pieces new_offsets already returned
+        self._seen_pieces = 0
+
+    def _intern(self, pname):
+        comm_id = self._comm_ids.get(pname)
+        if comm_id is None:
+            comm_id = self._comm_ids[pname] = len(self.comms)
+            self.comms.append(pname)
+        return comm_id
+
+    def _prefix_comm(self, prefix):
+        comm_id = self._prefixes.get(prefix)
+        if comm_id is None:
+            comm_id = self._prefixes[prefix] = self._check_prefix(prefix)
+        return comm_id
+
+    def _check_prefix(self, prefix):
+        # the rest of a plain hit line has no '[' and none of these strings, only the prefix decides
+        if not _RE_PREFIX.fullmatch(prefix):
+            return _SLOW
+        line = _decode(prefix)
+        if "LOST" in line and "EVENTS" in line:
+            # the lost count is taken from the end of the line
+            return _SLOW
+        if " bpf_trace_printk: " in line:
+            return _SKIP
+        pname = line.split("[")[0].strip()
+        if "-" not in pname:
+            log.warning(f"no process name in lines starting with: '{line}'")
+            return _SKIP
+        return self._intern(pname)
+
+    def _flush(self):
+        if self._time:
+            self._pieces.append((
+                np.array(self._time, dtype=np.float64),
+                np.array(self._offset, dtype=np.uint64),
+                np.array(self._comm, dtype=np.uint32),
+            ))
+            self._time, self._offset, self._comm = [], [], []
+
+    def _add_hits(self, time, offset, comm):
+        self._flush()
+        if len(time):
+            self._pieces.append((time, offset, comm))
+
+    def feed_line(self, line):
+        """the line based original, for everything that is not a plain hit line"""
+        line = line.rstrip()
+        # bpf can have lost events, handle those
+        if "LOST" in line and "EVENTS" in line:
+            with contextlib.suppress(ValueError, IndexError):
+                self.lost_events += int(line.split()[-2])
+            return
+        elif " bpf_trace_printk: " in line:
+            # ignore kerneltraces
+            return
+        # "AsyncTask #2-10249 [005] ..... 184.273432: event0xa4610: (0x767e1bc610)" -> process name can have space!
+        if "event0x" not in line or "[" not in line:
+            log.warning(f"unexpected raw line: '{line}'")
+            return
+        name_n_other = line.split("[")
+        if len(name_n_other) != 2:
+            log.warning(f"multiple '[' found, assuming part of name: {name_n_other}")
+        parts = name_n_other[-1].split()
+        if len(parts) < 4:
+            log.warning(f"unexpected raw line: '{line}'")
+            return
+
+        # get process name
+        pname = ' '.join(name_n_other[:-1]).strip()
+        if "-" not in pname:
+            log.warning(f"no process name in line: '{line}'")
+            return
+
+        # get timestamp
+        if parts[2][-1] != ':':
+            log.warning(f"timestamp format wrong in line: '{line}'")
+            return
+        try:
+            timestamp = float(parts[2][:-1])
+        except ValueError:
+            log.warning(f"timestamp format not float in line: '{line}'")
+            return
+
+        # get offset
+        if parts[3][:7] != "event0x" or parts[3][-1] != ':':
+            log.warning(f"event tag wrong in line: '{line}'")
+            return
+        try:
+            offset = int(parts[3][5:-1], 16)
+        except ValueError:
+            log.warning(f"offset not an int in line: '{line}'")
+            return
+        self._time.append(timestamp)
+        self._offset.append(offset)
+        self._comm.append(self._intern(pname))
+
+    def _feed_raw_line(self, raw):
+        # text mode also ends lines on \r
+        text = _decode(raw)
+        if text.endswith("\r"):
+            text = text[:-1]
+        for line in text.split("\r"):
+            self.feed_line(line)
+
+    def feed(self, buf, start, end):
+        """parse the lines in buf[start:end], start has to be at the beginning of a line"""
+        size = end - start
+        if not size:
+            return
+        # padded, so the windows never run out of the chunk
+        data = np.zeros(size + 2 * _PAD, dtype=np.uint8)
+        text = data[_PAD:_PAD + size]
+        text[:] = np.frombuffer(buf, dtype=np.uint8, count=size, offset=start)
+
+        line_ends = np.flatnonzero(text == ord("\n"))
+        if not len(line_ends) or line_ends[-1] != size - 1:
+            line_ends = np.append(line_ends, size)
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1)) + _PAD
+        line_ends += _PAD
+
+        # the first ": event0x" of each line
+        x = np.flatnonzero(text == ord("x")) + _PAD
+        found = np.ones(len(x), dtype=bool)
+        for i, c in enumerate(_MARKER[:-1], start=1 - len(_MARKER)):
+            found &= data[x + i] == c
+        marker = x[found] - len(_MARKER) + 1
+        lines = np.searchsorted(line_ends, marker)
+        first = np.ones(len(lines), dtype=bool)
+        first[1:] = lines[1:] != lines[:-1]
+        marker, lines = marker[first], lines[first]
+        line_start = line_starts[lines]
+        line_end = line_ends[lines]
+        line_end -= data[line_end - 1] == ord("\r")
+
+        # timestamp: from the last whitespace to the marker, digits with at most one dot
+        w = sliding_window_view(data, _STAMP_WIDTH + 1)[marker - _STAMP_WIDTH - 1]
+        space = (w == ord(" ")) | (w == ord("\t"))
+        stamp_len = np.argmax(space[:, ::-1], axis=1)
+        stamp_start = marker - stamp_len
+        ok = space.any(axis=1) & (stamp_start > line_start) & (stamp_len >= 1)
+        w = sliding_window_view(data, _STAMP_WIDTH)[stamp_start]
+        w[np.arange(_STAMP_WIDTH) >= stamp_len[:, None]] = 0
+        dots = (w == ord(".")).sum(axis=1)
+        ok &= (_STAMP[w] != 0).sum(axis=1) == stamp_len
+        ok &= (dots <= 1) & (dots < stamp_len)
+        # numpy rounds like float() does, lines that are no hits get a dummy
+        w[~ok] = _STAMP_DUMMY
+        time = w.view(f"S{_STAMP_WIDTH}").ravel().astype(np.float64)
+
+        # offset: hex digits after the marker up to the ':', right aligned and packed to big endian u8s
+        hex_start = marker + len(_MARKER)
+        w = _HEX[sliding_window_view(data, _HEX_WIDTH + 1)[hex_start]]
+        num_hex = np.argmax(w == 255, axis=1)
+        hex_end = hex_start + num_hex
+        ok &= (num_hex >= 1) & (data[hex_end] == ord(":"))
+        w = _HEX[sliding_window_view(data, _HEX_WIDTH)[hex_end - _HEX_WIDTH]]
+        w[np.arange(_HEX_WIDTH) < _HEX_WIDTH - num_hex[:, None]] = 0
+        packed = (w[:, 0::2] << 4) | w[:, 1::2]
+        offset = packed.view(">u8").ravel().astype(np.uint64)
+
+        # tail: the ':', then nothing or whitespace and the usual "(0x6e16e3e6b0)"
+        tail_len = line_end - hex_end
+        w = sliding_window_view(data, _TAIL_WIDTH)[hex_end]
+        in_tail = np.arange(_TAIL_WIDTH) < tail_len[:, None]
+        ok &= (tail_len >= 1) & (tail_len <= _TAIL_WIDTH) & (_TAIL[w] | ~in_tail).all(axis=1)
+        ok &= (tail_len == 1) | (w[:, 1] == ord(" ")) | (w[:, 1] == ord("\t"))
+
+        # prefix: everything in front of the timestamp, grouped by a hash and compared to be sure
+        prefix_len = stamp_start - line_start
+        ok &= prefix_len <= _PREFIX_WIDTH
+        idx = np.flatnonzero(ok)
+        prefix_len = prefix_len[idx]
+        w = sliding_window_view(data, _PREFIX_WIDTH)[line_start[idx]]
+        w *= np.arange(_PREFIX_WIDTH) < prefix_len[:, None]
+        words = w.view(np.uint64)
+        key = prefix_len.astype(np.uint64)
+        for col in words.T:
+            key = (key * np.uint64(0x100000001b3)) ^ col
+        _, rep, inverse = np.unique(key, return_index=True, return_inverse=True)
+        comm = np.array([self._prefix_comm(w[i, :prefix_len[i]].tobytes()) for i in rep], dtype=np.int64)[inverse]
+        same = (words == words[rep][inverse]).all(axis=1) & (prefix_len == prefix_len[rep][inverse])
+        comm[~same] = _SLOW
+
+        status = np.full(len(line_starts), _SLOW, dtype=np.int64)
+        status[lines[idx]] = comm
+        hit = comm >= 0
+        hit_lines = lines[idx][hit]
+        time, offset, comm = time[idx][hit], offset[idx][hit], comm[hit].astype(np.uint32)
+
+        # the other lines in between the hits
+        done = 0
+        for line in np.flatnonzero(status == _SLOW).tolist():
+            i = np.searchsorted(hit_lines, line)
+            self._add_hits(time[done:i], offset[done:i], comm[done:i])
+            done = i
+            self._feed_raw_line(data[line_starts[line]:line_ends[line]].tobytes())
+        self._add_hits(time[done:], offset[done:], comm[done:])
+
+    def new_offsets(self):
+        """offsets of the hits parsed since the last call, for watching a trace while it is parsed"""
+        self._flush()
+        pieces = self._pieces[self._seen_pieces:]
+        self._seen_pieces = len(self._pieces)
+        if not pieces:
+            return np.zeros(0, dtype=np.uint64)
+        return np.concatenate([offset for _, offset, _ in pieces])
+
+    def result(self):
+        self._flush()
+        if not self._pieces:
+            empty = np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint32)
+            return RawTrace(*empty, self.comms, self.lost_events)
+        time, offset, comm = (np.concatenate(column) for column in zip(*self._pieces, strict=True))
+        return RawTrace(time, offset, comm, self.comms, self.lost_events)
+
+
+def read_raw_trace(raw_output_path, chunk_size=_CHUNK_SIZE):
+    parser = RawTraceParser()
+    if compression.is_gzip(raw_output_path):
+        # decompressed in chunks of whole lines straight into the parser
+        with compression.open_stream(raw_output_path) as f:
+            for buf, end in iter_line_chunks(f, chunk_size):
+                parser.feed(buf, 1, end)
+        return parser.result()
+    with open(raw_output_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return parser.result()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                end = start + chunk_size
+                if end < size:
+                    # cut after the last full line, or after the first one if it is longer than a chunk
+                    cut = mm.rfind(b"\n", start, end)
+                    if cut == -1:
+                        cut = mm.find(b"\n", end)
+                    end = size if cut == -1 else cut + 1
+                else:
+                    end = size
+                parser.feed(mm, start, end)
+                start = end
+    return parser.result()
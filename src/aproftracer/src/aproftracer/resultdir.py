@@ -0,0 +1,311 @@
+"""
+columnar result format, a directory of .npy columns plus a small json manifest, replaces result.pickle.
+
+unpickling a result.pickle builds every python object in it, the offsets lists with a tuple and a
+method name per method included, even if only the hits are needed. here every column is its own
+.npy file that np.load can memory map, so an analysis over thousands of runs only pages in the
+columns (and parts of them) it actually touches. small tables (process names, dex locations,
+activities) live in the manifest.
+
+layout of a result directory, all arrays one dimensional:
+- manifest.json: format, version, counts and the small tables, see write_result
+- hits: probe (u4, index into probe_offset), comm (u4, index into manifest comms), time (f8, relative)
+- probe_offset (u8): offsets of the probes, the first num_tracepoints are trace_info,
+  trace_is_apkid (bool) is the other half of trace_info
+- method_*: one row per distinct method record of offsets_info, location and oatdata offset index
+  into manifest tables, method_name is a utf-8 blob with method_name_ends
+- offsets_<category>: rows of the methods in that category of offsets_info, in order
+- profile_bits (u1): the BitmapSets of profile_info back to back, manifest profile says where
+- probe_hitcount (u8, optional): hits per probe counted on the device, for captures that only log
+  the first hit of every probe (see uprobes.py), then hits has just those
+- probe_retired (f8, optional): when each probe was retired during the run, in seconds since the
+  retirement started, nan if it never was (see retirement.py)
+
+the version is bumped on any incompatible change, readers refuse versions they don't know.
+"""
+import json
+import logging
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+
+import click
+import numpy as np
+
+from aproftracer import log as pkglog
+from aproftracer.bitmapset import BitmapSet
+from aproftracer.rawtrace import HIT_DTYPE, HitRecords
+
+log = logging.getLogger(__name__)
+
+FORMAT = "aproftracer-result"
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# name of the result directory next to where result.pickle used to be
+RESULT_DIRNAME = "result"
+PICKLE_NAME = "result.pickle"
+
+
+def _save(path, name, array):
+    np.save(path / f"{name}.npy", array, allow_pickle=False)
+
+
+def _save_strings(path, name, strings):
+    data = [s.encode("utf-8", "surrogateescape") for s in strings]
+    _save(path, name, np.frombuffer(b"".join(data), dtype=np.uint8))
+    _save(path, f"{name}_ends", np.cumsum([len(b) for b in data], dtype=np.int64))
+
+
+def _index(table, ids, value):
+    if value not in ids:
+        ids[value] = len(table)
+        table.append(value)
+    return ids[value]
+
+
+def write_result(path, profile_info, offsets_info, trace_info, traced_activities, hit_records, probe_hitcount=None, probe_retired=None):
+    """
+    write the parts of a result, as they were pickled, to the directory path. an existing result there is replaced.
+    everything is written to a temporary directory next to it first, so readers never see half a result.
+    probe_hitcount are the hits of each of hit_records.probes, if they were counted on the device.
+    probe_retired is the retirement timeline {probe offset (hex string): seconds}, if probes were retired.
+    """
+    path = Path(path)
+    if not isinstance(hit_records, HitRecords):
+        hit_records = HitRecords.from_hit_uprobes(hit_records, trace_info or [])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{path.name}."))
+    try:
+        manifest = _write_columns(tmp, profile_info, offsets_info, trace_info, traced_activities, hit_records)
+        if probe_hitcount is not None:
+            if len(probe_hitcount) != manifest["num_probes"]:
+                raise RuntimeError(f"{len(probe_hitcount)} hit counts for {manifest['num_probes']} probes")
+            _save(tmp, "probe_hitcount", np.asarray(probe_hitcount, dtype="<u8"))
+        if probe_retired is not None:
+            index = {offset: i for i, offset in enumerate(hit_records.probes)}
+            retired = np.full(manifest["num_probes"], np.nan, dtype="<f8")
+            for offset, seconds in probe_retired.items():
+                if offset not in index:
+                    raise RuntimeError(f"retired probe {offset} is not a probe of the result")
+                retired[index[offset]] = seconds
+            _save(tmp, "probe_retired", retired)
+        with open(tmp / MANIFEST_NAME, "w") as f:
+            json.dump(manifest, f)
+        if path.exists():
+            shutil.rmtree(path)
+        tmp.rename(path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    log.debug(f"wrote result with {manifest['num_hits']} hits to {path}")
+
+
+def _write_columns(path, profile_info, offsets_info, trace_info, traced_activities, hit_records):
+    trace_info = trace_info or []
+    if not isinstance(hit_records, HitRecords):
+        hit_records = HitRecords.from_hit_uprobes(hit_records, trace_info)
+
+    # hits and probes
+    _save(path, "probe", np.ascontiguousarray(hit_records.probe, dtype="<u4"))
+    _save(path, "comm", np.ascontiguousarray(hit_records.comm, dtype="<u4"))
+    _save(path, "time", np.ascontiguousarray(hit_records.time, dtype="<f8"))
+    # offsets are hex() of the probe offset everywhere, they are stored as ints
+    _save(path, "probe_offset", np.array([int(o, 16) for o in hit_records.probes], dtype="<u8"))
+    _save(path, "trace_is_apkid", np.array([bool(a) for _, a in trace_info], dtype=bool))
+
+    # offsets_info, each record once even if it is in several categories
+    locations, location_ids = [], {}
+    odos, odo_ids = [], {}
+    records, record_ids = [], {}
+    categories = {}
+    for category, dats in (offsets_info or {}).items():
+        categories[category] = np.array([_index(records, record_ids, dat) for dat in dats], dtype="<i8")
+    _save(path, "method_location", np.array([_index(locations, location_ids, r[0]) for r in records], dtype="<u4"))
+    _save(path, "method_idx", np.array([r[1] for r in records], dtype="<u4"))
+    # the code offset stays the string it was, oatdump and the odex reader don't pad it the same way
+    _save(path, "method_code_offset", np.array([r[2].encode("ascii") for r in records], dtype=np.bytes_))
+    _save(path, "method_oatdata_offset", np.array([_index(odos, odo_ids, r[3]) for r in records], dtype="<u4"))
+    _save(path, "method_offset", np.array([r[4] for r in records], dtype="<u8"))
+    _save_strings(path, "method_name", [r[5] for r in records])
+    for category, rows in categories.items():
+        _save(path, f"offsets_{category}", rows)
+
+    # profile_info
+    profile, bits = [], []
+    start = 0
+    for category, dexes in (profile_info or {}).items():
+        for location, methods in dexes.items():
+            b = BitmapSet.from_indices(methods).bits
+            profile.append({"category": category, "location": location, "start": start, "length": len(b)})
+            bits.append(b)
+            start += len(b)
+    _save(path, "profile_bits", np.frombuffer(b"".join(bits), dtype=np.uint8))
+
+    return {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "num_hits": len(hit_records),
+        "num_tracepoints": len(trace_info),
+        "num_probes": len(hit_records.probes),
+        "num_methods": len(records),
+        "comms": list(hit_records.comms),
+        "locations": locations,
+        "oatdata_offsets": odos,
+        "offsets_categories": list(categories),
+        "profile": profile,
+        "traced_activities": traced_activities,
+    }
+
+
+class Result:
+    """
+    a result directory, columns are memory mapped on access (mmap=False reads them instead).
+    probe, comm and time work like the ones of HitRecords without building it.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = Path(path)
+        with open(self.path / MANIFEST_NAME) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT:
+            raise NotImplementedError(f"{self.path} is not an aproftracer result")
+        if self.manifest.get("version") != FORMAT_VERSION:
+            raise NotImplementedError(f"result format version {self.manifest.get('version')} of {self.path} not supported")
+        self._mmap_mode = "r" if mmap else None
+
+    def column(self, name):
+        return np.load(self.path / f"{name}.npy", mmap_mode=self._mmap_mode, allow_pickle=False)
+
+    def _strings(self, name):
+        data = self.column(name).tobytes()
+        start = 0
+        out = []
+        for end in self.column(f"{name}_ends").tolist():
+            out.append(data[start:end].decode("utf-8", "surrogateescape"))
+            start = end
+        return out
+
+    def __len__(self):
+        return self.manifest["num_hits"]
+
+    @property
+    def num_tracepoints(self):
+        return self.manifest["num_tracepoints"]
+
+    @property
+    def probe(self):
+        return self.column("probe")
+
+    @property
+    def comm(self):
+        return self.column("comm")
+
+    @property
+    def time(self):
+        return self.column("time")
+
+    @property
+    def comms(self):
+        return self.manifest["comms"]
+
+    @property
+    def probes(self):
+        return [hex(o) for o in self.column("probe_offset").tolist()]
+
+    @property
+    def traced_activities(self):
+        activities = self.manifest["traced_activities"]
+        return None if activities is None else [tuple(a) for a in activities]
+
+    def probe_hitcount(self):
+        """hits per probe counted on the device, or None if every hit is in the hits columns"""
+        if not (self.path / "probe_hitcount.npy").exists():
+            return None
+        return self.column("probe_hitcount")
+
+    def probe_retired(self):
+        """when each probe was retired in seconds, nan if never, or None if probes were not retired"""
+        if not (self.path / "probe_retired.npy").exists():
+            return None
+        return self.column("probe_retired")
+
+    def trace_info(self):
+        offsets = self.probes[:self.num_tracepoints]
+        return list(zip(offsets, self.column("trace_is_apkid").tolist(), strict=True))
+
+    def hit_records(self):
+        hits = np.empty(len(self), dtype=HIT_DTYPE)
+        hits['probe'] = self.probe
+        hits['comm'] = self.comm
+        hits['time'] = self.time
+        return HitRecords(hits, list(self.comms), self.probes)
+
+    def profile_info(self):
+        bits = self.column("profile_bits")
+        profile_info = {}
+        for p in self.manifest["profile"]:
+            dexes = profile_info.setdefault(p["category"], {})
+            dexes[p["location"]] = BitmapSet(bits[p["start"]:p["start"] + p["length"]].tobytes())
+        return profile_info
+
+    def offsets_info(self):
+        locations = self.manifest["locations"]
+        odos = self.manifest["oatdata_offsets"]
+        records = list(zip(
+            [locations[i] for i in self.column("method_location").tolist()],
+            self.column("method_idx").tolist(),
+            [o.decode("ascii") for o in self.column("method_code_offset").tolist()],
+            [odos[i] for i in self.column("method_oatdata_offset").tolist()],
+            self.column("method_offset").tolist(),
+            self._strings("method_name"),
+            strict=True,
+        ))
+        return {
+            category: [records[i] for i in self.column(f"offsets_{category}").tolist()]
+            for category in self.manifest["offsets_categories"]
+        }
+
+    def to_tuple(self):
+        """(profile_info, offsets_info, trace_info, traced_activities, hit_uprobes) like result.pickle had"""
+        return self.profile_info(), self.offsets_info(), self.trace_info(), self.traced_activities, self.hit_records()
+
+
+def read_result(path, mmap=True):
+    """a Result from a result directory, or the apkid directory that has one"""
+    path = Path(path)
+    if not (path / MANIFEST_NAME).exists() and (path / RESULT_DIRNAME / MANIFEST_NAME).exists():
+        path = path / RESULT_DIRNAME
+    return Result(path, mmap=mmap)
+
+
+def convert_pickle(pickle_path, out_path=None):
+    """write a result directory for a result.pickle, next to it unless out_path is given"""
+    pickle_path = Path(pickle_path)
+    if out_path is None:
+        out_path = pickle_path.parent / RESULT_DIRNAME
+    with open(pickle_path, "rb") as f:
+        results = pickle.load(f)
+    write_result(out_path, *results)
+    return out_path
+
+
+@click.command()
+@click.option("--verbose", default=False, is_flag=True)
+@click.option("--remove-pickle", default=False, is_flag=True, help="delete each result.pickle after converting it")
+@click.argument("paths", nargs=-1, type=click.Path(exists=True, path_type=Path))
+def main(verbose, remove_pickle, paths):
+    """convert result.pickle files to result directories. directories are searched for result.pickle files."""
+    if verbose:
+        pkglog.setLevel(logging.DEBUG)
+    for path in paths:
+        pickles = sorted(path.rglob(PICKLE_NAME)) if path.is_dir() else [path]
+        for pickle_path in pickles:
+            out_path = convert_pickle(pickle_path)
+            log.info(f"converted {pickle_path} to {out_path}")
+            if remove_pickle:
+                pickle_path.unlink()
+
+
+if __name__ == "__main__":
+    main()
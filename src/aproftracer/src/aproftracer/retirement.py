@@ -0,0 +1,86 @@
+"""
+host driven probe retirement: probes that fired once are switched off while the tool still runs.
+
+coverage only needs the first hit of a probe, but a registered uprobe traps on every call for the
+whole run. that slows the app down (so the tool gets fewer events in) and floods the ring buffer.
+with the stream capture the host sees the hits within about a second, so a thread takes the probes
+hit for the first time from the stream every interval and disables their events on the device, in
+batches of one adb call each (see uprobes.disable_events_script). once most probes of an app fired,
+hardly any trap is left and the overhead of the rest of the run goes towards zero.
+
+a probe can still log a few more hits between its first hit and its retirement, they are in the
+trace like any other hit. when every probe was retired is kept as the timeline, in seconds since
+the retirer started, and goes into the result as probe_retired (see resultdir.py).
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_INTERVAL = 1.0
+_BATCH_SIZE = 500
+
+
+class ProbeRetirer:
+    """
+    take_new() returns the offsets (ints) of probes hit for the first time since the last call,
+    retire(offsets) switches off the probes at offsets (hex strings). only offsets in probes are retired.
+    """
+
+    def __init__(self, take_new, retire, probes, interval=_INTERVAL, batch_size=_BATCH_SIZE):
+        self.take_new = take_new
+        self.retire = retire
+        self.probes = set(probes)
+        self.interval = interval
+        self.batch_size = batch_size
+        # offset -> seconds since start
+        self.retired = {}
+        self.failed_batches = 0
+        # hit but not retired yet, because their batch failed
+        self._pending = []
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def start(self):
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.retire_new()
+
+    def retire_new(self):
+        """retire what was hit since the last call, returns how many probes were retired"""
+        new = [hex(offset) for offset in self.take_new()]
+        new = [offset for offset in new if offset in self.probes and offset not in self.retired]
+        todo, self._pending = self._pending + new, []
+        done = 0
+        for i in range(0, len(todo), self.batch_size):
+            batch = todo[i:i + self.batch_size]
+            try:
+                self.retire(batch)
+            except Exception as e:
+                # the probes just keep trapping until the next try, nothing is lost
+                self.failed_batches += 1
+                self._pending += batch
+                log.warning(f"retiring {len(batch)} probes failed: {e}")
+                continue
+            now = time.monotonic() - self._start
+            for offset in batch:
+                self.retired[offset] = now
+            done += len(batch)
+        if done:
+            log.debug(f"retired {done} probes, {len(self.retired)}/{len(self.probes)} in total")
+        return done
+
+    def stop(self):
+        """stop retiring, returns the timeline {offset: seconds since start}"""
+        self._stopping.set()
+        self._thread.join()
+        log.info(f"retired {len(self.retired)}/{len(self.probes)} probes during the run")
+        if self.failed_batches:
+            log.warning(f"{self.failed_batches} retirement batches failed")
+        return self.retired
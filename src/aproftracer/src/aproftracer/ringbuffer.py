@@ -0,0 +1,199 @@
+"""
+decoder for binary ftrace captures, the pages read from per_cpu/cpuN/trace_pipe_raw.
+
+the text trace_pipe is one reader for all cpus and the kernel formats every event. reading the ring buffer
+pages of every cpu as they are is cheaper on the device and a lot smaller, the events are decoded here into
+the same RawTrace the text parser makes (see rawtrace.py).
+
+a capture directory has, next to one raw_cpuN.bin per cpu:
+- header_page: events/header_page, where timestamp, commit and data are in a page
+- format: the format of one of the uprobe events, where the common fields are in an event
+- event_ids.txt: "<event name> <id>" of every uprobe event, the id is common_type of its events
+- saved_cmdlines: pid to process name, what the text output uses for the names
+
+a page is the header (timestamp of the page, commit: bytes of data plus flags for missed events) and the
+events. an event is a u32 header with type_len in the low 5 bits and a time delta in the other 27, then
+its data: type_len * 4 bytes for type_len 1-28, or the length in the next u32 for type_len 0. 29 is
+padding (the rest of the page if its delta is 0), 30 extends the time delta, 31 is an absolute timestamp.
+see kernel/trace/ring_buffer.c.
+"""
+import logging
+import re
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from aproftracer import compression
+from aproftracer.rawtrace import RawTrace
+
+log = logging.getLogger(__name__)
+
+_TYPE_PADDING = 29
+_TYPE_TIME_EXTEND = 30
+_TYPE_TIME_STAMP = 31
+_MISSED_EVENTS = 1 << 31
+_MISSED_STORED = 1 << 30
+_COMMIT_MASK = _MISSED_STORED - 1
+
+_RE_FIELD = re.compile(r"field:\s*(?P<decl>[^;]*);\s*offset:\s*(?P<offset>\d+);\s*size:\s*(?P<size>\d+);")
+
+HEADER_PAGE_FNAME = "header_page"
+FORMAT_FNAME = "format"
+EVENT_IDS_FNAME = "event_ids.txt"
+SAVED_CMDLINES_FNAME = "saved_cmdlines"
+CPU_GLOB = "raw_cpu*.bin"
+
+
+def parse_fields(text):
+    """{field name: (offset, size)} of a format or header_page file"""
+    fields = {}
+    for m in _RE_FIELD.finditer(text):
+        name = m.group("decl").split()[-1].split("[")[0]
+        # header_page has overwrite at the same offset as commit, the first one wins
+        fields.setdefault(name, (int(m.group("offset")), int(m.group("size"))))
+    return fields
+
+
+class PageLayout:
+    def __init__(self, header_page, event_format):
+        page = parse_fields(header_page)
+        self.timestamp_offset, _ = page["timestamp"]
+        self.commit_offset, self.commit_size = page["commit"]
+        self.data_offset, data_size = page["data"]
+        self.page_size = self.data_offset + data_size
+        event = parse_fields(event_format)
+        self.type_offset, _ = event["common_type"]
+        self.pid_offset, _ = event["common_pid"]
+        self._commit_fmt = "<Q" if self.commit_size == 8 else "<I"
+
+
+def read_event_ids(path):
+    """{event id: probe offset} from the event_ids.txt of a capture"""
+    ids = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 2 or not parts[0].startswith("event0x"):
+                continue
+            ids[int(parts[1])] = int(parts[0][len("event"):], 16)
+    return ids
+
+
+def read_saved_cmdlines(path):
+    comms = {}
+    with open(path, errors="replace") as f:
+        for line in f:
+            pid, _, comm = line.rstrip("\n").partition(" ")
+            if pid.isdigit():
+                comms[int(pid)] = comm
+    return comms
+
+
+def decode_pages(data, layout):
+    """
+    (timestamps in ns, event types, pids, lost events) of the pages of one cpu.
+    lost events only counts what the kernel stored, pages that just say events are missing are logged.
+    """
+    timestamps, types, pids = [], [], []
+    lost = 0
+    unknown_lost = 0
+    buf = memoryview(data)
+    unpack_u32 = struct.Struct("<I").unpack_from
+    unpack_u64 = struct.Struct("<Q").unpack_from
+    unpack_commit = struct.Struct(layout._commit_fmt).unpack_from
+    unpack_u16 = struct.Struct("<H").unpack_from
+    unpack_i32 = struct.Struct("<i").unpack_from
+    type_offset, pid_offset = layout.type_offset, layout.pid_offset
+
+    # only whole pages, the last one can still be being written when the files are pulled
+    for page in range(0, len(data) - layout.page_size + 1, layout.page_size):
+        (ts,) = unpack_u64(buf, page + layout.timestamp_offset)
+        (commit,) = unpack_commit(buf, page + layout.commit_offset)
+        size = commit & _COMMIT_MASK
+        start = page + layout.data_offset
+        end = min(start + size, page + layout.page_size)
+        if commit & _MISSED_EVENTS:
+            if commit & _MISSED_STORED and end + layout.commit_size <= len(data):
+                lost += unpack_commit(buf, end)[0]
+            else:
+                unknown_lost += 1
+
+        pos = start
+        while pos < end:
+            (header,) = unpack_u32(buf, pos)
+            type_len = header & 0x1f
+            delta = header >> 5
+            if type_len == 0:
+                (length,) = unpack_u32(buf, pos + 4)
+                ts += delta
+                event = pos + 8
+                next_pos = pos + 4 + length
+            elif type_len <= 28:
+                ts += delta
+                event = pos + 4
+                next_pos = event + 4 * type_len
+            elif type_len == _TYPE_PADDING:
+                if delta == 0:
+                    break
+                next_pos = pos + 4 + unpack_u32(buf, pos + 4)[0]
+                event = None
+            elif type_len == _TYPE_TIME_EXTEND:
+                ts += (unpack_u32(buf, pos + 4)[0] << 27) | delta
+                next_pos = pos + 8
+                event = None
+            else:
+                ts = (unpack_u32(buf, pos + 4)[0] << 27) | delta
+                next_pos = pos + 8
+                event = None
+            if event is not None:
+                timestamps.append(ts)
+                types.append(unpack_u16(buf, event + type_offset)[0])
+                pids.append(unpack_i32(buf, event + pid_offset)[0])
+            pos = next_pos
+
+    if unknown_lost:
+        log.warning(f"{unknown_lost} pages had lost events without a count")
+    return (
+        np.array(timestamps, dtype=np.uint64),
+        np.array(types, dtype=np.uint16),
+        np.array(pids, dtype=np.int32),
+        lost,
+    )
+
+
+def read_capture(capture_dir):
+    """RawTrace of a capture directory, the hits of all cpus merged in time order like trace_pipe does"""
+    capture_dir = Path(capture_dir)
+    layout = PageLayout((capture_dir / HEADER_PAGE_FNAME).read_text(), (capture_dir / FORMAT_FNAME).read_text())
+    event_ids = read_event_ids(capture_dir / EVENT_IDS_FNAME)
+    saved_cmdlines = read_saved_cmdlines(capture_dir / SAVED_CMDLINES_FNAME)
+
+    parts = []
+    lost_events = 0
+    for path in sorted(capture_dir.glob(CPU_GLOB)):
+        with compression.open_stream(path) as f:
+            timestamps, types, pids, lost = decode_pages(f.read(), layout)
+        parts.append((timestamps, types, pids))
+        lost_events += lost
+        log.debug(f"decoded {len(timestamps)} events from {path.name}")
+    if not parts:
+        return RawTrace(np.zeros(0), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint32), [], lost_events)
+
+    timestamps, types, pids = (np.concatenate(p) for p in zip(*parts, strict=True))
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, types, pids = timestamps[order], types[order], pids[order]
+
+    # only our uprobe events, the ring buffer has whatever else was enabled. common_type is a u16
+    offset_of_type = np.full(1 << 16, -1, dtype=np.int64)
+    for event_id, offset in event_ids.items():
+        offset_of_type[event_id] = offset
+    offsets = offset_of_type[types]
+    known = offsets >= 0
+    timestamps, pids, offsets = timestamps[known], pids[known], offsets[known]
+
+    # process names like the text output has them
+    unique_pids, comm = np.unique(pids, return_inverse=True)
+    comms = [f"{saved_cmdlines.get(pid, '<...>')}-{pid}" for pid in unique_pids.tolist()]
+
+    return RawTrace(timestamps / 1e9, offsets.astype(np.uint64), comm.astype(np.uint32), comms, lost_events)
@@ -0,0 +1,91 @@
+"""
+soft reset of a device between two apps, instead of a reboot after every one.
+
+a run leaves the tracefs set up for its app: tracing off but the uprobes of TRACE_GROUP_NAME registered
+(the next tracepoints.sh could not register its own next to them), triggers on them, hits in the ring
+buffer and maybe readers of trace_pipe still running. a reboot throws all of that away, but costs a
+minute or two per app. the reset script undoes it directly: tracing off, the readers and the app
+killed, events disabled, triggers removed (an event with triggers can't be removed), uprobe_events and
+the ring buffer emptied. afterwards the state script reads back what a reboot would guarantee, and
+anything that is not clean (see dirty) means a reboot after all.
+
+the scripts run as root in one adb call each. they go through `su -c '...'`, so they contain no
+single quotes, and pkill/pgrep patterns are written such that they don't match the shell running
+the script itself (whose command line contains the pattern).
+
+the device keeps a count of the apps since its last boot (keyed by the boot id, so any reboot starts
+it again, see count_app_script), so a reboot every n apps also works when every app is its own
+aproftracer process.
+"""
+TRACING_DIR = "/sys/kernel/tracing"
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+
+# everything the state script reports has to be 0 after a reset
+STATE_KEYS = ["tracing_on", "uprobes", "group", "trace_entries", "processes", "app"]
+
+
+def _self_safe_pattern(name):
+    """pkill -f pattern for name that does not match a command line containing the pattern itself"""
+    return f"[{name[0]}]{name[1:].replace('.', '[.]')}"
+
+
+def reset_script(group, apkid, process_names, tracing_dir=TRACING_DIR):
+    """shell lines that reset the tracefs and kill apkid and the device processes in process_names"""
+    patterns = "|".join(_self_safe_pattern(name) for name in process_names)
+    return (
+        f"T={tracing_dir}\n"
+        f"echo 0 > $T/tracing_on\n"
+        f"am force-stop {apkid}\n"
+        f"pkill -9 -f \"{patterns}\"\n"
+        f"echo 0 > $T/events/enable\n"
+        f"for e in $T/events/{group}/event*; do\n"
+        f"  [ -e $e/trigger ] && echo \"!disable_event:{group}:${{e##*/}}\" > $e/trigger 2> /dev/null\n"
+        f"done\n"
+        f"echo > $T/uprobe_events\n"
+        f"echo > $T/trace\n"
+        f"true\n"
+    )
+
+
+def state_script(group, apkid, process_names, tracing_dir=TRACING_DIR):
+    """shell lines that print key=count for each of STATE_KEYS"""
+    patterns = "|".join(_self_safe_pattern(name) for name in process_names)
+    return (
+        f"T={tracing_dir}\n"
+        f"echo tracing_on=$(cat $T/tracing_on)\n"
+        f"echo uprobes=$(grep -c . $T/uprobe_events)\n"
+        f"echo group=$(ls -d $T/events/{group} 2> /dev/null | wc -l)\n"
+        f"echo trace_entries=$(grep -c \"^[^#]\" $T/trace)\n"
+        f"echo processes=$(pgrep -f \"{patterns}\" | wc -l)\n"
+        f"echo app=$(pidof {apkid} | wc -w)\n"
+    )
+
+
+def parse_state(output):
+    """{key: count} from the output of state_script"""
+    state = {}
+    for line in output.splitlines():
+        key, sep, value = line.strip().partition("=")
+        if sep and key in STATE_KEYS:
+            try:
+                state[key] = int(value)
+            except ValueError:
+                continue
+    return state
+
+
+def dirty(state):
+    """what is not clean in a parsed state, empty if the device is as good as rebooted"""
+    return [f"{key}={state[key]}" if key in state else f"{key} unknown" for key in STATE_KEYS if state.get(key) != 0]
+
+
+def count_app_script(counter_path, boot_id=BOOT_ID):
+    """shell lines that count one more app since the last boot in counter_path and print the count"""
+    return (
+        f"b=$(cat {boot_id}); n=0\n"
+        f"set -- $(cat {counter_path} 2> /dev/null)\n"
+        f"[ \"$1\" = \"$b\" ] && n=$2\n"
+        f"n=$((n+1))\n"
+        f"echo \"$b $n\" > {counter_path}\n"
+        f"echo $n\n"
+    )
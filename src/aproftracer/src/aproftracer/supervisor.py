@@ -0,0 +1,197 @@
+"""
+event driven supervision of the processes that talk to the device: the tracer, the tools, reboots.
+
+these used to be `sh` background commands whose output callbacks (one thread per pipe) set a flag
+that a `while not flag: time.sleep(1)` loop polled, up to a second late at every step, and every step
+of a run waited on the one before. here the processes run on one asyncio loop, their stdout is read
+line by line as it comes and what the Tracer waits for is an awaitable:
+
+  proc.expect(predicate)  the first line from now on that matches, None if the process exits first
+  proc.run_for(seconds)   the tool ran for seconds (False) or exited / printed a stop line before (True)
+  boot_completed(serial)  the device went away and is booted again, sys.boot_completed is 1
+
+everything wakes up the moment the line or the exit arrives. the loop of shared() runs on one thread
+for every process of every Tracer in the host process, so a fleet or pipeline driving many devices
+needs no thread per pipe, and code that is async already can use Proc and boot_completed on its own
+loop, e.g. asyncio.gather(*(boot_completed(serial) for serial in devices)).
+
+the Tracer is synchronous, it hands coroutines to the loop with Supervisor.run. line callbacks run on
+the loop thread, so they must not block (no adb calls), they only log and record.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+import threading
+
+log = logging.getLogger(__name__)
+
+# runs on the device, returns once the boot is done
+_BOOT_WAIT_SCRIPT = "while [ \"$(getprop sys.boot_completed)\" != 1 ]; do sleep 0.2; done"
+
+
+class Proc:
+    """argv on the loop, on_line(line) gets every line of stdout and stderr (with its newline)"""
+
+    def __init__(self, argv, on_line=None):
+        self.argv = [str(a) for a in argv]
+        self.on_line = on_line
+        self.returncode = None
+        self._proc = None
+        self._reader = None
+        # (predicate, future) of expect, resolved by the reader
+        self._waiters = []
+
+    async def start(self):
+        log.debug(f"starting {' '.join(self.argv)}")
+        # own session, kill takes children like the adb server connection or droidbot's adb along
+        self._proc = await asyncio.create_subprocess_exec(
+                *self.argv,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True,
+            )
+        self._reader = asyncio.ensure_future(self._read())
+        return self
+
+    async def _read(self):
+        while True:
+            raw = await self._proc.stdout.readline()
+            if not raw:
+                break
+            self._dispatch(raw.decode(errors="replace"))
+        self.returncode = await self._proc.wait()
+        log.debug(f"{self.argv[0]} exited with {self.returncode}")
+        for _, future in self._waiters:
+            if not future.done():
+                future.set_result(None)
+        self._waiters = []
+
+    def _dispatch(self, line):
+        if self.on_line is not None:
+            try:
+                self.on_line(line)
+            except Exception as e:
+                # a broken callback must not stop the reader, the waiters still need their lines
+                log.error(f"line callback of {self.argv[0]} failed: {e}")
+        for predicate, future in self._waiters:
+            if not future.done() and predicate(line):
+                future.set_result(line)
+        self._waiters = [(p, f) for p, f in self._waiters if not f.done()]
+
+    @property
+    def exited(self):
+        return self.returncode is not None
+
+    def expect(self, predicate):
+        """future of the first line from now on that matches predicate, None if the process exits first. call on the loop"""
+        future = asyncio.get_running_loop().create_future()
+        if self.exited:
+            future.set_result(None)
+        else:
+            self._waiters.append((predicate, future))
+        return future
+
+    async def line(self, predicate, timeout=None):
+        """the first line that matches predicate, None if the process exits first. asyncio.TimeoutError after timeout"""
+        return await asyncio.wait_for(self.expect(predicate), timeout)
+
+    async def wait(self, timeout=None):
+        """exit code. asyncio.TimeoutError after timeout, the process keeps running"""
+        await asyncio.wait_for(asyncio.shield(self._reader), timeout)
+        return self.returncode
+
+    async def run_for(self, seconds, stop=None):
+        """let the process run for seconds, True if it exited or printed a line matching stop before"""
+        ended = self.expect(stop if stop is not None else lambda line: False)
+        try:
+            await asyncio.wait_for(ended, seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def kill(self):
+        """SIGKILL the process and everything it started, returns the exit code"""
+        if not self.exited:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(self._proc.pid, signal.SIGKILL)
+        return await self.wait()
+
+
+async def boot_completed(serial, timeout=None):
+    """
+    wait until the device, which was just told to reboot, went away and is booted again.
+    asyncio.TimeoutError after timeout seconds
+    """
+    async def wait():
+        # the device is still listed for a moment after reboot, its old sys.boot_completed is 1 too
+        await _run(["adb", "-s", serial, "wait-for-disconnect"])
+        return await _run(["adb", "-s", serial, "wait-for-device", "shell", _BOOT_WAIT_SCRIPT])
+    return await asyncio.wait_for(wait(), timeout)
+
+
+async def _run(argv):
+    proc = await Proc(argv, on_line=lambda line: log.debug(line.rstrip())).start()
+    try:
+        returncode = await proc.wait()
+    except asyncio.CancelledError:
+        await proc.kill()
+        raise
+    if returncode != 0:
+        raise RuntimeError(f"{' '.join(argv)} failed with {returncode}")
+    return returncode
+
+
+class Supervisor:
+    """an asyncio loop on its own thread, for synchronous code"""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="supervisor", daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def run(self, coro, timeout=None):
+        """run coro on the loop and return its result, blocks the calling thread"""
+        loop = self._ensure_started()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("Supervisor.run called from a line callback, it would wait on itself")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def call(self, fn, *args):
+        """fn(*args) on the loop thread, for Proc.expect"""
+        async def call():
+            return fn(*args)
+        return self.run(call())
+
+    def spawn(self, argv, on_line=None):
+        """start a Proc, returns it once it runs"""
+        return self.run(Proc(argv, on_line).start())
+
+    def stop(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+
+_shared = Supervisor()
+
+
+def shared():
+    """the Supervisor of this host process"""
+    return _shared
@@ -0,0 +1,156 @@
+"""
+streams the trace from the device while the tool runs, instead of one pull of raw_output.txt at the end.
+
+the trace reader on the device writes trace_pipe to stdout of an `adb exec-out`, a thread on the host
+reads it in chunks, appends whole lines to the checkpoint file (fsynced every few seconds, so a crash
+only loses what came after) and parses them right away with rawtrace.RawTraceParser. at the end only
+the rest of the pipe is drained and the parser result is taken, nothing is pulled or parsed anymore.
+the checkpoint has the same format as raw_output.txt, rawtrace.read_raw_trace reads it after a crash.
+probes that were hit for the first time are collected on the way, take_new_probes hands them out while
+the trace still runs (see retirement.py).
+
+trace_pipe consumes what it reads, so if adb drops out in between the reader is just started again
+and carries on where it stopped.
+"""
+import contextlib
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+from aproftracer.rawtrace import RawTraceParser
+
+log = logging.getLogger(__name__)
+
+_READ_SIZE = 64 * 1024
+# lines are parsed in batches of about this size, or after _PARSE_INTERVAL
+_PARSE_SIZE = 4 * 1024 * 1024
+_PARSE_INTERVAL = 1.0
+_CHECKPOINT_INTERVAL = 5.0
+_MAX_RESTARTS = 5
+
+
+class TraceStream:
+    """argv starts the reader, e.g. ["adb", "-s", serial, "exec-out", "cat /sys/kernel/tracing/trace_pipe"]"""
+
+    def __init__(self, argv, checkpoint_path, max_restarts=_MAX_RESTARTS, checkpoint_interval=_CHECKPOINT_INTERVAL):
+        self.argv = list(argv)
+        self.checkpoint_path = checkpoint_path
+        self.max_restarts = max_restarts
+        self.checkpoint_interval = checkpoint_interval
+        self.parser = RawTraceParser()
+        self.bytes_read = 0
+        self._restarts = 0
+        self._last_read = time.monotonic()
+        self._stopping = threading.Event()
+        # replacing the reader and killing it in stop
+        self._lock = threading.Lock()
+        self._proc = None
+        self._thread = None
+        self._checkpoint = None
+        # offsets hit so far, and the ones take_new_probes did not hand out yet
+        self._probes_lock = threading.Lock()
+        self._seen_probes = set()
+        self._new_probes = []
+
+    def start(self):
+        # open for the whole run, closed in stop
+        self._checkpoint = open(self.checkpoint_path, "wb")  # noqa: SIM115
+        self._proc = self._start_reader()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _start_reader(self):
+        log.debug(f"starting trace stream {' '.join(self.argv)}")
+        return subprocess.Popen(self.argv, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, start_new_session=True)
+
+    def _run(self):
+        pending = bytearray()
+        last_parse = last_checkpoint = time.monotonic()
+        while True:
+            chunk = self._proc.stdout.read1(_READ_SIZE)
+            now = time.monotonic()
+            if chunk:
+                self._last_read = now
+                self.bytes_read += len(chunk)
+                pending += chunk
+            elif self._stopping.is_set() or not self._restart():
+                break
+            if len(pending) >= _PARSE_SIZE or now - last_parse >= _PARSE_INTERVAL:
+                cut = pending.rfind(b"\n") + 1
+                if cut:
+                    self._ingest(bytes(pending[:cut]))
+                    del pending[:cut]
+                last_parse = now
+            if now - last_checkpoint >= self.checkpoint_interval:
+                self._sync()
+                last_checkpoint = now
+        # a last line without newline is still a line, like at the end of raw_output.txt
+        self._ingest(bytes(pending))
+        self._sync()
+
+    def _restart(self):
+        self._proc.wait()
+        if self._restarts >= self.max_restarts:
+            log.warning(f"trace stream ended with {self._proc.returncode}, not restarting it")
+            return False
+        self._restarts += 1
+        log.warning(f"trace stream ended with {self._proc.returncode}, restarting it ({self._restarts}/{self.max_restarts})")
+        if self._stopping.wait(1):
+            return False
+        with self._lock:
+            if self._stopping.is_set():
+                return False
+            self._proc.stdout.close()
+            self._proc = self._start_reader()
+        return True
+
+    def _ingest(self, lines):
+        if not lines:
+            return
+        self._checkpoint.write(lines)
+        self.parser.feed(lines, 0, len(lines))
+        offsets = np.unique(self.parser.new_offsets()).tolist()
+        with self._probes_lock:
+            for offset in offsets:
+                if offset not in self._seen_probes:
+                    self._seen_probes.add(offset)
+                    self._new_probes.append(offset)
+
+    def take_new_probes(self):
+        """offsets (ints) of the probes hit for the first time since the last call"""
+        with self._probes_lock:
+            new, self._new_probes = self._new_probes, []
+        return new
+
+    def _sync(self):
+        self._checkpoint.flush()
+        os.fsync(self._checkpoint.fileno())
+        log.debug(f"trace stream checkpoint at {self.bytes_read} bytes")
+
+    def _kill(self):
+        if self._proc.poll() is None:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(os.getpgid(self._proc.pid), signal.SIGTERM)
+            self._proc.wait()
+
+    def stop(self, idle=1.0, timeout=30):
+        """
+        drain the pipe until nothing came for idle seconds (or timeout), then stop the reader.
+        returns the rawtrace.RawTrace of everything streamed.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() - self._last_read < idle and time.monotonic() < deadline and self._thread.is_alive():
+            time.sleep(0.1)
+        self._stopping.set()
+        with self._lock:
+            self._kill()
+        self._thread.join()
+        self._proc.stdout.close()
+        self._checkpoint.close()
+        log.info(f"streamed {self.bytes_read} bytes of trace")
+        return self.parser.result()
@@ -0,0 +1,107 @@
+"""
+bulk registration of uprobes through tracefs, and the tracefs side of the aggregate capture.
+
+one `echo 'p:...' >> uprobe_events` per probe is an open, a write and a close of uprobe_events plus a line
+of shell for every probe, minutes for 30k probes. the kernel takes any number of newline separated probe
+definitions per write (trace_parse_run_command), as long as no definition is split between two writes,
+and it skips empty lines. so all definitions go into one file, padded with empty lines such that every
+block of _BLOCK_SIZE bytes ends on a line boundary, and dd appends it to uprobe_events one block per
+write (never with of=, opening uprobe_events with O_TRUNC removes all probes). if a block fails (one bad
+definition stops the rest of its write), its lines are registered one by one instead, like before.
+
+the aggregate capture keeps the counting in the kernel: every event logs only its first hit (see
+first_hit_triggers_script) and the hit counts come from uprobe_profile at the end. hist triggers
+would count per process too, but every one preallocates at least 128 map entries, for 30k events
+that is around a GB of kernel memory.
+"""
+
+_BLOCK_SIZE = 64 * 1024
+# the kernel reads at most WRITE_BUFSIZE - 2 (4094) bytes per definition
+_MAX_LINE = 4094
+
+UPROBE_EVENTS = "/sys/kernel/tracing/uprobe_events"
+UPROBE_PROFILE = "/sys/kernel/tracing/uprobe_profile"
+
+
+def probe_definition(group, offset, path):
+    """definition of a uprobe named event<offset> in group, offset is the hex string"""
+    return f"p:{group}/event{offset} {path}:{offset}"
+
+
+def pack_definitions(definitions, block_size=_BLOCK_SIZE):
+    """the definitions file, every block_size bytes end with a newline"""
+    out = bytearray()
+    used = 0
+    for definition in definitions:
+        line = definition.encode() + b"\n"
+        if len(line) > _MAX_LINE:
+            raise NotImplementedError(f"uprobe definition longer than the kernel takes: {definition}")
+        if used + len(line) > block_size:
+            out += b"\n" * (block_size - used)
+            used = 0
+        out += line
+        used += len(line)
+    return bytes(out)
+
+
+def num_blocks(size, block_size=_BLOCK_SIZE):
+    return -(-size // block_size)
+
+
+def register_script(definitions_path, blocks, block_size=_BLOCK_SIZE, events_path=UPROBE_EVENTS, log_prefix=""):
+    """shell lines that register the probes of a definitions file made by pack_definitions"""
+    return (
+        f"i=0\n"
+        f"while [ $i -lt {blocks} ]; do\n"
+        f"  if ! dd if={definitions_path} bs={block_size} skip=$i count=1 2> /dev/null >> {events_path}; then\n"
+        f"    echo '{log_prefix}block '$i' failed, registering its probes one by one'\n"
+        f"    dd if={definitions_path} bs={block_size} skip=$i count=1 2> /dev/null | while read -r line; do\n"
+        f"      [ -n \"$line\" ] && echo \"$line\" >> {events_path} 2> /dev/null\n"
+        f"    done\n"
+        f"  fi\n"
+        f"  i=$((i+1))\n"
+        f"  echo '{log_prefix}registered block '$i'/{blocks}'\n"
+        f"done\n"
+    )
+
+
+def first_hit_triggers_script(group, events_dir="/sys/kernel/tracing/events", log_prefix=""):
+    """
+    shell lines that make every event of group disable itself after it was recorded once, for the
+    aggregate capture. a trigger with a filter runs after the event is written to the ring buffer
+    (without one it runs before and the first hit is dropped too), and a soft disabled uprobe still
+    counts its hits in uprobe_profile. hits on several cpus at once can still log a probe twice.
+    """
+    return (
+        f"for e in {events_dir}/{group}/event*; do\n"
+        f"  echo \"disable_event:{group}:${{e##*/}} if common_pid >= 0\" > $e/trigger\n"
+        f"done\n"
+        f"echo '{log_prefix}'$(ls -d {events_dir}/{group}/event* | wc -l)' first hit triggers set up'\n"
+    )
+
+
+def disable_events_script(group, offsets, events_dir="/sys/kernel/tracing/events"):
+    """
+    one shell line that disables the events of the probes at offsets (hex strings), for probe retirement.
+    a disabled uprobe event unregisters its uprobe, so its breakpoint is gone. the definitions stay in
+    uprobe_events: removing an event that was enabled resets the ring buffer, hits not read yet would be lost.
+    """
+    names = " ".join(f"event{offset}" for offset in offsets)
+    return f"cd {events_dir}/{group} && for e in {names}; do echo 0 > $e/enable; done"
+
+
+def read_uprobe_profile(path, probe_path=None):
+    """
+    {probe offset: hits} from a dump of uprobe_profile, the kernel counts every hit of every probe.
+    only event0x<offset> probes, and only the ones on probe_path if it is given.
+    """
+    hits = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 3 or not parts[1].startswith("event0x"):
+                continue
+            if probe_path is not None and parts[0] != str(probe_path):
+                continue
+            hits[int(parts[1][len("event"):], 16)] = int(parts[2])
+    return hits
@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import pickle
+
+from aproftracer.bitmapset import EMPTY, BitmapSet, union
+
+
+def test_set_interface():
+    s = BitmapSet.from_indices([3, 0, 17, 3])
+    assert list(s) == [0, 3, 17]
+    assert len(s) == 3
+    assert 17 in s and 0 in s
+    assert 4 not in s and 1000 not in s and -1 not in s and "3" not in s
+    assert s == {0, 3, 17} and {0, 3, 17} == s
+    assert s != {0, 3}
+    assert s <= {0, 3, 17, 20}
+    assert not EMPTY and len(EMPTY) == 0 and list(EMPTY) == []
+    assert pickle.loads(pickle.dumps(s)) == s
+
+
+def test_operators():
+    a = BitmapSet.from_indices([1, 2, 64])
+    b = BitmapSet.from_indices([2, 3])
+    assert isinstance(a | b, BitmapSet) and a | b == {1, 2, 3, 64}
+    assert isinstance(a & b, BitmapSet) and a & b == {2}
+    assert a | {5} == {1, 2, 5, 64}
+    assert {5} | a == {1, 2, 5, 64}
+    assert union(a, {9}, ()) == {1, 2, 9, 64}
+
+
+def test_from_bitmap():
+    # two regions of 10 bits each, like the startup and post startup bitmap of a profile
+    bitmap = ((1 << 1) | (1 << 9) | (1 << 10) | (1 << 15)).to_bytes(3, "little")
+    assert BitmapSet.from_bitmap(bitmap, 0, 10) == {1, 9}
+    assert BitmapSet.from_bitmap(bitmap, 10, 10) == {0, 5}
@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import numpy as np
+import pytest
+
+from aproftracer import bpfmap
+
+TRACE_INFO = [("0x1000", True), ("0x2000", False), ("0x3000", True), ("0x4000", True)]
+
+
+def write_dump(path, rows):
+    values = np.zeros(len(TRACE_INFO), dtype=bpfmap.MAP_VALUE_DTYPE)
+    for i, (first_ns, hits, pid, comm) in rows.items():
+        values[i] = (first_ns, hits, pid, comm, 0)
+    values.tofile(path)
+
+
+def test_map_value_size():
+    assert bpfmap.MAP_VALUE_DTYPE.itemsize == 40
+
+
+def test_read_map_dump(tmp_path):
+    dump = tmp_path / "map.bin"
+    write_dump(dump, {
+        0: (5_500_000_000, 3, 42, b"main"),
+        2: (5_000_000_000, 1, 43, b"RenderThread"),
+        3: (6_000_000_000, 7, 42, b"main"),
+    })
+    hits, probe_hitcount = bpfmap.read_map_dump(dump, TRACE_INFO)
+
+    assert probe_hitcount == [3, 0, 1, 7]
+    assert hits.probes == ["0x1000", "0x2000", "0x3000", "0x4000"]
+    # first hits in the order they happened
+    assert hits.hits['probe'].tolist() == [2, 0, 3]
+    assert hits.hits['time'].tolist() == pytest.approx([0.0, 0.5, 1.0])
+    assert [hits.comms[c] for c in hits.hits['comm']] == ["RenderThread-43", "main-42", "main-42"]
+
+
+def test_read_map_dump_nothing_hit(tmp_path):
+    dump = tmp_path / "map.bin"
+    write_dump(dump, {})
+    hits, probe_hitcount = bpfmap.read_map_dump(dump, TRACE_INFO)
+    assert len(hits.hits) == 0
+    assert probe_hitcount == [0, 0, 0, 0]
+
+
+def test_read_map_dump_mismatch(tmp_path):
+    dump = tmp_path / "map.bin"
+    write_dump(dump, {})
+    with pytest.raises(RuntimeError):
+        bpfmap.read_map_dump(dump, TRACE_INFO[:2])
+
+
+def test_write_offsets(tmp_path):
+    path = tmp_path / "offsets.txt"
+    bpfmap.write_offsets(path, TRACE_INFO)
+    assert path.read_text().splitlines() == ["0x1000", "0x2000", "0x3000", "0x4000"]
@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+from aproftracer import devicecache
+
+FINGERPRINT = "google/sdk_gphone64_x86_64/emu64xa:14/UE1A.230829.036.A1/11228894:userdebug/dev-keys"
+APK = "/data/app/~~abc==/org.example-xyz==/base.apk"
+
+
+def test_build(tmp_path):
+    cache = devicecache.DeviceCache(tmp_path)
+    assert cache.get_build(FINGERPRINT) is None
+    cache.put_build(FINGERPRINT, {"kernel_ok": True, "sdk": "34"})
+    assert cache.get_build(FINGERPRINT) == {"kernel_ok": True, "sdk": "34"}
+    assert cache.get_build(FINGERPRINT.replace("14", "15")) is None
+    # another process, same directory
+    assert devicecache.DeviceCache(tmp_path).get_build(FINGERPRINT)["kernel_ok"]
+
+
+def test_install(tmp_path):
+    cache = devicecache.DeviceCache(tmp_path)
+    facts = {"odex_path": APK.replace("base.apk", "oat/x86_64/base.odex"), "oatdata_offset": 0x1000}
+    cache.put_install(FINGERPRINT, "org.example", APK, "1700000000", facts)
+    assert cache.get_install(FINGERPRINT, "org.example", APK, "1700000000") == facts
+    # reinstalled, or another build
+    assert cache.get_install(FINGERPRINT, "org.example", APK, "1700000001") is None
+    assert cache.get_install(FINGERPRINT, "org.example", APK.replace("abc", "def"), "1700000000") is None
+    assert cache.get_install("other", "org.example", APK, "1700000000") is None
+
+
+def test_broken_entry(tmp_path):
+    cache = devicecache.DeviceCache(tmp_path)
+    cache.put_build(FINGERPRINT, {"kernel_ok": True})
+    path = tmp_path / "build" / f"{devicecache.build_key(FINGERPRINT)}.json"
+    path.write_text("{")
+    assert cache.get_build(FINGERPRINT) is None
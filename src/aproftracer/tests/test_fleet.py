@@ -0,0 +1,146 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import json
+import queue
+import threading
+
+import pytest
+
+from aproftracer import fleet
+
+APPS = [f"org.example.app{i}" for i in range(6)]
+
+
+class FakeDevices:
+    """run_app and is_healthy of a few fake devices, fail says which (app, device) pairs fail"""
+
+    def __init__(self, fail=(), lose=()):
+        self.fail = set(fail)
+        self.lose = set(lose)
+        self.lost = set()
+        self.runs = []
+        self._lock = threading.Lock()
+
+    def run_app(self, app, device):
+        with self._lock:
+            self.runs.append((app, device))
+            if (app, device) in self.lose:
+                self.lost.add(device)
+                return 1
+        return 1 if (app, device) in self.fail or (app, "*") in self.fail else 0
+
+    def is_healthy(self, device):
+        return device not in self.lost
+
+
+def _fleet(tmp_path, devices, fake, apps=APPS, **kwargs):
+    journal = fleet.Journal(tmp_path / "journal.jsonl")
+    return fleet.Fleet(apps, devices, fake.run_app, journal, fake.is_healthy, recheck_interval=0.05, **kwargs)
+
+
+def _events(tmp_path):
+    with open(tmp_path / "journal.jsonl") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_all_done(tmp_path):
+    fake = FakeDevices()
+    states = _fleet(tmp_path, ["a", "b"], fake).run()
+    assert all(s.final == "done" for s in states.values())
+    assert sorted(app for app, _ in fake.runs) == APPS
+    done = [e for e in _events(tmp_path) if e["event"] == "done"]
+    assert len(done) == len(APPS)
+
+
+def test_failure_moves_to_other_device(tmp_path):
+    fake = FakeDevices(fail=[(APPS[0], "a"), (APPS[0], "b")])
+    states = _fleet(tmp_path, ["a", "b", "c"], fake).run()
+    assert states[APPS[0]].final == "done"
+    # never twice on the same device, whichever worker got it next
+    devices = [d for app, d in fake.runs if app == APPS[0]]
+    assert devices[-1] == "c"
+    assert len(set(devices)) == len(devices)
+    assert states[APPS[0]].attempts == len(devices) - 1
+
+
+def test_give_up(tmp_path):
+    fake = FakeDevices(fail=[(APPS[1], "*")])
+    states = _fleet(tmp_path, ["a"], fake, max_attempts=2).run()
+    assert states[APPS[1]].final == "given_up"
+    assert fake.runs.count((APPS[1], "a")) == 2
+    assert sum(1 for s in states.values() if s.final == "done") == len(APPS) - 1
+
+
+def test_device_lost(tmp_path):
+    # a drops out during its first app, b (only plugged in then) does the rest, the app does not lose an attempt
+    fake = FakeDevices(lose=[(APPS[0], "a")])
+    fake.is_healthy = lambda device: device not in fake.lost and (device == "a" or "a" in fake.lost)
+    f = _fleet(tmp_path, ["a", "b"], fake, apps=APPS[:1])
+    states = f.run()
+    assert states[APPS[0]].final == "done"
+    assert states[APPS[0]].attempts == 0
+    assert fake.runs == [(APPS[0], "a"), (APPS[0], "b")]
+    assert [e["event"] for e in _events(tmp_path)] == ["started", "device_lost", "started", "done"]
+
+
+def test_resume(tmp_path):
+    journal = fleet.Journal(tmp_path / "journal.jsonl")
+    journal.record("started", APPS[0], device="a", attempt=1)
+    journal.record("done", APPS[0], device="a")
+    # killed while this one ran, and while writing the next line
+    journal.record("started", APPS[1], device="a", attempt=1)
+    with open(tmp_path / "journal.jsonl", "a") as f:
+        f.write('{"time": 1')
+    fake = FakeDevices()
+    states = _fleet(tmp_path, ["a"], fake, apps=APPS[:3]).run()
+    assert [app for app, _ in fake.runs] == APPS[1:3]
+    assert all(states[app].final == "done" for app in APPS[:3])
+
+
+def test_pool_lease_has_a_timeout(tmp_path):
+    leases = []
+
+    class FakePool:
+        def lease(self, device, timeout=None):
+            leases.append((device, timeout))
+            raise queue.Empty("nothing free")
+
+    run_app = fleet._run_aproftracer([], tmp_path, FakePool(), lease_timeout=5)
+    with pytest.raises(queue.Empty):
+        run_app("org.example.app0", "emulator-5554")
+    assert leases == [("emulator-5554", 5)]
+
+
+def test_app_that_keeps_taking_its_device_down(tmp_path):
+    # the device reboots during every run of the app and comes back healthy each time
+    fake = FakeDevices(lose=[(APPS[0], "a")])
+    down = set()
+
+    def run_app(app, device):
+        down.add(device)
+        return fake.run_app(app, device)
+
+    def is_healthy(device):
+        if device in down:
+            down.discard(device)
+            return False
+        return True
+
+    journal = fleet.Journal(tmp_path / "journal.jsonl")
+    f = fleet.Fleet(APPS[:1], ["a"], run_app, journal, is_healthy, recheck_interval=0.01, max_lost=2)
+    states = f.run()
+    assert states[APPS[0]].final == "given_up"
+    assert states[APPS[0]].lost == 2
+    assert states[APPS[0]].attempts == 0
+    assert fake.runs == [(APPS[0], "a")] * 2
+    assert _events(tmp_path)[-1]["reason"] == "device_lost"
+
+
+def test_no_healthy_device(tmp_path):
+    fake = FakeDevices()
+    fake.is_healthy = lambda device: False
+    states = _fleet(tmp_path, ["a", "b"], fake, apps=APPS[:2], no_device_timeout=0.1).run()
+    assert fake.runs == []
+    assert all(s.final == "given_up" for s in states.values())
+    assert {e["reason"] for e in _events(tmp_path)} == {"no healthy device"}
@@ -0,0 +1,94 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import gzip
+
+import pytest
+
+from aproftracer import oatdump
+
+OATDUMP = """MAGIC:
+oat
+236
+
+OatDexFile:
+location: /data/app/~~a/com.foo-1/base.apk
+checksum: 0x1234
+0: Lcom/foo/Bar; (offset=0x00001000) (type_idx=1) (status=Verified) (OatClassAllCompiled)
+  0: void com.foo.Bar.<init>() (dex_method_idx=3)
+    DEX CODE:
+      0x0000: 7010 1f10 0000           | invoke-direct {v0}, void java.lang.Object.<init>() // method@4127
+    CODE: (code_offset=0x00002000 size=12)...
+  1: int com.foo.Bar.get(\xff) (dex_method_idx=4)
+    CODE: (code_offset=0x00002040 size=12)...
+  2: void com.foo.Bar.gone() (dex_method_idx=5)
+    CODE: (code_offset=0x00000000 size=0)...
+      NO CODE!
+OatDexFile:
+location: /data/app/~~a/com.foo-1/base.apk!classes2.dex
+  0: void com.foo.Baz.run() (dex_method_idx=7)
+    CODE: (code_offset=0x00003000 size=12)...
+OatDexFile:
+location: /data/app/~~a/com.foo-1/base.apk!classes3.dex
+  0: void com.foo.Qux.run() (dex_method_idx=1)
+    CODE: (code_offset=0x00004000 size=12)...
+"""
+
+PROFILE_INFO = {
+    'hot': {'base.apk': {3}, 'base.apk!classes2.dex': {7}},
+    'startup': {'base.apk': {3, 4}, 'base.apk!classes2.dex': set()},
+    'poststartup': {'base.apk': set(), 'base.apk!classes2.dex': set()},
+}
+
+
+@pytest.fixture
+def oatdump_path(tmp_path):
+    p = tmp_path / "base.oatdump"
+    p.write_bytes(OATDUMP.encode("latin-1"))
+    return p
+
+
+@pytest.mark.parametrize("chunk_size", [16, 100, 1 << 20])
+def test_read_oatdump_info(oatdump_path, chunk_size):
+    info = oatdump.read_oatdump_info(PROFILE_INFO, oatdump_path, 0x1000, chunk_size=chunk_size)
+    assert info['hot'] == [
+        ('base.apk', 3, '0x00002000', '0x1000', 0x3000, 'void com.foo.Bar.<init>()'),
+        ('base.apk!classes2.dex', 7, '0x00003000', '0x1000', 0x4000, 'void com.foo.Baz.run()'),
+    ]
+    assert [x[1] for x in info['startup']] == [3, 4]
+    assert info['startup'][1][5] == 'int com.foo.Bar.get(\\xff)'
+    assert info['poststartup'] == []
+    assert info['other'] == []
+
+
+def test_read_oatdump_info_nonprofile(oatdump_path):
+    info = oatdump.read_oatdump_info(PROFILE_INFO, oatdump_path, 0x1000, include_nonprofile=True, chunk_size=32)
+    # classes3.dex is not in the profile and skipped entirely
+    assert info['other'] == [('base.apk', 5, '0x00000000', '0x1000', 0x1000, 'void com.foo.Bar.gone()')]
+
+
+def test_read_oatdump_info_bad_magic(tmp_path):
+    p = tmp_path / "base.oatdump"
+    p.write_text(OATDUMP.replace("236", "999"))
+    with pytest.raises(NotImplementedError):
+        oatdump.read_oatdump_info(PROFILE_INFO, p, 0x1000)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_oatdump_info_parallel(oatdump_path, workers):
+    for include_nonprofile in (False, True):
+        serial = oatdump.read_oatdump_info(PROFILE_INFO, oatdump_path, 0x1000, include_nonprofile)
+        parallel = oatdump.read_oatdump_info_parallel(PROFILE_INFO, oatdump_path, 0x1000, include_nonprofile, workers=workers)
+        assert parallel == serial
+
+
+def test_read_oatdump_info_gzip(oatdump_path, tmp_path):
+    gz_path = tmp_path / "gz" / "base.oatdump"
+    gz_path.parent.mkdir()
+    gz_path.write_bytes(gzip.compress(oatdump_path.read_bytes()))
+    for include_nonprofile in (False, True):
+        plain = oatdump.read_oatdump_info(PROFILE_INFO, oatdump_path, 0x1000, include_nonprofile)
+        # workers are ignored for a gzipped oatdump, it is streamed
+        for workers in (1, 2):
+            gz = oatdump.read_oatdump_info(PROFILE_INFO, gz_path, 0x1000, include_nonprofile, chunk_size=32, workers=workers)
+            assert gz == plain
@@ -0,0 +1,228 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import hashlib
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+from aproftracer import oatfile
+
+LOCATION = "/data/app/~~a/com.foo-1/base.apk"
+
+# (class descriptor, [(name, return, [params]) direct], [... virtual], OatClass type, code offsets or None)
+DEX1 = [
+    ("Lcom/foo/Bar;",
+        [("<init>", "V", [])],
+        [("run", "I", ["I", "[Ljava/lang/String;"]), ("get", "[[J", ["Z", "Lcom/foo/Baz;"])],
+        0, [0x2000, 0x2040, 0x2080]),
+    ("Lcom/foo/Baz;",
+        [("<init>", "V", []), ("<clinit>", "V", [])],
+        [("a", "V", []), ("b", "V", [])],
+        1, [0x3000, 0, 0, 0x3040]),
+    ("Lcom/foo/Empty;", [], [], 2, None),
+]
+DEX2 = [
+    ("Lcom/foo/Other;",
+        [("<init>", "V", [])],
+        [("c", "Ljava/lang/Object;", ["B", "C", "D", "F", "S"])],
+        2, [0, 0]),
+]
+
+
+def _uleb(v):
+    out = bytearray()
+    while True:
+        b = v & 0x7f
+        v >>= 7
+        if v:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _build_dex(classes):
+    strings, types, protos, methods = [], [], [], []
+
+    def idx(lst, x):
+        if x not in lst:
+            lst.append(x)
+        return lst.index(x)
+
+    def type_idx(desc):
+        return idx(types, idx(strings, desc))
+
+    class_defs = []
+    for desc, direct, virtual, *_ in classes:
+        cls = type_idx(desc)
+        lists = []
+        for ms in (direct, virtual):
+            lists.append([])
+            for name, ret, params in ms:
+                proto = idx(protos, (type_idx(ret), tuple(type_idx(p) for p in params)))
+                methods.append((cls, proto, idx(strings, name)))
+                lists[-1].append(len(methods) - 1)
+        class_defs.append((cls, lists))
+
+    ids_off = 0x70
+    string_ids_off = ids_off
+    type_ids_off = string_ids_off + 4 * len(strings)
+    proto_ids_off = type_ids_off + 4 * len(types)
+    method_ids_off = proto_ids_off + 12 * len(protos)
+    class_defs_off = method_ids_off + 8 * len(methods)
+    data = bytearray(b"\0" * (class_defs_off + 32 * len(class_defs)))
+
+    string_offs = []
+    for s in strings:
+        string_offs.append(len(data))
+        data += _uleb(len(s)) + s.encode() + b"\0"
+    param_offs = []
+    for _, params in protos:
+        data += b"\0" * (-len(data) % 4)
+        param_offs.append(len(data) if params else 0)
+        if params:
+            data += struct.pack(f"<I{len(params)}H", len(params), *params)
+    class_data_offs = []
+    for _, (direct, virtual) in class_defs:
+        if not direct and not virtual:
+            class_data_offs.append(0)
+            continue
+        class_data_offs.append(len(data))
+        data += _uleb(0) + _uleb(0) + _uleb(len(direct)) + _uleb(len(virtual))
+        for ms in (direct, virtual):
+            prev = 0
+            for m in ms:
+                data += _uleb(m - prev) + _uleb(1) + _uleb(0)
+                prev = m
+
+    struct.pack_into(f"<{len(strings)}I", data, string_ids_off, *string_offs)
+    struct.pack_into(f"<{len(types)}I", data, type_ids_off, *types)
+    for i, ((ret, _), off) in enumerate(zip(protos, param_offs, strict=True)):
+        struct.pack_into("<3I", data, proto_ids_off + 12 * i, 0, ret, off)
+    for i, m in enumerate(methods):
+        struct.pack_into("<HHI", data, method_ids_off + 8 * i, *m)
+    for i, ((cls, _), off) in enumerate(zip(class_defs, class_data_offs, strict=True)):
+        struct.pack_into("<8I", data, class_defs_off + 32 * i, cls, 1, 0, 0, 0, 0, off, 0)
+
+    data += b"\0" * (-len(data) % 4)
+    data[0:8] = b"dex\n039\0"
+    struct.pack_into("<I", data, 0x20, len(data))
+    struct.pack_into("<12I", data, 0x38,
+        len(strings), string_ids_off, len(types), type_ids_off, len(protos), proto_ids_off,
+        0, 0, len(methods), method_ids_off, len(class_defs), class_defs_off)
+    data[0x0c:0x20] = hashlib.sha1(data[0x20:]).digest()
+    struct.pack_into("<I", data, 0x08, zlib.adler32(data[0x0c:]))
+    return bytes(data)
+
+
+def _build_vdex(dexes):
+    dex_section = b"".join(dexes)
+    header = b"vdex027\0" + struct.pack("<I", 4)
+    off = len(header) + 4 * 12
+    sections = struct.pack("<12I", 0, off, 0, 1, off, len(dex_section), 2, 0, 0, 3, 0, 0)
+    return header + sections + dex_section
+
+
+def _build_oat(dexes, classes_per_dex):
+    # header, then OatDexFile records with sha1 and 8 trailing offsets, then class offsets and OatClasses
+    oat = bytearray(b"oat\n236\0" + b"\0" * 64)
+    struct.pack_into("<II", oat, 20, len(dexes), len(oat))
+    record_fixups = []
+    for i, dex in enumerate(dexes):
+        loc = (LOCATION if i == 0 else f"{LOCATION}!classes{i + 1}.dex").encode()
+        oat += struct.pack("<I", len(loc)) + loc + dex[0x08:0x0c] + dex[0x0c:0x20]
+        record_fixups.append(len(oat) + 4)
+        oat += struct.pack("<2I", 0, 0) + struct.pack("<8I", *range(8))
+    for fixup, classes in zip(record_fixups, classes_per_dex, strict=True):
+        class_offsets_offset = len(oat)
+        struct.pack_into("<I", oat, fixup, class_offsets_offset)
+        oat += b"\0" * (4 * len(classes))
+        for i, (_, direct, virtual, class_type, offsets) in enumerate(classes):
+            struct.pack_into("<I", oat, class_offsets_offset + 4 * i, len(oat))
+            n = len(direct) + len(virtual)
+            oat += struct.pack("<HH", 9, class_type)
+            if class_type == 0:
+                oat += struct.pack(f"<I{n}I", n, *offsets)
+            elif class_type == 1:
+                bitmap = sum(1 << j for j, o in enumerate(offsets) if o)
+                compiled = [o for o in offsets if o]
+                oat += struct.pack(f"<II{len(compiled)}I", n, bitmap, *compiled)
+    return bytes(oat)
+
+
+def _build_elf(oat, oat_offset=0x1000):
+    elf = bytearray(b"\0" * oat_offset)
+    dynstr = b"\0oatexec\0oatdata\0"
+    dynstr_off, dynsym_off, shdr_off = 0x100, 0x140, 0x200
+    elf[dynstr_off:dynstr_off + len(dynstr)] = dynstr
+    struct.pack_into("<IBBHQQ", elf, dynsym_off + 24, 1, 0, 0, 0, 0x5000, 0)
+    struct.pack_into("<IBBHQQ", elf, dynsym_off + 48, 9, 0, 0, 0, oat_offset, len(oat))
+    elf += oat
+    elf[0:6] = b"\x7fELF\x02\x01"
+    struct.pack_into("<HHIQQQIHHHHHH", elf, 16, 3, 183, 1, 0, 64, shdr_off, 0, 64, 56, 1, 64, 3, 0)
+    struct.pack_into("<IIQQQQQQ", elf, 64, 1, 4, 0, 0, 0, len(elf), len(elf), 0x1000)
+    struct.pack_into("<IIQQQQIIQQ", elf, shdr_off + 64, 0, 3, 0, 0, dynstr_off, len(dynstr), 0, 0, 1, 0)
+    struct.pack_into("<IIQQQQIIQQ", elf, shdr_off + 128, 0, 11, 0, 0, dynsym_off, 72, 1, 1, 8, 24)
+    return bytes(elf)
+
+
+@pytest.fixture
+def odex_files(tmp_path):
+    dexes = [_build_dex(DEX1), _build_dex(DEX2)]
+    (tmp_path / "base.odex").write_bytes(_build_elf(_build_oat(dexes, [DEX1, DEX2])))
+    (tmp_path / "base.vdex").write_bytes(_build_vdex(dexes))
+    (tmp_path / "empty.vdex").write_bytes(_build_vdex([]))
+    with zipfile.ZipFile(tmp_path / "base.apk", "w", compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr("classes.dex", dexes[0])
+        z.writestr("classes2.dex", dexes[1])
+    return tmp_path
+
+
+PROFILE_INFO = {
+    'hot': {'base.apk': {0, 1, 4}, 'base.apk!classes2.dex': {1}},
+    'startup': {'base.apk': {4}},
+    'poststartup': {},
+}
+
+
+def test_pretty_descriptor():
+    assert oatfile._pretty_descriptor(b"Lcom/foo/Bar;") == b"com.foo.Bar"
+    assert oatfile._pretty_descriptor(b"[[J") == b"long[][]"
+    assert oatfile._pretty_descriptor(b"[Ljava/lang/String;") == b"java.lang.String[]"
+    assert oatfile._pretty_descriptor(b"V") == b"void"
+
+
+def test_read_odex_info(odex_files):
+    info, oatdata_offset = oatfile.read_odex_info(PROFILE_INFO, odex_files / "base.odex", odex_files / "base.vdex")
+    assert oatdata_offset == 0x1000
+    assert info['hot'] == [
+        ("base.apk", 0, "0x00002000", "0x1000", 0x3000, "void com.foo.Bar.<init>()"),
+        ("base.apk", 1, "0x00002040", "0x1000", 0x3040, "int com.foo.Bar.run(int, java.lang.String[])"),
+        ("base.apk", 4, "0x00000000", "0x1000", 0x1000, "void com.foo.Baz.<clinit>()"),
+        ("base.apk!classes2.dex", 1, "0x00000000", "0x1000", 0x1000,
+            "java.lang.Object com.foo.Other.c(byte, char, double, float, short)"),
+    ]
+    assert [d[1] for d in info['startup']] == [4]
+    assert info['poststartup'] == info['other'] == []
+
+
+def test_read_odex_info_nonprofile(odex_files):
+    info, _ = oatfile.read_odex_info(PROFILE_INFO, odex_files / "base.odex", odex_files / "base.vdex", include_nonprofile=True)
+    other = {(d[0], d[1]): d for d in info['other']}
+    assert set(other) == {("base.apk", 2), ("base.apk", 3), ("base.apk", 5), ("base.apk", 6), ("base.apk!classes2.dex", 0)}
+    assert other[("base.apk", 2)][2] == "0x00002080"
+    assert other[("base.apk", 2)][5] == "long[][] com.foo.Bar.get(boolean, com.foo.Baz)"
+    assert other[("base.apk", 3)][2] == "0x00003000"
+    assert other[("base.apk", 6)][2] == "0x00003040"
+
+
+def test_read_odex_info_from_apk(odex_files):
+    from_vdex, _ = oatfile.read_odex_info(PROFILE_INFO, odex_files / "base.odex", odex_files / "base.vdex")
+    with pytest.raises(NotImplementedError):
+        oatfile.read_odex_info(PROFILE_INFO, odex_files / "base.odex", odex_files / "empty.vdex")
+    assert not oatfile.has_dex_files(odex_files / "empty.vdex")
+    from_apk, _ = oatfile.read_odex_info(PROFILE_INFO, odex_files / "base.odex", odex_files / "empty.vdex", odex_files / "base.apk")
+    assert from_apk == from_vdex
@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import multiprocessing
+import time
+
+from aproftracer import offsetscache
+from aproftracer.bitmapset import BitmapSet
+
+PROFILE_INFO = {"base.apk": {"hot": BitmapSet.from_indices([1, 5, 9])}}
+OFFSETS_INFO = {"0x1d96b0": {"method": "void a.b.c()", "dex": "base.apk"}}
+
+
+def test_cache_key():
+    key = offsetscache.cache_key("dm", "odex", "google/sdk:14", False)
+    assert key == offsetscache.cache_key("dm", "odex", "google/sdk:14", False)
+    assert len(key) == 64
+    assert key != offsetscache.cache_key("dm", "odex", "google/sdk:14", True)
+    assert key != offsetscache.cache_key("dm", "odex2", "google/sdk:14", False)
+    assert key != offsetscache.cache_key("dm", "odex", "google/sdk:15", False)
+
+
+def test_get_put(tmp_path):
+    cache = offsetscache.OffsetsCache(tmp_path / "cache")
+    key = offsetscache.cache_key("dm", "odex", "fp", False)
+    assert cache.get(key) is None
+    cache.put(key, PROFILE_INFO, OFFSETS_INFO, 0x1000)
+    # a second instance on the same dir, like another worker
+    assert offsetscache.OffsetsCache(tmp_path / "cache").get(key) == (PROFILE_INFO, OFFSETS_INFO, 0x1000)
+    # no temporary files left behind
+    assert [p.name for p in (tmp_path / "cache").rglob("*.pickle*")] == [f"{key}.pickle"]
+
+
+def test_broken_entry(tmp_path):
+    cache = offsetscache.OffsetsCache(tmp_path)
+    key = offsetscache.cache_key("dm", "odex", "fp", False)
+    cache.put(key, PROFILE_INFO, OFFSETS_INFO, 0x1000)
+    cache._path(key).write_bytes(b"")
+    assert cache.get(key) is None
+
+
+def _fill(cache_dir, key, results):
+    cache = offsetscache.OffsetsCache(cache_dir)
+    with cache.lock(key):
+        if cache.get(key) is None:
+            time.sleep(0.2)
+            cache.put(key, PROFILE_INFO, OFFSETS_INFO, 0x1000)
+            results.put("computed")
+        else:
+            results.put("cached")
+
+
+def test_lock(tmp_path):
+    key = offsetscache.cache_key("dm", "odex", "fp", False)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_fill, args=(tmp_path, key, results)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert sorted(results.get() for _ in procs) == ["cached", "cached", "computed"]
@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import threading
+
+from aproftracer import pipeline
+
+
+class FakeTracer:
+    """logs the steps of the Tracer it stands in for to a shared list"""
+
+    def __init__(self, app, steps, fail=(), run_waits_for=None, reboots=True):
+        self.app = app
+        self.reboots = reboots
+        self.steps = steps
+        self.fail = fail
+        self.run_waits_for = run_waits_for
+        self.built = threading.Event()
+
+    def _step(self, name):
+        self.steps.append((name, self.app))
+        if name in self.fail:
+            raise RuntimeError(f"{name} failed")
+
+    def fetch_tracepoint_inputs(self, code_coverage):
+        self._step("fetch")
+
+    def build_tracepoints(self, code_coverage, also_startup_poststartup, only_appid):
+        self._step("build")
+        self.built.set()
+
+    def push_tracepoints(self):
+        self._step("push")
+
+    def run_tracer(self, tool, max_runtime, also_trace_activities):
+        self._step("run")
+        if self.run_waits_for is not None:
+            # the build of the next app has to happen while this one runs
+            assert self.run_waits_for().built.wait(5)
+
+    def collect_results(self):
+        self._step("collect")
+
+    def write_results(self):
+        self._step("write")
+
+    def cleanup_host(self):
+        pass
+
+    def cleanup_android(self):
+        self._step("cleanup")
+
+    def reset_device(self, reboot_every):
+        self._step("reset")
+        if self.reboots:
+            self._step("reboot")
+        return self.reboots
+
+    def reconnect(self):
+        self._step("reconnect")
+
+
+def _pipeline(tracers, steps, **kwargs):
+    return pipeline.Pipeline(
+            lambda app: tracers[app],
+            lambda t: steps.append(("install", t.app)),
+            (False, False, False),
+            {"tool": "time", "max_runtime": 1, "also_trace_activities": False},
+            **kwargs)
+
+
+def _device_steps(steps):
+    return [s for s in steps if s[0] not in ("build", "write")]
+
+
+def test_order_and_overlap():
+    steps = []
+    tracers = {}
+    for app in ("a", "b", "c"):
+        tracers[app] = FakeTracer(app, steps)
+    tracers["a"].run_waits_for = lambda: tracers["b"]
+    retcodes = _pipeline(tracers, steps).run(["a", "b", "c"])
+
+    assert retcodes == {"a": 0, "b": 0, "c": 0}
+    assert _device_steps(steps) == [
+        ("install", "a"), ("fetch", "a"),
+        ("install", "b"), ("fetch", "b"),
+        ("push", "a"), ("run", "a"), ("collect", "a"), ("reset", "a"), ("reboot", "a"), ("reconnect", "b"),
+        ("install", "c"), ("fetch", "c"),
+        ("push", "b"), ("run", "b"), ("collect", "b"), ("reset", "b"), ("reboot", "b"), ("reconnect", "c"),
+        ("push", "c"), ("run", "c"), ("collect", "c"), ("reset", "c"), ("reboot", "c"),
+    ]
+    assert sorted(s for s in steps if s[0] == "write") == [("write", "a"), ("write", "b"), ("write", "c")]
+
+
+def test_failures():
+    steps = []
+    tracers = {
+        "a": FakeTracer("a", steps, fail=("write",)),
+        "b": FakeTracer("b", steps, fail=("fetch",)),
+        "c": FakeTracer("c", steps, fail=("build",)),
+        "d": FakeTracer("d", steps),
+    }
+    retcodes = _pipeline(tracers, steps).run(["a", "b", "c", "d"])
+    assert retcodes == {"a": pipeline.FAILED, "b": pipeline.FAILED, "c": pipeline.FAILED, "d": 0}
+    # b never ran, it is only cleaned up
+    assert ("push", "b") not in steps
+    assert ("cleanup", "b") in steps
+    # c never got pushed, but the device is reset after it
+    assert ("push", "c") not in steps
+    assert ("reboot", "c") in steps
+
+
+def test_no_cleanup_android():
+    steps = []
+    tracers = {app: FakeTracer(app, steps) for app in ("a", "b")}
+    _pipeline(tracers, steps, cleanup_android=False).run(["a", "b"])
+    assert not [s for s in steps if s[0] in ("cleanup", "reset", "reboot", "reconnect")]
+
+
+def test_no_reconnect_after_soft_reset():
+    steps = []
+    tracers = {"a": FakeTracer("a", steps, reboots=False), "b": FakeTracer("b", steps)}
+    retcodes = _pipeline(tracers, steps).run(["a", "b"])
+    assert retcodes == {"a": 0, "b": 0}
+    assert ("reset", "a") in steps
+    assert ("reconnect", "b") not in steps
@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import struct
+import zlib
+
+import pytest
+
+from aproftracer import prof
+
+# key, checksum, num_type_ids, num_method_ids, hot, startup, post startup, classes
+DEXES = [
+    ("base.apk", 0x1111, 20, 40, [0, 3, 39], [1, 3, 17], [2, 39], [4, 5, 19]),
+    ("base.apk!classes2.dex", 0x2222, 10, 9, [8], [], [0, 8], []),
+]
+
+
+def _diffs(idxs):
+    return struct.pack(f"<{len(idxs)}H", *(b - a for a, b in zip([0, *idxs], idxs, strict=False)))
+
+
+def _bitmap(regions, num_method_ids):
+    bits = 0
+    for i, idxs in enumerate(regions):
+        for idx in idxs:
+            bits |= 1 << (i * num_method_ids + idx)
+    return bits.to_bytes((len(regions) * num_method_ids + 7) // 8, "little")
+
+
+def _hot_methods(hot, inline_caches):
+    out = b""
+    for i, d in enumerate(struct.unpack(f"<{len(hot)}H", _diffs(hot))):
+        # only the first method gets inline caches
+        caches = inline_caches if i == 0 else []
+        out += struct.pack("<HH", d, len(caches)) + b"".join(caches)
+    return out
+
+
+def _build_015():
+    dex_files = struct.pack("<H", len(DEXES))
+    classes = b""
+    methods = b""
+    for i, (key, checksum, num_types, num_methods, hot, startup, post, cls) in enumerate(DEXES):
+        dex_files += struct.pack("<3IH", checksum, num_types, num_methods, len(key)) + key.encode()
+        if cls:
+            classes += struct.pack("<HH", i, len(cls)) + _diffs(cls)
+        caches = [struct.pack("<HB", 5, 2) + _diffs([3, 7]), struct.pack("<HB", 6, 7), struct.pack("<HB", 9, 6)]
+        # hot | startup | post startup | 64bit, the last one has its own (empty) bitmap region
+        data = struct.pack("<H", 0b10111) + _bitmap([startup, post, []], num_methods) + _hot_methods(hot, caches)
+        methods += struct.pack("<HI", i, len(data)) + data
+
+    sections = [(0, dex_files, False), (2, classes, True), (3, methods, True)]
+    out = b"pro\x00015\x00" + struct.pack("<I", len(sections))
+    offset = len(out) + 16 * len(sections)
+    payload = b""
+    for kind, section, compress in sections:
+        stored = zlib.compress(section) if compress else section
+        out += struct.pack("<4I", kind, offset + len(payload), len(stored), len(section) if compress else 0)
+        payload += stored
+    return out + payload
+
+
+def _build_010():
+    headers = b""
+    lines = b""
+    for key, checksum, _, num_methods, hot, startup, post, cls in DEXES:
+        caches = [struct.pack("<HBBB", 5, 1, 0, 2) + _diffs([3, 7]), struct.pack("<HB", 6, 7)]
+        hot_methods = _hot_methods(hot, caches)
+        headers += struct.pack("<HHIII", len(key), len(cls), len(hot_methods), checksum, num_methods) + key.encode()
+        lines += hot_methods + _diffs(cls) + _bitmap([startup, post], num_methods)
+    body = headers + lines
+    compressed = zlib.compress(body)
+    return b"pro\x00010\x00" + struct.pack("<BII", len(DEXES), len(body), len(compressed)) + compressed
+
+
+@pytest.mark.parametrize("build", [_build_015, _build_010])
+def test_decode_prof(build):
+    dex_files = prof.decode_prof(build())
+    assert [d['key'] for d in dex_files] == [d[0] for d in DEXES]
+    for dex, (_, checksum, _, num_methods, hot, startup, post, cls) in zip(dex_files, DEXES, strict=True):
+        assert dex['checksum'] == checksum
+        assert dex['num_method_ids'] == num_methods
+        assert dex['hot'] == set(hot)
+        assert dex['startup'] == set(startup)
+        assert dex['poststartup'] == set(post)
+        assert dex['classes'] == set(cls)
+
+
+def test_read_prof_info(tmp_path):
+    path = tmp_path / "primary.prof"
+    path.write_bytes(_build_015())
+    assert prof.is_prof(path)
+    profile_info = prof.read_prof_info(path)
+    # same labels as Tracer.read_profdump_info
+    assert profile_info['hot']['base.apk'] == {0, 3, 39}
+    assert profile_info['startup']['base.apk'] == {2, 39}
+    assert profile_info['poststartup']['base.apk'] == {1, 3, 17}
+    assert profile_info['startup']['base.apk!classes2.dex'] == {0, 8}
+
+
+def test_unknown_version():
+    with pytest.raises(NotImplementedError):
+        prof.decode_prof(b"pro\x00009\x00" + b"\0" * 16)
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import gzip
+import pickle
+
+import pytest
+
+from aproftracer import rawtrace
+
+RAW = (
+    "   app.organicmaps-24536   [002] .....  4423.725704: event0x1d96b0: (0x6e16e3e6b0)\n"
+    "AsyncTask #2-10249 [005] d..3. 4423.825704: event0xa4610: (0x767e1bc610)\n"
+    "CPU:2 [LOST 123 EVENTS]\n"
+    "           <...>-1 [001] d..3. 4424.000001: bpf_trace_printk: hello\n"
+    "weird[name-1 [002] ..... 4424.5: event0x10: (0x1)\n"
+    "noname [001] ..... 4425.0: event0x10: (0x1)\n"
+    "garbage line\n"
+    "\n"
+    "RenderThread-24570   [001] ..... 4426: event0xAB: (0x1)\r\n"
+    "LOST EVENTS-1 [000] ..... 4427.0: event0x2: (0x1) 7 )\n"
+    "split-1 [000] ..... 4428.0: event0x3:\r(0x1)\n"
+    "tail-1 [000] ..... 4429.0: event0x4: (0x1) and more\n"
+    "a name that is a lot longer than sixteen characters-99 [000] ..... 4430.25: event0x5: (0x1)\n"
+    "RenderThread-24570   [001] ..... 4431.000001: event0x1d96b0: (0x6e16e3e6b0)"
+)
+
+EXPECTED = [
+    ("app.organicmaps-24536", 0.0, "0x1d96b0"),
+    ("AsyncTask #2-10249", 4423.825704 - 4423.725704, "0xa4610"),
+    ("weird name-1", 4424.5 - 4423.725704, "0x10"),
+    ("RenderThread-24570", 4426 - 4423.725704, "0xab"),
+    ("split-1", 4428.0 - 4423.725704, "0x3"),
+    ("tail-1", 4429.0 - 4423.725704, "0x4"),
+    ("a name that is a lot longer than sixteen characters-99", 4430.25 - 4423.725704, "0x5"),
+    ("RenderThread-24570", 4431.000001 - 4423.725704, "0x1d96b0"),
+]
+
+
+def _line_based(path):
+    parser = rawtrace.RawTraceParser()
+    with open(path) as f:
+        for line in f:
+            parser.feed_line(line)
+    return parser.result()
+
+
+@pytest.mark.parametrize("chunk_size", [16, 100, 4 * 1024 * 1024])
+def test_read_raw_trace(tmp_path, chunk_size):
+    path = tmp_path / "raw_output.txt"
+    path.write_bytes(RAW.encode())
+    trace = rawtrace.read_raw_trace(path, chunk_size=chunk_size)
+    assert trace.to_hit_uprobes() == EXPECTED
+    # 123 from the LOST EVENTS line and 7 from the process whose name has both words in it
+    assert trace.lost_events == 130
+    assert trace.to_hit_uprobes() == _line_based(path).to_hit_uprobes()
+
+
+@pytest.mark.parametrize("chunk_size", [16, 4 * 1024 * 1024])
+def test_read_raw_trace_gzip(tmp_path, chunk_size):
+    path = tmp_path / "raw_output.txt"
+    path.write_bytes(gzip.compress(RAW.encode()))
+    trace = rawtrace.read_raw_trace(path, chunk_size=chunk_size)
+    assert trace.to_hit_uprobes() == EXPECTED
+    assert trace.lost_events == 130
+
+
+def test_read_raw_trace_many(tmp_path):
+    names = ["app.organicmaps-24536", "  AsyncTask #2-10249", "<...>-1234", "binder:24536_2-24550"]
+    lines = []
+    for i in range(5000):
+        if i % 997 == 0:
+            lines.append(f"CPU:{i % 8} [LOST {i} EVENTS]")
+        lines.append(f"{names[i % 4]:>16} [{i % 8:03d}] d..{i % 3}. {12.5 + i * 0.000013:11.6f}: event{hex(i * 7919)}: (0x7f{i:x})")
+    path = tmp_path / "raw_output.txt"
+    path.write_text("\n".join(lines) + "\n")
+    trace = rawtrace.read_raw_trace(path, chunk_size=4096)
+    assert len(trace) == 5000
+    assert trace.lost_events == sum(range(0, 5000, 997))
+    assert sorted(trace.comms) == sorted(n.strip() for n in names)
+    assert trace.to_hit_uprobes() == _line_based(path).to_hit_uprobes()
+
+
+def test_first_timestamp_zero(tmp_path):
+    # a first hit at 0 doesn't count as first hit, the next one does
+    path = tmp_path / "raw_output.txt"
+    path.write_text(
+        "a-1 [000] ..... 0.000000: event0x1: (0x1)\n"
+        "a-1 [000] ..... 2.500000: event0x2: (0x1)\n"
+        "a-1 [000] ..... 3.000000: event0x3: (0x1)\n"
+    )
+    assert [h[1] for h in rawtrace.read_raw_trace(path).to_hit_uprobes()] == [0.0, 0.0, 0.5]
+
+
+def test_empty(tmp_path):
+    path = tmp_path / "raw_output.txt"
+    path.write_text("")
+    trace = rawtrace.read_raw_trace(path)
+    assert trace.to_hit_uprobes() == []
+    assert trace.lost_events == 0
+
+
+def test_hit_records(tmp_path):
+    path = tmp_path / "raw_output.txt"
+    path.write_bytes(RAW.encode())
+    trace = rawtrace.read_raw_trace(path)
+    # 0x3 was not traced, it gets appended to the probes
+    trace_info = [("0x5", False), ("0x1d96b0", True), ("0xa4610", True), ("0x10", False), ("0xab", False), ("0x4", True)]
+    records = trace.to_hit_records(trace_info)
+    assert records.hits.dtype.itemsize == 16
+    assert records.probes == [o for o, _ in trace_info] + ["0x3"]
+    assert records.probe.tolist() == [1, 2, 3, 4, 6, 5, 0, 1]
+    assert list(records) == EXPECTED
+    assert list(pickle.loads(pickle.dumps(records))) == EXPECTED
+
+    legacy = rawtrace.HitRecords.from_hit_uprobes(EXPECTED, trace_info)
+    assert legacy.probes == records.probes
+    assert legacy.probe.tolist() == records.probe.tolist()
+    assert list(legacy) == EXPECTED
@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import socketserver
+import threading
+import types
+
+import pytest
+from adbdevice import AdbClient
+from adbdevice.shellsession import SessionCommand
+
+from aproftracer.aproftracer import Tracer
+
+SERIAL = "emulator-5554"
+
+
+class RebootingAdbServer(socketserver.ThreadingTCPServer):
+    """an adb server whose device goes away on the first shell command, like it does on reboot"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RebootingHandler)
+        self.services = []
+
+
+class RebootingHandler(socketserver.BaseRequestHandler):
+    def read_request(self):
+        length = int(self.request.recv(4), 16)
+        data = b""
+        while len(data) < length:
+            data += self.request.recv(length - len(data))
+        return data.decode()
+
+    def handle(self):
+        assert self.read_request() == f"host:transport:{SERIAL}"
+        self.request.sendall(b"OKAY")
+        self.server.services.append(self.read_request())
+        self.request.sendall(b"OKAY")
+        # no exit packet, the connection just drops
+
+
+class FakeSupervisor:
+    def __init__(self):
+        self.ran = []
+
+    def run(self, coro, timeout=None):
+        self.ran.append(coro.__name__)
+        coro.close()
+
+
+@pytest.fixture
+def server():
+    server = RebootingAdbServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_reboot_over_the_socket_backend(server):
+    closed = []
+    tracer = Tracer.__new__(Tracer)
+    tracer.device_id = SERIAL
+    tracer.adbdev = types.SimpleNamespace(
+            shell=SessionCommand(AdbClient(SERIAL, address=server.server_address, timeout=10)),
+            close_sessions=lambda: closed.append(True),
+        )
+    tracer._supervisor = FakeSupervisor()
+    tracer.reboot_and_wait_ok(timeout=5)
+    assert server.services == ["shell,v2,raw:reboot"]
+    assert tracer._supervisor.ran == ["boot_completed"]
+    assert closed == [True]
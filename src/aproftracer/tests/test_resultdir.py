@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import json
+import pickle
+
+import numpy as np
+import pytest
+
+from aproftracer import resultdir
+from aproftracer.bitmapset import BitmapSet
+from aproftracer.rawtrace import HitRecords
+
+_A = ("/data/app/a/base.apk", 3, "0x00001000", "0x5000", 0x6000, "void a.B.c()")
+_B = ("/data/app/a/base.apk!classes2.dex", 7, "0x1f00", "0x5000", 0x6f00, "int a.B.ä(java.lang.String)")
+_C = ("/data/app/a/base.apk", 9, "0x00001100", "0x5000", 0x6100, "void x.Y.z()")
+
+PROFILE_INFO = {
+    "startup": {"/data/app/a/base.apk": BitmapSet.from_indices([3])},
+    "poststartup": {"/data/app/a/base.apk": BitmapSet()},
+    "hot": {"/data/app/a/base.apk": BitmapSet.from_indices([3, 9]), "/data/app/a/base.apk!classes2.dex": BitmapSet.from_indices([7])},
+}
+OFFSETS_INFO = {"hot": [_A, _C, _B], "startup": [_A], "poststartup": [], "other": []}
+TRACE_INFO = [("0x6000", True), ("0x6100", False), ("0x6f00", True)]
+HIT_UPROBES = [("app-1", 0.0, "0x6000"), ("RenderThread-2", 0.5, "0x6f00"), ("app-1", 1.25, "0x6000"), ("app-1", 2.0, "0x1234")]
+ACTIVITIES = [("a/.Main", "0.100000")]
+
+
+def _results():
+    return PROFILE_INFO, OFFSETS_INFO, TRACE_INFO, ACTIVITIES, HitRecords.from_hit_uprobes(HIT_UPROBES, TRACE_INFO)
+
+
+def test_round_trip(tmp_path):
+    resultdir.write_result(tmp_path / "result", *_results())
+    result = resultdir.read_result(tmp_path)
+    assert len(result) == 4
+    assert result.num_tracepoints == 3
+    assert isinstance(result.time, np.memmap)
+    assert result.time.tolist() == [0.0, 0.5, 1.25, 2.0]
+    assert result.probe.tolist() == [0, 2, 0, 3]
+    assert [result.comms[c] for c in result.comm.tolist()] == [h[0] for h in HIT_UPROBES]
+
+    profile_info, offsets_info, trace_info, activities, hits = result.to_tuple()
+    assert profile_info == PROFILE_INFO
+    assert offsets_info == OFFSETS_INFO
+    assert trace_info == TRACE_INFO
+    assert activities == ACTIVITIES
+    assert list(hits) == HIT_UPROBES
+    # the same record in two categories is stored once
+    assert result.manifest["num_methods"] == 3
+
+
+def test_probe_hitcount(tmp_path):
+    resultdir.write_result(tmp_path / "result", *_results())
+    assert resultdir.read_result(tmp_path / "result").probe_hitcount() is None
+    # probes are trace_info plus the unknown 0x1234
+    resultdir.write_result(tmp_path / "counted", *_results(), probe_hitcount=[2, 0, 1, 1])
+    assert resultdir.read_result(tmp_path / "counted").probe_hitcount().tolist() == [2, 0, 1, 1]
+    with pytest.raises(RuntimeError):
+        resultdir.write_result(tmp_path / "counted", *_results(), probe_hitcount=[2, 0, 1])
+
+
+def test_probe_retired(tmp_path):
+    resultdir.write_result(tmp_path / "result", *_results())
+    assert resultdir.read_result(tmp_path / "result").probe_retired() is None
+    resultdir.write_result(tmp_path / "retired", *_results(), probe_retired={"0x6f00": 1.5, "0x6000": 0.5})
+    retired = resultdir.read_result(tmp_path / "retired").probe_retired()
+    assert retired[0] == 0.5 and retired[2] == 1.5
+    assert np.isnan(retired[1]) and np.isnan(retired[3])
+    with pytest.raises(RuntimeError):
+        resultdir.write_result(tmp_path / "retired", *_results(), probe_retired={"0x7000": 1.0})
+
+
+def test_replace_and_empty(tmp_path):
+    resultdir.write_result(tmp_path / "result", *_results())
+    resultdir.write_result(tmp_path / "result", {}, {}, [], None, [])
+    result = resultdir.read_result(tmp_path / "result", mmap=False)
+    assert len(result) == 0
+    assert result.to_tuple()[:4] == ({}, {}, [], None)
+    assert [p.name for p in tmp_path.iterdir()] == ["result"]
+
+
+def test_convert_pickle(tmp_path):
+    # a result.pickle from before hits were records, with python sets in the profile
+    old = ({"hot": {"/data/app/a/base.apk": {3, 9}}}, OFFSETS_INFO, TRACE_INFO, None, HIT_UPROBES)
+    with open(tmp_path / "result.pickle", "wb") as f:
+        pickle.dump(old, f)
+    out = resultdir.convert_pickle(tmp_path / "result.pickle")
+    assert out == tmp_path / "result"
+    profile_info, offsets_info, trace_info, activities, hits = resultdir.read_result(tmp_path).to_tuple()
+    assert profile_info == {"hot": {"/data/app/a/base.apk": BitmapSet.from_indices([3, 9])}}
+    assert offsets_info == OFFSETS_INFO
+    assert trace_info == TRACE_INFO
+    assert activities is None
+    assert list(hits) == HIT_UPROBES
+
+
+def test_unknown_version(tmp_path):
+    resultdir.write_result(tmp_path / "result", *_results())
+    manifest_path = tmp_path / "result" / resultdir.MANIFEST_NAME
+    manifest = json.loads(manifest_path.read_text())
+    manifest["version"] = resultdir.FORMAT_VERSION + 1
+    manifest_path.write_text(json.dumps(manifest))
+    with pytest.raises(NotImplementedError):
+        resultdir.read_result(tmp_path)
@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import time
+
+from aproftracer import retirement
+
+PROBES = ["0x1000", "0x1004", "0x1008", "0x100c", "0x1010"]
+
+
+def _retirer(hits, retired_batches, batch_size=2, fail=0):
+    def take_new():
+        new = list(hits)
+        hits.clear()
+        return new
+
+    failures = [fail]
+
+    def retire(batch):
+        if failures[0]:
+            failures[0] -= 1
+            raise RuntimeError("adb dropped out")
+        retired_batches.append(batch)
+
+    retirer = retirement.ProbeRetirer(take_new, retire, PROBES, batch_size=batch_size)
+    retirer._start = 0.0
+    return retirer
+
+
+def test_retire_in_batches():
+    hits, batches = [0x1000, 0x1008, 0x100c, 0x9999], []
+    retirer = _retirer(hits, batches)
+    # unknown offsets are no probes, they are not retired
+    assert retirer.retire_new() == 3
+    assert batches == [["0x1000", "0x1008"], ["0x100c"]]
+    hits += [0x1000, 0x1010]
+    assert retirer.retire_new() == 1
+    assert batches[-1] == ["0x1010"]
+    assert sorted(retirer.retired) == ["0x1000", "0x1008", "0x100c", "0x1010"]
+
+
+def test_failed_batch_is_retried():
+    hits, batches = [0x1000, 0x1004], []
+    retirer = _retirer(hits, batches, fail=1)
+    assert retirer.retire_new() == 0
+    assert retirer.failed_batches == 1
+    assert retirer.retire_new() == 2
+    assert batches == [["0x1000", "0x1004"]]
+
+
+def test_thread():
+    hits, batches = [0x1004], []
+    retirer = retirement.ProbeRetirer(lambda: [hits.pop()] if hits else [], batches.append, PROBES, interval=0.05)
+    retirer.start()
+    while not batches:
+        time.sleep(0.01)
+    timeline = retirer.stop()
+    assert list(timeline) == ["0x1004"]
+    assert timeline["0x1004"] >= 0
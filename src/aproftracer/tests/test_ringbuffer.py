@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import struct
+
+import numpy as np
+import pytest
+
+from aproftracer import ringbuffer
+
+PAGE_SIZE = 4096
+
+HEADER_PAGE = (
+    "\tfield: u64 timestamp;\toffset:0;\tsize:8;\tsigned:0;\n"
+    "\tfield: local_t commit;\toffset:8;\tsize:8;\tsigned:1;\n"
+    "\tfield: int overwrite;\toffset:8;\tsize:1;\tsigned:1;\n"
+    f"\tfield: char data;\toffset:16;\tsize:{PAGE_SIZE - 16};\tsigned:1;\n"
+)
+
+FORMAT = (
+    "name: event0x1d96b0\n"
+    "ID: 1500\n"
+    "format:\n"
+    "\tfield:unsigned short common_type;\toffset:0;\tsize:2;\tsigned:0;\n"
+    "\tfield:unsigned char common_flags;\toffset:2;\tsize:1;\tsigned:0;\n"
+    "\tfield:unsigned char common_preempt_count;\toffset:3;\tsize:1;\tsigned:0;\n"
+    "\tfield:int common_pid;\toffset:4;\tsize:4;\tsigned:1;\n"
+    "\n"
+    "\tfield:unsigned long __probe_ip;\toffset:8;\tsize:8;\tsigned:0;\n"
+    "\n"
+    "print fmt: \"(%lx)\", REC->__probe_ip\n"
+)
+
+EVENT_IDS = "event0x1d96b0 1500\nevent0xa4610 1501\n"
+
+
+def _event(delta, event_type, pid):
+    # a uprobe event is 16 bytes, type_len 4
+    return struct.pack("<IHBBiQ", (delta << 5) | 4, event_type, 0, 0, pid, 0x7000)
+
+
+def _time_extend(delta):
+    return struct.pack("<II", (delta & ((1 << 27) - 1)) << 5 | 30, delta >> 27)
+
+
+def _page(timestamp, events, lost=None):
+    data = b"".join(events)
+    commit = len(data)
+    if lost is not None:
+        commit |= 1 << 31 | 1 << 30
+    page = struct.pack("<QQ", timestamp, commit) + data
+    if lost is not None:
+        page += struct.pack("<Q", lost)
+    return page + b"\0" * (PAGE_SIZE - len(page))
+
+
+def test_layout():
+    layout = ringbuffer.PageLayout(HEADER_PAGE, FORMAT)
+    assert (layout.timestamp_offset, layout.commit_offset, layout.commit_size) == (0, 8, 8)
+    assert (layout.data_offset, layout.page_size) == (16, PAGE_SIZE)
+    assert (layout.type_offset, layout.pid_offset) == (0, 4)
+
+
+def test_decode_pages():
+    layout = ringbuffer.PageLayout(HEADER_PAGE, FORMAT)
+    data = _page(1000, [
+        _event(0, 1500, 10),
+        _event(5, 1501, 11),
+        _time_extend(1 << 30),
+        _event(1, 1500, 10),
+        # padding with a length, skipped
+        struct.pack("<II", (3 << 5) | 29, 8) + b"\0" * 4,
+        _event(2, 7, 12),
+    ], lost=42)
+    data += _page(5000, [_event(0, 1501, 13), struct.pack("<I", 29)])
+    # the last page is still being written, it is left out
+    data += _page(9000, [_event(0, 1500, 10)])[:100]
+
+    timestamps, types, pids, lost = ringbuffer.decode_pages(data, layout)
+    assert timestamps.tolist() == [1000, 1005, 1005 + (1 << 30) + 1, 1005 + (1 << 30) + 3, 5000]
+    assert types.tolist() == [1500, 1501, 1500, 7, 1501]
+    assert pids.tolist() == [10, 11, 10, 12, 13]
+    assert lost == 42
+
+
+def test_read_capture(tmp_path):
+    (tmp_path / ringbuffer.HEADER_PAGE_FNAME).write_text(HEADER_PAGE)
+    (tmp_path / ringbuffer.FORMAT_FNAME).write_text(FORMAT)
+    (tmp_path / ringbuffer.EVENT_IDS_FNAME).write_text(EVENT_IDS)
+    (tmp_path / ringbuffer.SAVED_CMDLINES_FNAME).write_text("10 app.organicmaps\n11 RenderThread\n")
+    ts = 4423_725704_000
+    (tmp_path / "raw_cpu0.bin").write_bytes(_page(ts, [_event(0, 1500, 10), _time_extend(200_000_000), _event(0, 1501, 12)]))
+    # an event that isn't ours on cpu1 is dropped
+    (tmp_path / "raw_cpu1.bin").write_bytes(_page(ts + 100_000_000, [_event(0, 1501, 11), _event(1, 9, 11)], lost=3))
+
+    trace = ringbuffer.read_capture(tmp_path)
+    assert [trace.comms[c] for c in trace.comm.tolist()] == ["app.organicmaps-10", "RenderThread-11", "<...>-12"]
+    assert trace.offset.tolist() == [0x1d96b0, 0xa4610, 0xa4610]
+    assert trace.relative_time().tolist() == pytest.approx([0.0, 0.1, 0.2])
+    assert trace.lost_events == 3
+
+    hits = trace.to_hit_records([("0x1d96b0", True), ("0xa4610", False)])
+    assert hits.probe.tolist() == [0, 1, 1]
+
+
+def test_read_capture_empty(tmp_path):
+    (tmp_path / ringbuffer.HEADER_PAGE_FNAME).write_text(HEADER_PAGE)
+    (tmp_path / ringbuffer.FORMAT_FNAME).write_text(FORMAT)
+    (tmp_path / ringbuffer.EVENT_IDS_FNAME).write_text(EVENT_IDS)
+    (tmp_path / ringbuffer.SAVED_CMDLINES_FNAME).write_text("")
+    trace = ringbuffer.read_capture(tmp_path)
+    assert len(trace) == 0
+    assert trace.time.dtype == np.float64
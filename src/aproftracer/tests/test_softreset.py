@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from aproftracer import softreset
+
+GROUP = "sonoftroya"
+APP = "com.example.app"
+PROCESSES = ["tracepoints.sh", "tracer.bin", "trace_pipe"]
+
+
+def _sh(script, env=None):
+    return subprocess.run(["sh", "-c", script], capture_output=True, text=True, timeout=30, env=env).stdout
+
+
+@pytest.fixture
+def shims(tmp_path):
+    """env whose PATH starts with pkill and am that only record their arguments in the returned log"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    calls = tmp_path / "calls"
+    for name in ("pkill", "am"):
+        shim = bin_dir / name
+        shim.write_text(f"#!/bin/sh\necho \"{name} $*\" >> {calls}\n")
+        shim.chmod(0o755)
+    return {**os.environ, "PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}"}, calls
+
+
+def _dirty_tracefs(tmp_path):
+    tracing = tmp_path / "tracing"
+    (tracing / "events" / GROUP / "event0x1000").mkdir(parents=True)
+    (tracing / "events" / GROUP / "event0x1000" / "trigger").write_text(f"disable_event:{GROUP}:event0x1000 if common_pid >= 0\n")
+    (tracing / "events" / "enable").write_text("1\n")
+    (tracing / "tracing_on").write_text("1\n")
+    (tracing / "uprobe_events").write_text(f"p:{GROUP}/event0x1000 /data/app/base.odex:0x1000\n")
+    (tracing / "trace").write_text("# tracer: nop\n#\n  com.example-123 [000] d.... 12.5: event0x1000: (0x7000)\n")
+    return tracing
+
+
+def test_state_of_a_dirty_tracefs(tmp_path):
+    tracing = _dirty_tracefs(tmp_path)
+    state = softreset.parse_state(_sh(softreset.state_script(GROUP, APP, PROCESSES, tracing_dir=tracing)))
+    assert state == {"tracing_on": 1, "uprobes": 1, "group": 1, "trace_entries": 1, "processes": 0, "app": 0}
+    assert softreset.dirty(state) == ["tracing_on=1", "uprobes=1", "group=1", "trace_entries=1"]
+
+
+def test_reset_cleans_up(tmp_path, shims):
+    env, calls = shims
+    tracing = _dirty_tracefs(tmp_path)
+    # what the real pkill would kill, the shim must leave it alone
+    reader = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)", "/sys/kernel/tracing/trace_pipe"])
+    try:
+        before = softreset.parse_state(_sh(softreset.state_script(GROUP, APP, PROCESSES, tracing_dir=tracing)))
+        assert before["processes"] >= 1
+        _sh(softreset.reset_script(GROUP, APP, PROCESSES, tracing_dir=tracing), env=env)
+        assert reader.poll() is None
+    finally:
+        reader.kill()
+        reader.wait()
+    assert calls.read_text().splitlines() == [
+            f"am force-stop {APP}",
+            "pkill -9 -f [t]racepoints[.]sh|[t]racer[.]bin|[t]race_pipe",
+        ]
+    assert (tracing / "tracing_on").read_text().strip() == "0"
+    assert (tracing / "events" / "enable").read_text().strip() == "0"
+    assert (tracing / "events" / GROUP / "event0x1000" / "trigger").read_text().strip() == f"!disable_event:{GROUP}:event0x1000"
+    assert (tracing / "uprobe_events").read_text().strip() == ""
+    # the kernel removes the group with its last probe, here it is just a directory
+    state = softreset.parse_state(_sh(softreset.state_script(GROUP, APP, PROCESSES, tracing_dir=tracing)))
+    assert softreset.dirty(state) == ["group=1"]
+
+
+def test_scripts_dont_match_themselves():
+    for script in (softreset.reset_script(GROUP, APP, PROCESSES), softreset.state_script(GROUP, APP, PROCESSES)):
+        assert "'" not in script
+        pattern = re.search(r'-f "([^"]+)"', script).group(1)
+        assert re.search(pattern, script) is None
+        for name in PROCESSES:
+            assert re.search(pattern, f"sh /data/local/tmp/tracer/{APP}/{name}")
+
+
+def test_parse_and_dirty():
+    assert softreset.parse_state("tracing_on=0\ngarbage\napp=\nuprobes=x\nother=3\n") == {"tracing_on": 0}
+    clean = dict.fromkeys(softreset.STATE_KEYS, 0)
+    assert softreset.dirty(clean) == []
+    assert softreset.dirty({**clean, "uprobes": 12}) == ["uprobes=12"]
+    del clean["app"]
+    assert softreset.dirty(clean) == ["app unknown"]
+
+
+def test_count_apps_since_boot(tmp_path):
+    boot_id = tmp_path / "boot_id"
+    counter = tmp_path / "apps_since_boot"
+    boot_id.write_text("first-boot\n")
+    script = softreset.count_app_script(counter, boot_id=boot_id)
+    assert [_sh(script).strip() for _ in range(3)] == ["1", "2", "3"]
+    boot_id.write_text("second-boot\n")
+    assert _sh(script).strip() == "1"
@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import asyncio
+import sys
+import time
+
+import pytest
+
+from aproftracer import supervisor
+
+
+def _script(code):
+    return [sys.executable, "-u", "-c", code]
+
+
+READY_THEN_WAIT = _script("import time; print('setting up'); print('ready'); time.sleep(30)")
+
+
+@pytest.fixture
+def sup():
+    sup = supervisor.Supervisor()
+    yield sup
+    sup.stop()
+
+
+def test_expect_before_start_sees_the_line(sup):
+    lines = []
+    proc = supervisor.Proc(READY_THEN_WAIT, lines.append)
+    ready = sup.call(proc.expect, lambda line: "ready" in line)
+    sup.run(proc.start())
+    start = time.monotonic()
+    assert sup.run(asyncio.wait_for(ready, 10)) == "ready\n"
+    assert time.monotonic() - start < 5
+    assert lines == ["setting up\n", "ready\n"]
+    sup.run(proc.kill())
+    assert proc.exited
+
+
+def test_line_is_none_if_the_process_exits_first(sup):
+    proc = sup.spawn(_script("import sys; print('oops'); sys.exit(3)"))
+    assert sup.run(proc.line(lambda line: "ready" in line, timeout=10)) is None
+    assert proc.returncode == 3
+    # and right away once it is gone
+    assert sup.run(proc.line(lambda line: True, timeout=10)) is None
+
+
+def test_line_times_out(sup):
+    proc = sup.spawn(READY_THEN_WAIT)
+    with pytest.raises(asyncio.TimeoutError):
+        sup.run(proc.line(lambda line: "never" in line, timeout=0.2))
+    assert not proc.exited
+    sup.run(proc.kill())
+
+
+def test_run_for_full_runtime(sup):
+    proc = sup.spawn(READY_THEN_WAIT)
+    assert sup.run(proc.run_for(0.3)) is False
+    sup.run(proc.kill())
+
+
+def test_run_for_stops_on_exit_and_stop_line(sup):
+    start = time.monotonic()
+    proc = sup.spawn(_script("print('done')"))
+    assert sup.run(proc.run_for(30)) is True
+    proc = sup.spawn(_script("import time; print('Events injected: 10'); time.sleep(30)"))
+    assert sup.run(proc.run_for(30, lambda line: "Events injected" in line)) is True
+    assert time.monotonic() - start < 10
+    sup.run(proc.kill())
+
+
+def test_kill_takes_children_along(sup):
+    proc = sup.spawn(_script(
+        "import subprocess, sys, time;"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)']);"
+        "print(child.pid); time.sleep(30)"))
+    pid = int(sup.run(proc.line(lambda line: line.strip().isdigit(), timeout=10)))
+    assert sup.run(proc.kill()) != 0
+    for _ in range(50):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                if f.read().split()[2] == "Z":
+                    break
+        except FileNotFoundError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("child survived the kill")
+
+
+def test_broken_callback_keeps_reading(sup):
+    def on_line(line):
+        raise ValueError(line)
+
+    proc = sup.spawn(READY_THEN_WAIT, on_line)
+    assert sup.run(proc.line(lambda line: "ready" in line, timeout=10)) == "ready\n"
+    sup.run(proc.kill())
+
+
+def test_many_processes_on_one_loop():
+    async def run_all():
+        procs = [supervisor.Proc(_script(f"print('ready {i}')")) for i in range(20)]
+        # expected before the start, a process may be done before the last one is started
+        ready = [p.expect(lambda line: "ready" in line) for p in procs]
+        for p in procs:
+            await p.start()
+        lines = await asyncio.wait_for(asyncio.gather(*ready), 10)
+        await asyncio.gather(*(p.wait() for p in procs))
+        return lines
+
+    assert sorted(asyncio.run(run_all())) == sorted(f"ready {i}\n" for i in range(20))
+
+
+def test_run_from_callback_refuses(sup):
+    errors = []
+
+    def on_line(line):
+        try:
+            sup.run(asyncio.sleep(0))
+        except RuntimeError as e:
+            errors.append(e)
+
+    proc = sup.spawn(_script("print('hi')"), on_line)
+    sup.run(proc.wait(timeout=10))
+    assert len(errors) == 1
@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+from aproftracer import rawtrace, tracestream
+
+LINES = (
+    "   app.organicmaps-24536   [002] .....  4423.725704: event0x1d96b0: (0x6e16e3e6b0)\n"
+    "CPU:2 [LOST 123 EVENTS]\n"
+    "AsyncTask #2-10249 [005] d..3. 4423.825704: event0xa4610: (0x767e1bc610)\n"
+)
+
+
+def test_stream(tmp_path):
+    # the second half comes in late and without a newline at the end, then the reader waits like cat would
+    script = f"printf '{LINES}'; sleep 0.3; printf '{LINES.rstrip()}'; exec sleep 60"
+    checkpoint = tmp_path / "raw_output.txt"
+    stream = tracestream.TraceStream(["sh", "-c", script], checkpoint, max_restarts=0)
+    stream.start()
+    trace = stream.stop(idle=0.6, timeout=10)
+
+    assert checkpoint.read_text() == LINES + LINES.rstrip()
+    expected = rawtrace.read_raw_trace(checkpoint)
+    assert trace.to_hit_uprobes() == expected.to_hit_uprobes()
+    assert len(trace) == 4
+    assert trace.lost_events == 246
+
+
+def test_stream_restarts(tmp_path):
+    # the reader exits right away every time, like adb dropping out
+    checkpoint = tmp_path / "raw_output.txt"
+    stream = tracestream.TraceStream(["sh", "-c", f"printf '{LINES}'"], checkpoint, max_restarts=1)
+    stream.start()
+    stream._thread.join(timeout=10)
+    trace = stream.stop(idle=0)
+
+    assert checkpoint.read_text() == LINES * 2
+    assert len(trace) == 4
+
+
+def test_take_new_probes(tmp_path):
+    stream = tracestream.TraceStream(["true"], tmp_path / "raw_output.txt")
+    stream._checkpoint = open(tmp_path / "raw_output.txt", "wb")  # noqa: SIM115
+    stream._ingest(LINES.encode())
+    assert sorted(stream.take_new_probes()) == [0xa4610, 0x1d96b0]
+    assert stream.take_new_probes() == []
+    # hit again, nothing new
+    stream._ingest(LINES.encode())
+    assert stream.take_new_probes() == []
+    stream._checkpoint.close()
@@ -0,0 +1,79 @@
+# SPDX-FileCopyrightText: 2024-present Jakob <git@themoep.at>
+#
+# SPDX-License-Identifier: MIT
+import subprocess
+
+import pytest
+
+from aproftracer import uprobes
+
+ODEX = "/data/app/~~abc==/org.example-1/oat/x86_64/base.odex"
+
+
+def _definitions(n):
+    return [uprobes.probe_definition("sonoftroya", hex(0x1000 + 4 * i), ODEX) for i in range(n)]
+
+
+def test_probe_definition():
+    assert uprobes.probe_definition("sonoftroya", "0x1d96b0", ODEX) == f"p:sonoftroya/event0x1d96b0 {ODEX}:0x1d96b0"
+
+
+def test_pack_definitions():
+    definitions = _definitions(3000)
+    packed = uprobes.pack_definitions(definitions, block_size=4096)
+    # every block ends on a line boundary, so no definition is split between two writes
+    for start in range(0, len(packed), 4096):
+        assert packed[start:start + 4096].endswith(b"\n")
+    assert [line for line in packed.decode().split("\n") if line] == definitions
+    assert uprobes.num_blocks(len(packed), 4096) == -(-len(packed) // 4096)
+
+    with pytest.raises(NotImplementedError):
+        uprobes.pack_definitions(["p:g/e /" + "a" * 5000 + ":0x1"])
+
+
+def test_register_script(tmp_path):
+    # a regular file stands in for uprobe_events, dd appends one block per write to it
+    definitions = _definitions(3000)
+    packed = uprobes.pack_definitions(definitions, block_size=4096)
+    (tmp_path / "uprobes.txt").write_bytes(packed)
+    events = tmp_path / "uprobe_events"
+    events.write_text("")
+    blocks = uprobes.num_blocks(len(packed), 4096)
+    script = uprobes.register_script(tmp_path / "uprobes.txt", blocks, block_size=4096, events_path=events)
+    out = subprocess.run(["sh", "-c", script], capture_output=True, text=True, check=True).stdout
+    assert out.splitlines()[-1] == f"registered block {blocks}/{blocks}"
+    assert [line for line in events.read_text().split("\n") if line] == definitions
+
+
+def test_first_hit_triggers_script(tmp_path):
+    # directories stand in for the events of the group
+    for name in ("event0x1000", "event0x1004"):
+        (tmp_path / "sonoftroya" / name).mkdir(parents=True)
+    script = uprobes.first_hit_triggers_script("sonoftroya", events_dir=tmp_path, log_prefix="[t] ")
+    out = subprocess.run(["sh", "-c", script], capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["[t]", "2", "first", "hit", "triggers", "set", "up"]
+    trigger = (tmp_path / "sonoftroya" / "event0x1004" / "trigger").read_text()
+    assert trigger == "disable_event:sonoftroya:event0x1004 if common_pid >= 0\n"
+
+
+def test_disable_events_script(tmp_path):
+    for name in ("event0x1000", "event0x1004", "event0x1008"):
+        (tmp_path / "sonoftroya" / name).mkdir(parents=True)
+        (tmp_path / "sonoftroya" / name / "enable").write_text("1\n")
+    script = uprobes.disable_events_script("sonoftroya", ["0x1000", "0x1008"], events_dir=tmp_path)
+    subprocess.run(["sh", "-c", script], check=True)
+    enabled = {name: (tmp_path / "sonoftroya" / name / "enable").read_text() for name in ("event0x1000", "event0x1004", "event0x1008")}
+    assert enabled == {"event0x1000": "0\n", "event0x1004": "1\n", "event0x1008": "0\n"}
+
+
+def test_read_uprobe_profile(tmp_path):
+    odex = "/data/app/~~abc==/org.example-1/oat/x86_64/base.odex"
+    path = tmp_path / "uprobe_profile.txt"
+    path.write_text(
+        f"  {odex} event0x1d96b0                                            12\n"
+        f"  {odex} event0xa4610                                              0\n"
+        f"  /system/lib64/libc.so event0x1000                                7\n"
+        f"  {odex} other_probe                                               3\n"
+    )
+    assert uprobes.read_uprobe_profile(path, odex) == {0x1d96b0: 12, 0xa4610: 0}
+    assert uprobes.read_uprobe_profile(path) == {0x1d96b0: 12, 0xa4610: 0, 0x1000: 7}